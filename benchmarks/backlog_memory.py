@@ -0,0 +1,134 @@
+"""
+Backlog memory benchmark.
+
+Fills the backlogs of a set of subscribers that are all offline, every message being published to each of
+them, and reports with tracemalloc the memory held per queued message. The original design (plain message
+dicts) and the first envelopes (string ids and ISO timestamps, topics not interned) are stored in
+OrderedDict backlogs as the previous SubscriberQueue did, the current compact envelopes in SubscriberQueue.
+
+Usage: PYTHONPATH=src python benchmarks/backlog_memory.py [--messages 100000] [--subscribers 10]
+"""
+
+import argparse
+from collections import OrderedDict
+import gc
+import json
+import tracemalloc
+import uuid
+from datetime import (
+    datetime,
+    timezone,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Tuple,
+)
+from manager.envelope import Envelope
+from manager.subscriber_queue import SubscriberQueue
+
+
+class StringEnvelope:
+    """Layout of the first envelopes: id and timestamp as strings, topic not interned."""
+
+    __slots__ = ("id", "topic", "timestamp", "body")
+
+    def __init__(
+        self, message_id: str, topic: str, timestamp: str, body: bytes
+    ) -> None:
+        self.id = message_id
+        self.topic = topic
+        self.timestamp = timestamp
+        self.body = body
+
+
+def as_dict(topic: str, message: Dict[str, Any]) -> Tuple[Any, int]:
+    message["topic"] = topic
+    message["message_timestamp_utc"] = datetime.now(timezone.utc).isoformat()
+    return message, len(json.dumps(message))
+
+
+def as_string_envelope(topic: str, message: Dict[str, Any]) -> Tuple[Any, int]:
+    timestamp = datetime.now(timezone.utc).isoformat()
+    body = json.dumps(
+        {**message, "topic": topic, "message_timestamp_utc": timestamp},
+        separators=(",", ":"),
+    ).encode()
+    return StringEnvelope(uuid.uuid4().hex, topic, timestamp, body), len(body)
+
+
+def as_envelope(topic: str, message: Dict[str, Any]) -> Tuple[Any, int]:
+    envelope = Envelope.create(topic, message)
+    return envelope, len(envelope.body)
+
+
+class OrderedDictBacklog:
+    """Backlog layout of the previous SubscriberQueue, entries kept in an OrderedDict keyed by sequence number."""
+
+    def __init__(self, name: str) -> None:
+        self._entries: OrderedDict[int, Tuple[Any, int]] = OrderedDict()
+        self._last_seq = 0
+
+    def append(self, message: Any, size: int) -> int:
+        self._last_seq += 1
+        self._entries[self._last_seq] = (message, size)
+        return self._last_seq
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def measure(
+    seal: Callable[[str, Dict[str, Any]], Tuple[Any, int]],
+    create_backlog: Callable[[str], Any],
+    messages: int,
+    subscribers: List[str],
+) -> None:
+    gc.collect()
+    tracemalloc.start()
+    backlogs = [create_backlog(subscriber) for subscriber in subscribers]
+    for i in range(messages):
+        # topics arrive as a fresh string with every request
+        topic = "".join(["orders.", "created"])
+        message, size = seal(topic, {"message": f"order {i} was created"})
+        for backlog in backlogs:
+            backlog.append(message, size)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queued = sum(len(backlog) for backlog in backlogs)
+    print(
+        f"  {current / 2**20:10.1f} MiB  {current / messages:8.1f} bytes/message  "
+        f"{current / queued:8.1f} bytes/queued message"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--subscribers", type=int, default=10)
+    args = parser.parse_args()
+
+    subscribers = [f"http://localhost:9000/{i}" for i in range(args.subscribers)]
+    for name, seal, create_backlog in (
+        ("message dicts, OrderedDict backlogs", as_dict, OrderedDictBacklog),
+        (
+            "string envelopes, OrderedDict backlogs",
+            as_string_envelope,
+            OrderedDictBacklog,
+        ),
+        ("compact envelopes, SubscriberQueue", as_envelope, SubscriberQueue),
+    ):
+        print(f"{name} ({args.messages} messages, {args.subscribers} subscribers)")
+        measure(
+            seal,
+            lambda subscriber: create_backlog(name=subscriber),
+            args.messages,
+            subscribers,
+        )
+
+
+if __name__ == "__main__":
+    main()
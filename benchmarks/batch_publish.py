@@ -0,0 +1,80 @@
+"""
+Batch publish benchmark.
+
+Publishes the same messages through the HTTP layer once with one POST /publish/<topic> per message and once
+with batches POSTed to /publish, and reports the server side cost per message. Webhook delivery is simulated as
+instant so only routing, JSON handling, subscriber lookup, queueing and bookkeeping are measured.
+
+Usage: PYTHONPATH=src python benchmarks/batch_publish.py [--messages 5000] [--batch 100] [--subscribers 4]
+"""
+
+import argparse
+import logging
+import time
+from typing import (
+    List,
+    Sequence,
+    Tuple,
+)
+from manager.delivery_engine import (
+    DeliveryResult,
+    Payload,
+)
+from manager.message_broker import MessageBroker
+import main as server
+
+
+class InstantDeliveryEngine:
+    def deliver_many(
+        self, deliveries: Sequence[Tuple[str, Payload]]
+    ) -> List[DeliveryResult]:
+        return [
+            DeliveryResult(subscriber=subscriber, delivered=True)
+            for subscriber, _ in deliveries
+        ]
+
+    def shutdown(self) -> None:
+        pass
+
+
+def report(name: str, messages: int, elapsed: float) -> None:
+    print(
+        f"{name:>20}: {elapsed:6.2f}s  {elapsed / messages * 1e6:8.1f} us/message  "
+        f"{messages / elapsed:10.0f} messages/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--subscribers", type=int, default=4)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    server.message_broker = MessageBroker(delivery_engine=InstantDeliveryEngine())
+    topics = [f"benchmark.{i}" for i in range(10)]
+    for topic in topics:
+        for i in range(args.subscribers):
+            server.subscription_manager.subscribe(topic, f"http://localhost:9000/{i}")
+    client = server.app.test_client()
+
+    start = time.perf_counter()
+    for i in range(args.messages):
+        client.post(f"/publish/{topics[i % len(topics)]}", json={"message": i})
+    report("single publishes", args.messages, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for offset in range(0, args.messages, args.batch):
+        client.post(
+            "/publish",
+            json=[
+                {"topic": topics[i % len(topics)], "message": {"message": i}}
+                for i in range(offset, min(offset + args.batch, args.messages))
+            ],
+        )
+    report(f"batches of {args.batch}", args.messages, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
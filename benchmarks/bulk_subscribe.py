@@ -0,0 +1,112 @@
+"""
+Bulk subscribe benchmark.
+
+Validates the urls of a provisioning job with the previous Validation.isValidUrl (pattern compiled on every
+call, full validators check for anything not on localhost), with the precompiled checks alone and with the
+cache in front of them, then subscribes them through the HTTP layer once with one POST /subscribe/<topic>
+per subscription and once with batches POSTed to /subscribe.
+
+Usage: PYTHONPATH=src python benchmarks/bulk_subscribe.py [--subscriptions 20000] [--batch 1000] [--rounds 3]
+"""
+
+import argparse
+import logging
+import re
+import time
+from typing import (
+    Callable,
+    List,
+)
+from validators.url import url as isNormalURL
+from manager.subscription_manager import SubscriptionManager
+from utils.validation import (
+    Validation,
+    _is_valid_url,
+)
+import main as server
+
+
+def previous_is_valid_url(url: str) -> bool:
+    if not url:
+        return False
+    pattern = re.compile("^https?://localhost(:[0-9]+)?(/.*)?$")
+    try:
+        if re.search(pattern, url) or isNormalURL(url):
+            return True
+    except:  # noqa
+        pass
+    return False
+
+
+def report(name: str, count: int, elapsed: float, unit: str) -> None:
+    print(
+        f"{name:>28}: {elapsed:6.2f}s  {elapsed / count * 1e6:8.1f} us/{unit}  "
+        f"{count / elapsed:10.0f} {unit}s/s"
+    )
+
+
+def measure_validation(
+    name: str, is_valid_url: Callable[[str], bool], urls: List[str], rounds: int
+) -> None:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for url in urls:
+            is_valid_url(url)
+    report(name, len(urls) * rounds, time.perf_counter() - start, "url")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--subscriptions", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    # mostly public endpoints, a few invalid ones, as a provisioning job would send them again and again
+    urls = [
+        (
+            f"https://hooks{i % 50}.example.com/tenant/{i}"
+            if i % 20
+            else f"htps:/hooks.example.com/{i}"
+        )
+        for i in range(args.subscriptions)
+    ]
+    measure_validation("previous isValidUrl", previous_is_valid_url, urls, args.rounds)
+    measure_validation(
+        "precompiled, uncached", _is_valid_url.__wrapped__, urls, args.rounds
+    )
+    _is_valid_url.cache_clear()
+    measure_validation("precompiled, cached", Validation.isValidUrl, urls, args.rounds)
+
+    valid = [url for url in urls if Validation.isValidUrl(url)]
+    topics = [f"tenants.{i % 100}.#" for i in range(len(valid))]
+
+    server.subscription_manager = SubscriptionManager()
+    client = server.app.test_client()
+    start = time.perf_counter()
+    for topic, url in zip(topics, valid):
+        client.post(f"/subscribe/{topic.replace('#', '%23')}", json={"url": url})
+    report("single subscribes", len(valid), time.perf_counter() - start, "subscription")
+
+    server.subscription_manager = SubscriptionManager()
+    start = time.perf_counter()
+    for offset in range(0, len(valid), args.batch):
+        end = offset + args.batch
+        client.post(
+            "/subscribe",
+            json=[
+                {"topic": topic, "url": url}
+                for topic, url in zip(topics[offset:end], valid[offset:end])
+            ],
+        )
+    report(
+        f"batches of {args.batch}",
+        len(valid),
+        time.perf_counter() - start,
+        "subscription",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Fan-out encoding benchmark for the publish path.
+
+Measures the cost of turning one published message into the request bodies of its subscribers, comparing the
+previous design (the message dict is JSON encoded again by the HTTP client for every subscriber) with an
+Envelope encoded once and posted as is.
+
+Usage: PYTHONPATH=src python benchmarks/fan_out_encoding.py [--subscribers 1000] [--publishes 200]
+"""
+
+import argparse
+import json
+import time
+from datetime import (
+    datetime,
+    timezone,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+)
+from manager.envelope import Envelope
+
+
+def encode_per_subscriber(
+    message: Dict[str, Any], subscribers: List[str]
+) -> List[bytes]:
+    message["topic"] = "benchmark"
+    message["message_timestamp_utc"] = datetime.now(timezone.utc).isoformat()
+    return [json.dumps(message).encode() for _ in subscribers]
+
+
+def encode_once(message: Dict[str, Any], subscribers: List[str]) -> List[bytes]:
+    envelope = Envelope.create("benchmark", message)
+    return [envelope.body for _ in subscribers]
+
+
+def measure_publish(
+    encode: Callable[[Dict[str, Any], List[str]], List[bytes]],
+    message: Dict[str, Any],
+    subscribers: List[str],
+    publishes: int,
+) -> None:
+    start = time.perf_counter()
+    for _ in range(publishes):
+        encode(dict(message), subscribers)
+    elapsed = time.perf_counter() - start
+    print(
+        f"  {elapsed / publishes * 1e3:10.3f} ms/publish  "
+        f"{elapsed / publishes / len(subscribers) * 1e6:8.3f} us/delivery"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--subscribers", type=int, default=1_000)
+    parser.add_argument("--publishes", type=int, default=200)
+    args = parser.parse_args()
+
+    subscribers = [f"http://localhost:9000/{i}" for i in range(args.subscribers)]
+    message = {"message": "x" * 512, "order": {"id": 42, "items": list(range(20))}}
+
+    for name, encode in (
+        ("encoded per subscriber", encode_per_subscriber),
+        ("encoded once", encode_once),
+    ):
+        print(f"{name} ({args.subscribers} subscribers)")
+        measure_publish(encode, message, subscribers, args.publishes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Journal recovery benchmark.
+
+Queues a large backlog through a journaled MessageBroker, takes a checkpoint, appends a tail of further
+enqueues and acks, then measures how long a fresh broker takes to rebuild its backlogs from the snapshot and
+the tail of the log.
+
+Usage: PYTHONPATH=src python benchmarks/journal_recovery.py [--messages 1000000] [--subscribers 100]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from manager.envelope import Envelope
+from manager.journal import Journal
+from manager.message_broker import MessageBroker
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument(
+        "--tail", type=float, default=0.1, help="share of messages after the checkpoint"
+    )
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    subscribers = [f"http://localhost:9000/{i}" for i in range(args.subscribers)]
+    message = Envelope.create("benchmark", {"message": "x" * 64})
+    tail = int(args.messages * args.tail)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        journal = Journal(data_dir=data_dir)
+        message_broker = MessageBroker(journal=journal)
+
+        start = time.monotonic()
+        for i in range(args.messages - tail):
+            message_broker._get_queue(subscribers[i % len(subscribers)]).append(
+                message, 100
+            )
+        journal.sync()
+        elapsed = time.monotonic() - start
+        print(f"enqueued {args.messages - tail} messages in {elapsed:.2f}s")
+
+        start = time.monotonic()
+        journal.checkpoint(message_broker.snapshot_records())
+        print(f"checkpoint written in {time.monotonic() - start:.2f}s")
+
+        for i in range(tail):
+            subscriber_queue = message_broker._get_queue(
+                subscribers[i % len(subscribers)]
+            )
+            subscriber_queue.append(message, 100)
+            if i % 2:
+                subscriber_queue.popleft()
+        journal.close()
+        print(f"journal size on disk: {directory_size(data_dir) / 2**20:.1f} MiB")
+
+        start = time.monotonic()
+        journal = Journal(data_dir=data_dir)
+        recovered_broker = MessageBroker(journal=journal)
+        records = 0
+        for record in journal.replay():
+            recovered_broker.restore(record)
+            records += 1
+        elapsed = time.monotonic() - start
+        journal.close()
+
+        queued = sum(len(queue) for queue in recovered_broker._messages_map.values())
+        print(
+            f"recovered {queued} queued messages from {records} records in {elapsed:.2f}s "
+            f"({records / elapsed:.0f} records/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
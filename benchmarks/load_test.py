@@ -0,0 +1,370 @@
+"""
+Load test harness.
+
+Starts the server in a subprocess (the Flask or the asyncio app) and a fleet of local stand-in subscribers
+in another: fast ones answer straight away, slow ones after a delay, flaky ones fail a share of their
+deliveries with a 503 and dead ones refuse connections. It then drives subscribe, publish and poll
+workloads at a set concurrency and reports, per workload, the throughput, p50/p99 latency and status codes,
+the growth of the server's resident memory, the backlog depths read from /metrics and the webhooks the
+fleet received. Everything runs on localhost, no network access needed. Linux only, memory is read from
+/proc.
+
+Usage: PYTHONPATH=src python benchmarks/load_test.py [--server async] [--requests 2000] [--concurrency 32]
+    [--fast 20] [--slow 5] [--flaky 5] [--dead 5] [--workloads subscribe,publish,poll]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+from aiohttp import web
+import aiohttp
+
+SRC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"
+)
+KINDS = ("fast", "slow", "flaky", "dead")
+QUEUE_MESSAGES = re.compile(
+    r'^leafi_queue_messages\{subscriber="([^"]*)"\} (\S+)$', re.M
+)
+
+# method, path and JSON body of a request
+Request = Tuple[str, str, Optional[Any]]
+
+
+class PhaseResult(NamedTuple):
+    requests: int
+    elapsed: float
+    latencies: List[float]
+    statuses: Dict[Any, int]
+
+
+def free_port() -> int:
+    """
+    A port nothing listens on, also used as the address of dead subscribers.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_fleet(port: int, slow_delay: float, flaky_rate: float, seed: int) -> None:
+    """
+    Stand-in subscribers, all served by one aiohttp app on their own process: /fast/<i>, /slow/<i> and
+    /flaky/<i> accept webhooks, /stats reports what they received.
+    """
+    received: Counter = Counter()
+    rng = random.Random(seed)
+
+    async def hook(request: web.Request) -> web.Response:
+        kind = request.match_info["kind"]
+        await request.read()
+        if kind == "slow":
+            await asyncio.sleep(slow_delay)
+        elif kind == "flaky" and rng.random() < flaky_rate:
+            received["flaky_failed"] += 1
+            return web.Response(status=503)
+        received[kind] += 1
+        return web.Response(status=200)
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(dict(received))
+
+    app = web.Application()
+    app.router.add_get("/stats", stats)
+    app.router.add_post("/{kind}/{index}", hook)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def start_server(kind: str, port: int, log_path: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.setdefault("LEAFI_LOG_LEVEL", "WARNING")
+    env["PYTHONPATH"] = SRC_DIR
+    if kind == "async":
+        env["LEAFI_SERVER_HOST"] = "127.0.0.1"
+        env["LEAFI_SERVER_PORT"] = str(port)
+        command = [sys.executable, os.path.join(SRC_DIR, "async_main.py")]
+    else:
+        env["FLASK_APP"] = os.path.join(SRC_DIR, "main.py")
+        command = [
+            sys.executable,
+            "-m",
+            "flask",
+            "run",
+            "--port",
+            str(port),
+            "--with-threads",
+        ]
+    with open(log_path, "wb") as log:
+        return subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_until_up(
+    session: aiohttp.ClientSession, url: str, timeout: float = 20
+) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(url) as response:
+                if response.status < 500:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{url} did not come up within {timeout}s")
+        await asyncio.sleep(0.1)
+
+
+def resident_memory(pid: int) -> int:
+    """
+    Resident set size of a process in bytes.
+    """
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+async def drive(
+    session: aiohttp.ClientSession,
+    base_url: str,
+    count: int,
+    concurrency: int,
+    request: Callable[[int], Request],
+) -> PhaseResult:
+    """
+    Send count requests with at most concurrency of them in flight, request(i) builds the i-th one.
+    """
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    indexes = iter(range(count))
+
+    async def worker() -> None:
+        # the iterator is shared, every request is sent once by whichever worker is free
+        for i in indexes:
+            method, path, body = request(i)
+            start = time.perf_counter()
+            try:
+                async with session.request(
+                    method, base_url + path, json=body
+                ) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return PhaseResult(count, time.perf_counter() - start, latencies, dict(statuses))
+
+
+async def queue_depths(
+    session: aiohttp.ClientSession, base_url: str
+) -> Dict[str, Tuple[int, int]]:
+    """
+    (total, largest) backlog depth per kind of subscriber, read from /metrics.
+    """
+    async with session.get(base_url + "/metrics") as response:
+        text = await response.text()
+    depths: Dict[str, List[int]] = {kind: [] for kind in KINDS}
+    for subscriber, value in QUEUE_MESSAGES.findall(text):
+        kind = subscriber.rstrip("/").split("/")[-2]
+        if kind in depths:
+            depths[kind].append(int(float(value)))
+    return {
+        kind: (sum(values), max(values, default=0)) for kind, values in depths.items()
+    }
+
+
+async def fleet_stats(session: aiohttp.ClientSession, fleet_url: str) -> Dict[str, int]:
+    async with session.get(fleet_url + "/stats") as response:
+        return await response.json()
+
+
+def report(
+    name: str,
+    result: PhaseResult,
+    memory_before: int,
+    memory_after: int,
+    depths: Dict[str, Tuple[int, int]],
+    received: Dict[str, int],
+) -> None:
+    statuses = ", ".join(
+        f"{status}: {count}"
+        for status, count in sorted(result.statuses.items(), key=str)
+    )
+    print(
+        f"{name:>10}: {result.requests} requests in {result.elapsed:6.2f}s  "
+        f"{result.requests / result.elapsed:8.0f} req/s  "
+        f"p50 {percentile(result.latencies, 0.5) * 1000:7.1f} ms  "
+        f"p99 {percentile(result.latencies, 0.99) * 1000:7.1f} ms"
+    )
+    print(f"{'':>12}status codes: {statuses}")
+    print(
+        f"{'':>12}server memory: {memory_after / 2**20:.1f} MiB "
+        f"({(memory_after - memory_before) / 2**20:+.1f} MiB)"
+    )
+    print(
+        f"{'':>12}backlogs (total/largest): "
+        + ", ".join(
+            f"{kind} {total}/{largest}" for kind, (total, largest) in depths.items()
+        )
+    )
+    print(
+        f"{'':>12}webhooks received: "
+        + (
+            ", ".join(f"{kind} {count}" for kind, count in sorted(received.items()))
+            or "none"
+        )
+    )
+
+
+async def run(
+    args: argparse.Namespace,
+    server_pid: int,
+    base_url: str,
+    fleet_url: str,
+    dead_url: str,
+) -> None:
+    subscribers = [
+        f"{dead_url if kind == 'dead' else fleet_url}/{kind}/{i}"
+        for kind, count in zip(KINDS, (args.fast, args.slow, args.flaky, args.dead))
+        for i in range(count)
+    ]
+    # subscriber i is subscribed to topic i % topics, publishes go round robin over the topics
+    topics = [f"load.{i}" for i in range(args.topics)]
+    # polled by the subscribers that cannot take webhooks, or not all of them
+    pollers = [subscriber for subscriber in subscribers if "/fast/" not in subscriber]
+    message = {"message": "x" * args.message_bytes}
+    publish_query = "?async=true" if args.async_publish else ""
+
+    workloads: Dict[str, Tuple[int, Callable[[int], Request]]] = {
+        "subscribe": (
+            len(subscribers),
+            lambda i: (
+                "POST",
+                f"/subscribe/{topics[i % len(topics)]}",
+                {"url": subscribers[i]},
+            ),
+        ),
+        "publish": (
+            args.requests,
+            lambda i: (
+                "POST",
+                f"/publish/{topics[i % len(topics)]}{publish_query}",
+                message,
+            ),
+        ),
+        "poll": (
+            args.requests,
+            lambda i: ("GET", f"/poll/{pollers[i % len(pollers)]}?max=100", None),
+        ),
+    }
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await wait_until_up(session, base_url + "/")
+        await wait_until_up(session, fleet_url + "/stats")
+        print(
+            f"{args.server} server, {args.fast} fast, {args.slow} slow ({args.slow_delay}s), "
+            f"{args.flaky} flaky ({args.flaky_rate:.0%} failures) and {args.dead} dead subscribers "
+            f"over {args.topics} topics, concurrency {args.concurrency}"
+        )
+        for name in args.workloads.split(","):
+            if name not in workloads:
+                raise ValueError(
+                    f"Unknown workload {name}, one of {', '.join(workloads)}"
+                )
+            if name == "poll" and not pollers:
+                continue
+            count, request = workloads[name]
+            memory_before = resident_memory(server_pid)
+            result = await drive(session, base_url, count, args.concurrency, request)
+            report(
+                name,
+                result,
+                memory_before,
+                resident_memory(server_pid),
+                await queue_depths(session, base_url),
+                await fleet_stats(session, fleet_url),
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--server", choices=("async", "flask"), default="async")
+    parser.add_argument("--workloads", default="subscribe,publish,poll")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--topics", type=int, default=1)
+    parser.add_argument("--message-bytes", type=int, default=256)
+    parser.add_argument("--async-publish", action="store_true")
+    parser.add_argument("--fast", type=int, default=20)
+    parser.add_argument("--slow", type=int, default=5)
+    parser.add_argument("--slow-delay", type=float, default=0.2)
+    parser.add_argument("--flaky", type=int, default=5)
+    parser.add_argument("--flaky-rate", type=float, default=0.3)
+    parser.add_argument("--dead", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    server_port, fleet_port, dead_port = free_port(), free_port(), free_port()
+    fleet = multiprocessing.Process(
+        target=run_fleet,
+        args=(fleet_port, args.slow_delay, args.flaky_rate, args.seed),
+        daemon=True,
+    )
+    fleet.start()
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = os.path.join(directory, "server.log")
+        server = start_server(args.server, server_port, log_path)
+        try:
+            asyncio.run(
+                run(
+                    args,
+                    server.pid,
+                    f"http://127.0.0.1:{server_port}",
+                    f"http://127.0.0.1:{fleet_port}",
+                    f"http://127.0.0.1:{dead_port}",
+                )
+            )
+        except Exception:
+            with open(log_path) as log:
+                print(log.read()[-5000:], file=sys.stderr)
+            raise
+        finally:
+            server.terminate()
+            server.wait()
+            fleet.terminate()
+            fleet.join()
+
+
+if __name__ == "__main__":
+    main()
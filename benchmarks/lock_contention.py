@@ -0,0 +1,159 @@
+"""
+Lock contention benchmark for MessageBroker.
+
+Every publisher thread publishes to and polls from subscribers of its own, disjoint from those of the other
+threads, while the delivery engine simulates a webhook round trip. Backlog writes hold the queue lock for
+a simulated storage write, as a queue backed by a store does; the sleep releases the GIL like real I/O
+would. The same workload is run with per-subscriber locks (current broker) and with every queue sharing
+one lock (the previous global lock design), for an increasing number of threads.
+
+The speedup reported with the default --hold-ms comes from the simulated write, it is not a measurement of
+the in-memory broker. --hold-ms 0 runs the real in-memory publish and poll path without any simulated work:
+there the work under the lock is pure Python, holds the GIL, and both designs perform alike.
+
+Usage: PYTHONPATH=src python benchmarks/lock_contention.py [--duration 2] [--delivery-ms 1] [--hold-ms 0.2]
+"""
+
+import argparse
+import logging
+import time
+from threading import (
+    RLock,
+    Thread,
+)
+from typing import (
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from manager.delivery_engine import (
+    DeliveryResult,
+    Payload,
+)
+from manager.envelope import Envelope
+from manager.message_broker import MessageBroker
+from manager.subscriber_queue import (
+    QueueEntry,
+    SubscriberQueue,
+)
+
+
+class SimulatedDeliveryEngine:
+    def __init__(self, delivery_seconds: float) -> None:
+        self._delivery_seconds = delivery_seconds
+
+    def deliver_many(
+        self, deliveries: Sequence[Tuple[str, Payload]]
+    ) -> List[DeliveryResult]:
+        if self._delivery_seconds:
+            time.sleep(self._delivery_seconds)
+        # every other delivery fails so both the ack and the poll paths are exercised
+        return [
+            DeliveryResult(subscriber=subscriber, delivered=i % 2 == 0)
+            for i, (subscriber, _) in enumerate(deliveries)
+        ]
+
+    def shutdown(self) -> None:
+        pass
+
+
+class StorageQueue(SubscriberQueue):
+    """Queue holding its lock for a simulated storage write on every change."""
+
+    def __init__(self, hold_seconds: float, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._hold_seconds = hold_seconds
+
+    def append(self, message: Envelope, size: int = 0) -> Optional[int]:
+        with self.lock:
+            if self._hold_seconds:
+                time.sleep(self._hold_seconds)
+            return super().append(message, size)
+
+    def popleft(self) -> Optional[QueueEntry]:
+        with self.lock:
+            if self._hold_seconds and len(self):
+                time.sleep(self._hold_seconds)
+            return super().popleft()
+
+
+class StorageMessageBroker(MessageBroker):
+    """Broker with a lock per queue, i.e. the current design."""
+
+    def __init__(self, hold_seconds: float, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._hold_seconds = hold_seconds
+
+    def _create_queue(self, subscriber: str) -> SubscriberQueue:
+        return StorageQueue(self._hold_seconds)
+
+
+class GlobalLockMessageBroker(StorageMessageBroker):
+    """Broker whose queues all share one lock, i.e. the previous design."""
+
+    def __init__(self, hold_seconds: float, **kwargs) -> None:
+        super().__init__(hold_seconds, **kwargs)
+        self._shared_queue_lock = RLock()
+
+    def _create_queue(self, subscriber: str) -> SubscriberQueue:
+        return StorageQueue(self._hold_seconds, lock=self._shared_queue_lock)
+
+
+def run(broker: MessageBroker, threads: int, duration: float) -> float:
+    operations = [0] * threads
+    deadline = time.monotonic() + duration
+
+    def worker(index: int) -> None:
+        subscribers = [f"http://localhost:9000/{index}/{i}" for i in range(4)]
+        message = {"message": "benchmark"}
+        while time.monotonic() < deadline:
+            broker.publish_message(
+                topic="benchmark", subscribers=subscribers, message=dict(message)
+            )
+            for subscriber in subscribers:
+                broker.retrieve_message(subscriber)
+            operations[index] += 1 + len(subscribers)
+
+    workers = [Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(operations) / duration
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=2.0)
+    parser.add_argument("--delivery-ms", type=float, default=1.0)
+    parser.add_argument("--hold-ms", type=float, default=0.2)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    if args.hold_ms:
+        print(
+            f"simulated storage write of {args.hold_ms} ms under every queue lock, "
+            "speedups come from the simulation"
+        )
+    else:
+        print("in-memory backlogs, no simulated work under the queue locks")
+    print(
+        f"{'threads':>8} {'global lock ops/s':>18} {'striped ops/s':>14} {'speedup':>8}"
+    )
+    for threads in args.threads:
+        results = []
+        for broker_class in (GlobalLockMessageBroker, StorageMessageBroker):
+            broker = broker_class(
+                args.hold_ms / 1000,
+                delivery_engine=SimulatedDeliveryEngine(args.delivery_ms / 1000),
+            )
+            results.append(run(broker, threads, args.duration))
+        print(
+            f"{threads:>8} {results[0]:>18.0f} {results[1]:>14.0f} {results[1] / results[0]:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
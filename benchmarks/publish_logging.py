@@ -0,0 +1,114 @@
+"""
+Publish logging benchmark.
+
+Publishes messages to a wide fan-out through MessageBroker with instant webhook delivery and reports the
+publish throughput under several logging setups: every per-message and per-subscriber event logged by a
+synchronous file handler, as the broker did at INFO before, the same events through the queue pipeline,
+the current INFO level through the queue pipeline, and logging disabled.
+
+Usage: PYTHONPATH=src python benchmarks/publish_logging.py [--messages 2000] [--subscribers 50]
+"""
+
+import argparse
+import logging
+import os
+import queue
+import tempfile
+import time
+from logging.handlers import QueueListener
+from typing import (
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from manager.delivery_engine import (
+    DeliveryResult,
+    Payload,
+)
+from manager.message_broker import MessageBroker
+from utils.log import NonBlockingQueueHandler
+
+
+class InstantDeliveryEngine:
+    def deliver_many(
+        self, deliveries: Sequence[Tuple[str, Payload]]
+    ) -> List[DeliveryResult]:
+        return [
+            DeliveryResult(subscriber=subscriber, delivered=True)
+            for subscriber, _ in deliveries
+        ]
+
+    def shutdown(self) -> None:
+        pass
+
+
+def measure(
+    name: str,
+    level: int,
+    handler: Optional[logging.Handler],
+    messages: int,
+    subscribers: List[str],
+) -> None:
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    if handler is not None:
+        root.addHandler(handler)
+    root.setLevel(level)
+    logging.disable(logging.NOTSET if handler is not None else logging.CRITICAL)
+
+    message_broker = MessageBroker(delivery_engine=InstantDeliveryEngine())
+    start = time.perf_counter()
+    for i in range(messages):
+        message_broker.publish_message(
+            "benchmark", subscribers, {"message": f"message {i}"}
+        )
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:>32}: {elapsed:6.2f}s  {elapsed / messages * 1e6:8.1f} us/publish  "
+        f"{messages / elapsed:8.0f} publishes/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--subscribers", type=int, default=50)
+    args = parser.parse_args()
+
+    subscribers = [f"http://localhost:9000/{i}" for i in range(args.subscribers)]
+    formatter = logging.Formatter(logging.BASIC_FORMAT)
+    with tempfile.TemporaryDirectory() as directory:
+        file_handler = logging.FileHandler(os.path.join(directory, "server.log"))
+        file_handler.setFormatter(formatter)
+
+        measure(
+            "every event, synchronous file",
+            logging.DEBUG,
+            file_handler,
+            args.messages,
+            subscribers,
+        )
+
+        log_queue: queue.Queue = queue.Queue(maxsize=10000)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        listener = QueueListener(log_queue, file_handler)
+        listener.start()
+        measure(
+            "every event, queue",
+            logging.DEBUG,
+            queue_handler,
+            args.messages,
+            subscribers,
+        )
+        measure("INFO, queue", logging.INFO, queue_handler, args.messages, subscribers)
+        listener.stop()
+        file_handler.close()
+        print(f"{queue_handler.dropped} records dropped by the full queue")
+
+    measure("logging disabled", logging.INFO, None, args.messages, subscribers)
+
+
+if __name__ == "__main__":
+    main()
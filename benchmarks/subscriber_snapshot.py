@@ -0,0 +1,76 @@
+"""
+Subscriber lookup benchmark for the publish path.
+
+Measures the cost of resolving the subscribers of a topic with many subscribers, as done once per published
+message, comparing the previous lookup (strip the topic and copy the subscriber set into a new list) with the
+cached immutable snapshots of SubscriptionManager. Memory allocated per lookup is measured with tracemalloc.
+
+Usage: PYTHONPATH=src python benchmarks/subscriber_snapshot.py [--subscribers 10000] [--lookups 2000]
+"""
+
+import argparse
+import logging
+import time
+import tracemalloc
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Set,
+)
+from manager.subscription_manager import SubscriptionManager
+
+
+class CopyingSubscriptionManager:
+    """Lookup of the previous design, a fresh list is built from the subscriber set on every call."""
+
+    def __init__(self) -> None:
+        self._subscription_map: Dict[str, Set[str]] = {}
+
+    def subscribe(self, topic: str, endpoint: str) -> bool:
+        self._subscription_map.setdefault(topic, set()).add(endpoint)
+        return True
+
+    def get_subscribers(self, topic: str) -> List[str]:
+        subscribers = self._subscription_map.get(topic.strip(), set())
+        return list(subscribers)
+
+
+def measure(lookup: Callable[[str], object], lookups: int) -> None:
+    lookup("benchmark")  # warm up caches
+
+    start = time.perf_counter()
+    for _ in range(lookups):
+        lookup("benchmark")
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    lookup("benchmark")
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"  {elapsed / lookups * 1e6:10.2f} us/lookup  {lookups / elapsed:12.0f} lookups/s  "
+        f"{peak / 1024:8.1f} KiB allocated/lookup"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--subscribers", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    for name, subscription_manager in (
+        ("copying set to list", CopyingSubscriptionManager()),
+        ("immutable snapshot", SubscriptionManager()),
+    ):
+        for i in range(args.subscribers):
+            subscription_manager.subscribe("benchmark", f"http://localhost:9000/{i}")
+        print(f"{name} ({args.subscribers} subscribers)")
+        measure(subscription_manager.get_subscribers, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+"""
+Server state and request handling shared by the Flask app (main.py) and the asyncio app (async_main.py).
+Nothing in here depends on the web framework, handlers pass in the parsed request data.
+"""
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from manager.subscription_manager import (
+    SubscriptionManager,
+    SubscriptionOptions,
+)
+from manager.message_broker import (
+    MessageBroker,
+    PolledBatch,
+    PublishResult,
+    DELIVERY_DELIVERED,
+    DELIVERY_FAILED,
+    DELIVERY_QUEUED,
+)
+from manager.envelope import ENCODING_GZIP
+from manager.journal import Journal
+from manager.rate_limiter import (
+    PublishRateLimiter,
+    TokenBucketLimiter,
+)
+from manager.sqlite_state_backend import SQLiteStateBackend
+from manager.state_backend import (
+    MemoryStateBackend,
+    StateBackend,
+)
+from utils.config import Config
+from utils.metrics import REGISTRY
+from utils.validation import Validation
+from itertools import chain
+import logging
+import math
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# per entry outcomes of a batch publish, besides delivered and failed
+PUBLISH_ACCEPTED = "accepted"
+PUBLISH_REJECTED = "rejected"
+PUBLISH_INVALID = "invalid"
+PUBLISH_NO_SUBSCRIBERS = "no_subscribers"
+PUBLISH_RATE_LIMITED = "rate_limited"
+
+# per entry outcomes of a batch subscribe
+SUBSCRIBE_SUBSCRIBED = "subscribed"
+SUBSCRIBE_INVALID = "invalid"
+SUBSCRIBE_FAILED = "failed"
+
+STATE_BACKEND_MEMORY = "memory"
+STATE_BACKEND_SQLITE = "sqlite"
+
+
+def create_state_backend() -> StateBackend:
+    """
+    :raises ValueError: if the configured state backend is unknown
+    """
+    if Config.STATE_BACKEND == STATE_BACKEND_SQLITE:
+        return SQLiteStateBackend(
+            path=Config.STATE_PATH,
+            poll_interval=Config.STATE_POLL_INTERVAL,
+            compact_interval=Config.JOURNAL_CHECKPOINT_INTERVAL,
+        )
+    if Config.STATE_BACKEND != STATE_BACKEND_MEMORY:
+        raise ValueError(f"Unknown state backend {Config.STATE_BACKEND}")
+
+    journal = (
+        Journal(
+            data_dir=Config.DATA_DIR,
+            segment_bytes=Config.JOURNAL_SEGMENT_BYTES,
+            commit_interval=Config.JOURNAL_COMMIT_INTERVAL,
+        )
+        if Config.DATA_DIR
+        else None
+    )
+    return MemoryStateBackend(
+        journal=journal, checkpoint_interval=Config.JOURNAL_CHECKPOINT_INTERVAL
+    )
+
+
+def create_state(
+    delivery_engine: Any,
+) -> Tuple[StateBackend, SubscriptionManager, MessageBroker]:
+    """
+    Build the configured state backend, the subscription manager and the message broker.
+
+    :param delivery_engine: DeliveryEngine, or AsyncDeliveryEngine for asyncio servers
+    """
+    state_backend = create_state_backend()
+    message_broker: Optional[MessageBroker] = None
+
+    def reclaim_endpoint(endpoint: str) -> None:
+        message_broker.remove_subscriber(endpoint)
+
+    subscription_manager = SubscriptionManager(
+        journal=state_backend.journal, on_endpoint_removed=reclaim_endpoint
+    )
+    message_broker = MessageBroker(
+        delivery_engine=delivery_engine,
+        dispatch_workers=Config.DISPATCH_WORKERS,
+        dispatch_queue_size=Config.DISPATCH_QUEUE_SIZE,
+        status_retention=Config.DELIVERY_STATUS_RETENTION,
+        max_queue_messages=Config.MAX_QUEUE_MESSAGES,
+        max_queue_bytes=Config.MAX_QUEUE_BYTES,
+        max_total_messages=Config.MAX_TOTAL_MESSAGES,
+        max_total_bytes=Config.MAX_TOTAL_BYTES,
+        overflow_policy=Config.OVERFLOW_POLICY,
+        retry_max_attempts=Config.RETRY_MAX_ATTEMPTS,
+        retry_base_delay=Config.RETRY_BASE_DELAY,
+        retry_max_delay=Config.RETRY_MAX_DELAY,
+        dead_letter_max_messages=Config.DEAD_LETTER_MAX_MESSAGES,
+        breaker_failure_threshold=Config.BREAKER_FAILURE_THRESHOLD,
+        breaker_reset_timeout=Config.BREAKER_RESET_TIMEOUT,
+        subscription_options=subscription_manager.get_options,
+        state_backend=state_backend,
+        compress_threshold=Config.COMPRESS_THRESHOLD,
+        delivery_rate_limiter=(
+            TokenBucketLimiter(
+                rate=Config.RATE_LIMIT_DELIVERY,
+                burst=Config.RATE_LIMIT_DELIVERY_BURST,
+                max_keys=Config.RATE_LIMIT_MAX_KEYS,
+            )
+            if Config.RATE_LIMIT_DELIVERY > 0
+            else None
+        ),
+    )
+    register_state_metrics(subscription_manager, message_broker)
+    return state_backend, subscription_manager, message_broker
+
+
+def register_state_metrics(
+    subscription_manager: SubscriptionManager, message_broker: MessageBroker
+) -> None:
+    """
+    Gauges read from the server state when /metrics is scraped, nothing is recorded for them in between.
+    """
+    REGISTRY.gauge(
+        "leafi_queue_messages",
+        "Messages waiting in the backlog of each subscriber",
+        ("subscriber",),
+        lambda: [
+            ((subscriber,), messages)
+            for subscriber, messages, _ in message_broker.queue_stats()
+        ],
+    )
+    REGISTRY.gauge(
+        "leafi_queue_bytes",
+        "Bytes held by the backlog of each subscriber",
+        ("subscriber",),
+        lambda: [
+            ((subscriber,), size)
+            for subscriber, _, size in message_broker.queue_stats()
+        ],
+    )
+    REGISTRY.gauge(
+        "leafi_subscriptions",
+        "Endpoints subscribed to each topic or topic pattern",
+        ("topic",),
+        lambda: [
+            ((topic,), count)
+            for topic, count in subscription_manager.subscription_counts()
+        ],
+    )
+
+
+def create_publish_rate_limiter() -> PublishRateLimiter:
+    return PublishRateLimiter(
+        topic_rate=Config.RATE_LIMIT_TOPIC,
+        topic_burst=Config.RATE_LIMIT_TOPIC_BURST,
+        publisher_rate=Config.RATE_LIMIT_PUBLISHER,
+        publisher_burst=Config.RATE_LIMIT_PUBLISHER_BURST,
+        max_keys=Config.RATE_LIMIT_MAX_KEYS,
+    )
+
+
+def retry_after_header(retry_after: float) -> Dict[str, str]:
+    """
+    Retry-After header of a 429 response, in whole seconds rounded up.
+    """
+    return {"Retry-After": str(math.ceil(retry_after))}
+
+
+def recover_state(
+    state_backend: StateBackend,
+    subscription_manager: SubscriptionManager,
+    message_broker: MessageBroker,
+) -> None:
+    """
+    Rebuild subscriptions and backlogs from the state backend, then start its background maintenance:
+    journal checkpoints, or following the changes of other processes for a shared backend.
+    """
+    recovered: int = 0
+    for record in state_backend.replay():
+        subscription_manager.restore(record)
+        message_broker.restore(record)
+        recovered += 1
+    logger.info(
+        "Recovered %d records from the %s state", recovered, Config.STATE_BACKEND
+    )
+
+    state_backend.start(
+        snapshot_records=lambda: chain(
+            subscription_manager.snapshot_records(),
+            message_broker.snapshot_records(),
+        ),
+        apply=subscription_manager.restore,
+    )
+    subscription_manager.start_expiry()
+
+
+def is_async_publish(requested: Optional[str]) -> bool:
+    """
+    :param requested: value of the async query parameter, if any
+    """
+    if requested is None:
+        return Config.PUBLISH_ASYNC
+    return requested.lower() in ("1", "true", "yes")
+
+
+def parse_max_count(max_count: Optional[str]) -> Optional[int]:
+    """
+    :param max_count: value of the max query parameter, if any
+    :return max_count: None if invalid
+    """
+    if max_count is None:
+        return Config.POLL_DEFAULT_BATCH
+    try:
+        count = int(max_count)
+    except ValueError:
+        return None
+    if not 0 < count <= Config.POLL_MAX_BATCH:
+        return None
+    return count
+
+
+def parse_wait(wait: Optional[str]) -> Optional[float]:
+    """
+    :param wait: value of the wait query parameter, if any
+    :return wait: seconds to long poll for, None if invalid
+    """
+    try:
+        seconds = float(wait or 0)
+    except ValueError:
+        return None
+    if not 0 <= seconds <= Config.LONG_POLL_MAX_WAIT:
+        return None
+    return seconds
+
+
+def parse_subscription_options(data: Dict[str, Any]) -> Optional[SubscriptionOptions]:
+    """
+    Read the optional delivery options of a subscribe request.
+
+    :return options: None if the request sets no options
+    :raises ValueError: if an option is invalid
+    """
+    if not any(
+        option in data for option in ("max_attempts", "batch", "accept_encoding")
+    ):
+        return None
+
+    max_attempts = data.get("max_attempts")
+    if max_attempts is not None and (
+        isinstance(max_attempts, bool)
+        or not isinstance(max_attempts, int)
+        or max_attempts < 0
+    ):
+        raise ValueError("max_attempts must be a non-negative number")
+
+    batch = data.get("batch") or {}
+    if not isinstance(batch, dict):
+        raise ValueError("batch must be an object with max_size and max_linger_ms")
+    max_size = batch.get("max_size", 0)
+    max_linger_ms = batch.get("max_linger_ms", 0)
+    if batch and (
+        isinstance(max_size, bool) or not isinstance(max_size, int) or max_size <= 0
+    ):
+        raise ValueError("batch.max_size must be a positive number")
+    if (
+        isinstance(max_linger_ms, bool)
+        or not isinstance(max_linger_ms, (int, float))
+        or not 0 <= max_linger_ms <= Config.BATCH_MAX_LINGER_MS
+    ):
+        raise ValueError(
+            f"batch.max_linger_ms must be a non-negative number, at most {Config.BATCH_MAX_LINGER_MS:g}"
+        )
+
+    accept_encoding = data.get("accept_encoding")
+    if accept_encoding not in (None, ENCODING_GZIP):
+        raise ValueError(f"accept_encoding must be {ENCODING_GZIP} or null")
+
+    return SubscriptionOptions(
+        max_attempts=max_attempts,
+        batch_max_size=max_size,
+        batch_max_linger=max_linger_ms / 1000,
+        accept_encoding=accept_encoding,
+    )
+
+
+def parse_ttl(data: Dict[str, Any]) -> Optional[float]:
+    """
+    :return ttl: lease of a subscribe request in seconds, None for a permanent subscription
+    :raises ValueError: if the ttl is invalid
+    """
+    ttl = data.get("ttl")
+    if ttl is not None and (
+        isinstance(ttl, bool)
+        or not isinstance(ttl, (int, float))
+        or not 0 < ttl <= Config.SUBSCRIPTION_MAX_TTL
+    ):
+        raise ValueError(
+            f"ttl must be a positive number of seconds, at most {Config.SUBSCRIPTION_MAX_TTL:g}"
+        )
+    return ttl
+
+
+def validate_publish_batch(
+    data: Any,
+) -> Tuple[List[Dict[str, Any]], List[Tuple[int, str, Dict[str, Any]]]]:
+    """
+    Validate the entries of a batch publish request, before any rate limit is checked.
+
+    :return validated: a result per entry, filled in for invalid entries, plus the index, topic and message
+        of every valid entry
+    :raises ValueError: if the request as a whole is invalid
+    """
+    if not isinstance(data, list) or not data:
+        raise ValueError("Please send a non-empty array of {topic, message} entries")
+    if len(data) > Config.PUBLISH_MAX_BATCH:
+        raise ValueError(
+            f"At most {Config.PUBLISH_MAX_BATCH} entries can be published at once"
+        )
+
+    results: List[Dict[str, Any]] = [{} for _ in data]
+    valid = []
+    for i, entry in enumerate(data):
+        topic = entry.get("topic") if isinstance(entry, dict) else None
+        message = entry.get("message") if isinstance(entry, dict) else None
+        if (
+            not isinstance(topic, str)
+            or not Validation.isValidTopic(topic.strip())
+            or not isinstance(message, dict)
+            or not message
+        ):
+            results[i] = {"status": PUBLISH_INVALID}
+            continue
+        valid.append((i, topic.strip(), message))
+    return results, valid
+
+
+def resolve_publish_batch(
+    results: List[Dict[str, Any]],
+    valid: Sequence[Tuple[int, str, Dict[str, Any]]],
+    get_subscribers: Callable[[str], Tuple[str, ...]],
+    acquire_topic: Optional[Callable[[str], float]] = None,
+) -> Tuple[List[int], List[Tuple[str, Sequence[str], Dict[str, Any]]]]:
+    """
+    Resolve the subscribers of the valid entries of a batch publish request, once per topic. Entries over
+    their topic's rate limit, checked with acquire_topic, are not published.
+
+    :param results: from validate_publish_batch(), filled in for entries that cannot be published
+    :return entries: the index and (topic, subscribers, message) of every entry to publish
+    """
+    topic_subscribers: Dict[str, Tuple[str, ...]] = {}
+    indexes = []
+    entries = []
+    for i, topic, message in valid:
+        retry_after = acquire_topic(topic) if acquire_topic else 0
+        if retry_after:
+            results[i] = {
+                "status": PUBLISH_RATE_LIMITED,
+                "retry_after": math.ceil(retry_after),
+            }
+            continue
+        if topic not in topic_subscribers:
+            topic_subscribers[topic] = get_subscribers(topic)
+        if not topic_subscribers[topic]:
+            results[i] = {"status": PUBLISH_NO_SUBSCRIBERS}
+            continue
+        indexes.append(i)
+        entries.append((topic, topic_subscribers[topic], message))
+    return indexes, entries
+
+
+def parse_subscribe_batch(
+    data: Any,
+) -> Tuple[
+    List[Dict[str, Any]],
+    List[int],
+    List[Tuple[str, str, Optional[SubscriptionOptions], Optional[float]]],
+]:
+    """
+    Validate the entries of a batch subscribe request, each one is checked as a single subscribe would be.
+
+    :return parsed: a result per entry, filled in for invalid entries, plus the index and
+        (topic, url, options, ttl) of every entry to subscribe
+    :raises ValueError: if the request as a whole is invalid
+    """
+    if not isinstance(data, list) or not data:
+        raise ValueError("Please send a non-empty array of {topic, url} entries")
+    if len(data) > Config.SUBSCRIBE_MAX_BATCH:
+        raise ValueError(
+            f"At most {Config.SUBSCRIBE_MAX_BATCH} subscriptions can be created at once"
+        )
+
+    results: List[Dict[str, Any]] = [{} for _ in data]
+    indexes = []
+    subscriptions = []
+    for i, entry in enumerate(data):
+        if not isinstance(entry, dict):
+            results[i] = {
+                "status": SUBSCRIBE_INVALID,
+                "error": "Entry is not an object",
+            }
+            continue
+        topic = entry.get("topic")
+        url = entry.get("url")
+        if not isinstance(topic, str) or not Validation.isValidTopicPattern(
+            topic.strip()
+        ):
+            results[i] = {"status": SUBSCRIBE_INVALID, "error": "Invalid topic"}
+            continue
+        if not Validation.isValidUrl(url):
+            results[i] = {"status": SUBSCRIBE_INVALID, "error": "Invalid URL"}
+            continue
+        try:
+            options = parse_subscription_options(entry)
+            ttl = parse_ttl(entry)
+        except ValueError as e:
+            results[i] = {"status": SUBSCRIBE_INVALID, "error": str(e)}
+            continue
+        indexes.append(i)
+        subscriptions.append((topic, url, options, ttl))
+    return results, indexes, subscriptions
+
+
+def subscribe_results(
+    results: List[Dict[str, Any]], indexes: List[int], subscribed: List[bool]
+) -> List[Dict[str, Any]]:
+    """
+    Fill in the results of the entries passed to SubscriptionManager.subscribe_batch().
+    """
+    for i, isSubscribed in zip(indexes, subscribed):
+        results[i] = {
+            "status": SUBSCRIBE_SUBSCRIBED if isSubscribed else SUBSCRIBE_FAILED
+        }
+    return results
+
+
+def publish_result_to_json(result: PublishResult) -> Dict[str, Any]:
+    if result.rejected:
+        return {"status": PUBLISH_REJECTED}
+    body: Dict[str, Any] = {"status": DELIVERY_DELIVERED}
+    if result.queued_subscribers:
+        body = {
+            "status": DELIVERY_QUEUED,
+            "queued_subscribers": result.queued_subscribers,
+        }
+    if result.failed_subscribers:
+        body["status"] = DELIVERY_FAILED
+        body["failed_subscribers"] = result.failed_subscribers
+    return body
+
+
+def encode_polled_batch(batch: PolledBatch) -> bytes:
+    """
+    JSON response of a poll, the messages are spliced in as they were encoded when published.
+    """
+    messages = b",".join(
+        b'{"seq":%d,"message":%s}' % (entry.seq, entry.message.body)
+        for entry in batch.entries
+    )
+    next_cursor = b"null" if batch.next_cursor is None else b"%d" % batch.next_cursor
+    return b'{"count":%d,"messages":[%s],"next_cursor":%s}' % (
+        len(batch.entries),
+        messages,
+        next_cursor,
+    )
@@ -0,0 +1,610 @@
+"""
+asyncio variant of the server in main.py, built on aiohttp.
+
+Serves the same routes with the same SubscriptionManager and MessageBroker semantics. Webhooks are delivered
+through AsyncDeliveryEngine and long polls and event streams wait on the event loop, so in-flight publishes
+and waiting subscribers cost a coroutine each instead of a thread.
+
+Usage: python src/async_main.py
+"""
+
+from aiohttp import web
+from typing import (
+    Any,
+    Dict,
+    Optional,
+)
+from app_common import (
+    create_publish_rate_limiter,
+    create_state,
+    encode_polled_batch,
+    is_async_publish,
+    parse_max_count,
+    parse_subscribe_batch,
+    parse_subscription_options,
+    parse_ttl,
+    parse_wait,
+    publish_result_to_json,
+    recover_state,
+    resolve_publish_batch,
+    retry_after_header,
+    subscribe_results,
+    validate_publish_batch,
+    PUBLISH_ACCEPTED,
+    PUBLISH_REJECTED,
+)
+from manager.async_delivery_engine import AsyncDeliveryEngine
+from manager.journal import JournalError
+from manager.rate_limiter import PublishRateLimiter
+from manager.state_backend import StateBackend
+from manager.message_broker import (
+    DispatchQueueFullError,
+    MessageBroker,
+    PolledBatch,
+)
+from manager.subscription_manager import SubscriptionManager
+from utils.config import Config
+from utils.log import setup_logging
+from utils.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    REGISTRY,
+)
+from utils.validation import Validation
+import utils.http_codes as HttpStatus
+import asyncio
+import logging
+import sys
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+DELIVERY_ENGINE = web.AppKey("delivery_engine", AsyncDeliveryEngine)
+STATE_BACKEND = web.AppKey("state_backend", StateBackend)
+SUBSCRIPTION_MANAGER = web.AppKey("subscription_manager", SubscriptionManager)
+MESSAGE_BROKER = web.AppKey("message_broker", MessageBroker)
+PUBLISH_RATE_LIMITER = web.AppKey("publish_rate_limiter", PublishRateLimiter)
+# mutable flags shared by the handlers, e.g. whether POST /event is accepted
+SETTINGS = web.AppKey("settings", Dict[str, Any])
+
+routes = web.RouteTableDef()
+
+
+def _respond(
+    message: str, status_code: int, data: Optional[Dict[str, Any]] = None
+) -> web.Response:
+    body = {"message": message}
+    if data:
+        body.update(data)
+    return web.json_response(body, status=status_code)
+
+
+def _too_many_requests(retry_after: float) -> web.Response:
+    response = _respond(
+        message="Too many messages, please try again later",
+        status_code=HttpStatus.HTTP_TOO_MANY_REQUESTS,
+    )
+    response.headers.update(retry_after_header(retry_after))
+    return response
+
+
+def _not_persisted(what: str = "Message") -> web.Response:
+    return _respond(
+        message=f"{what} could not be persisted, please try again later",
+        status_code=HttpStatus.HTTP_SERVICE_UNAVAILABLE,
+    )
+
+
+async def _get_json(request: web.Request) -> Any:
+    """
+    Same contract as Flask's request.get_json(): JSON bodies only, malformed ones are a bad request.
+    """
+    if request.content_type != "application/json":
+        raise web.HTTPUnsupportedMediaType(
+            text="Did not attempt to load JSON data because the request Content-Type was not 'application/json'."
+        )
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Failed to decode JSON object")
+
+
+async def _retrieve_messages(
+    message_broker: MessageBroker,
+    subscriber: str,
+    max_count: int,
+    wait: float,
+    peek: bool = False,
+) -> PolledBatch:
+    """
+    Poll like MessageBroker.retrieve_messages(), but long poll by awaiting a wake-up from the subscriber's
+    queue instead of parking a thread on it. Every call into the broker runs in a worker thread, queues kept
+    in SQLite block.
+
+    :param peek: Leave the entries queued until acked, see MessageBroker.peek_messages()
+    """
+    poll = message_broker.peek_messages if peek else message_broker.retrieve_messages
+    batch = await asyncio.to_thread(poll, subscriber=subscriber, max_count=max_count)
+    if batch.entries or wait <= 0:
+        return batch
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    arrived = asyncio.Event()
+
+    def listener() -> None:
+        loop.call_soon_threadsafe(arrived.set)
+
+    await asyncio.to_thread(message_broker.watch, subscriber, listener)
+    try:
+        while True:
+            # cleared before polling, so a message queued right after the poll still wakes us up
+            arrived.clear()
+            batch = await asyncio.to_thread(
+                poll, subscriber=subscriber, max_count=max_count
+            )
+            remaining = deadline - loop.time()
+            if batch.entries or remaining <= 0:
+                return batch
+            try:
+                await asyncio.wait_for(arrived.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await asyncio.to_thread(message_broker.unwatch, subscriber, listener)
+
+
+@routes.get("/")
+async def hello_world(request: web.Request) -> web.Response:
+    return web.Response(text="Hello, World! Usage information in Readme.md")
+
+
+@routes.get("/subscribers/{topic}")
+async def get_subscription_info(request: web.Request) -> web.Response:
+    topic = request.match_info["topic"].strip()
+    topic_subscribers = request.app[SUBSCRIPTION_MANAGER].get_subscribers(topic=topic)
+    if topic_subscribers:
+        return web.json_response(list(topic_subscribers), status=HttpStatus.HTTP_OK)
+    return _respond(
+        message="Topic either does not exist or has no subscribed endpoints",
+        status_code=HttpStatus.HTTP_NOT_FOUND,
+    )
+
+
+@routes.get("/subscribers/{topic}/breakers")
+async def get_breaker_info(request: web.Request) -> web.Response:
+    topic = request.match_info["topic"].strip()
+    topic_subscribers = request.app[SUBSCRIPTION_MANAGER].get_subscribers(topic=topic)
+    if topic_subscribers:
+        return web.json_response(
+            request.app[MESSAGE_BROKER].get_breaker_states(topic_subscribers),
+            status=HttpStatus.HTTP_OK,
+        )
+    return _respond(
+        message="Topic either does not exist or has no subscribed endpoints",
+        status_code=HttpStatus.HTTP_NOT_FOUND,
+    )
+
+
+@routes.post("/subscribe")
+async def setup_subscription_batch(request: web.Request) -> web.Response:
+    data = await _get_json(request)
+    try:
+        results, indexes, subscriptions = parse_subscribe_batch(data)
+    except ValueError as e:
+        return _respond(message=str(e), status_code=HttpStatus.HTTP_BAD_REQUEST)
+    logger.debug("Batch of %d subscriptions requested", len(data))
+
+    # subscribing waits for the journal or the shared state, off the event loop
+    try:
+        subscribed = await asyncio.to_thread(
+            request.app[SUBSCRIPTION_MANAGER].subscribe_batch, subscriptions
+        )
+    except JournalError:
+        return _not_persisted("Subscriptions")
+    return web.json_response(
+        {"results": subscribe_results(results, indexes, subscribed)},
+        status=HttpStatus.HTTP_OK,
+    )
+
+
+@routes.post("/subscribe/{topic}")
+async def setup_subscription(request: web.Request) -> web.Response:
+    topic = request.match_info["topic"]
+    data = await _get_json(request)
+    logger.info("Subscription requested for topic %s", topic)
+
+    if (
+        not isinstance(data, dict)
+        or not isinstance(data.get("url"), str)
+        or topic.strip() == ""
+    ):
+        return _respond(
+            message="Please check topic and URL again. At least one was not found.",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    if not Validation.isValidUrl(data["url"]):
+        return _respond(
+            message="Invalid URL provided.", status_code=HttpStatus.HTTP_BAD_REQUEST
+        )
+
+    if not Validation.isValidTopicPattern(topic.strip()):
+        return _respond(
+            message="Invalid topic, wildcards must fill a whole level and # may only be the last level",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    try:
+        options = parse_subscription_options(data)
+        ttl = parse_ttl(data)
+    except ValueError as e:
+        return _respond(message=str(e), status_code=HttpStatus.HTTP_BAD_REQUEST)
+
+    # subscribing waits for the journal or the shared state, off the event loop
+    try:
+        isSubscribed = await asyncio.to_thread(
+            request.app[SUBSCRIPTION_MANAGER].subscribe,
+            topic=topic,
+            endpoint=data["url"],
+            options=options,
+            ttl=ttl,
+        )
+    except JournalError:
+        return _not_persisted("Subscription")
+    if isSubscribed:
+        return _respond(
+            message=f"Subscription created successfully between {topic} and {data['url']}",
+            status_code=HttpStatus.HTTP_CREATED,
+        )
+
+    return _respond(
+        message="Subscription was unsuccessful",
+        status_code=HttpStatus.HTTP_INTERNAL_ERR,
+    )
+
+
+@routes.delete("/subscribe/{topic}")
+async def remove_subscription(request: web.Request) -> web.Response:
+    topic = request.match_info["topic"]
+    data = await _get_json(request)
+    logger.info("Unsubscription requested for topic %s", topic)
+
+    if (
+        not isinstance(data, dict)
+        or not isinstance(data.get("url"), str)
+        or topic.strip() == ""
+    ):
+        return _respond(
+            message="Please check topic and URL again. At least one was not found.",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    try:
+        unsubscribed = await asyncio.to_thread(
+            request.app[SUBSCRIPTION_MANAGER].unsubscribe,
+            topic=topic,
+            endpoint=data["url"],
+        )
+    except JournalError:
+        return _not_persisted("Unsubscription")
+    if unsubscribed:
+        return _respond(
+            message=f"Subscription removed between {topic} and {data['url']}",
+            status_code=HttpStatus.HTTP_OK,
+        )
+    return _respond(
+        message=f"No subscription found between {topic} and {data['url']}",
+        status_code=HttpStatus.HTTP_NOT_FOUND,
+    )
+
+
+@routes.post("/publish")
+async def publish_batch(request: web.Request) -> web.Response:
+    message_broker = request.app[MESSAGE_BROKER]
+    publish_rate_limiter = request.app[PUBLISH_RATE_LIMITER]
+    data = await _get_json(request)
+    try:
+        results, valid = validate_publish_batch(data)
+    except ValueError as e:
+        return _respond(message=str(e), status_code=HttpStatus.HTTP_BAD_REQUEST)
+    # a token per valid entry, taken before any subscriber lookup or broker work
+    if valid:
+        retry_after = publish_rate_limiter.acquire_publisher(
+            request.remote, messages=len(valid)
+        )
+        if retry_after:
+            return _too_many_requests(retry_after)
+    indexes, entries = resolve_publish_batch(
+        results,
+        valid,
+        request.app[SUBSCRIPTION_MANAGER].get_subscribers,
+        acquire_topic=publish_rate_limiter.acquire_topic,
+    )
+    logger.debug("Batch of %d messages is requested to be published", len(data))
+
+    if is_async_publish(request.query.get("async")):
+        for i, (topic, subscribers, message) in zip(indexes, entries):
+            try:
+                message_id = message_broker.submit_message(
+                    topic=topic, subscribers=subscribers, message=message
+                )
+                results[i] = {"status": PUBLISH_ACCEPTED, "message_id": message_id}
+            except DispatchQueueFullError:
+                results[i] = {"status": PUBLISH_REJECTED}
+    elif entries:
+        try:
+            publish_results = await message_broker.publish_batch_async(entries)
+        except JournalError:
+            return _not_persisted()
+        for i, result in zip(indexes, publish_results):
+            results[i] = publish_result_to_json(result)
+
+    return web.json_response({"results": results}, status=HttpStatus.HTTP_OK)
+
+
+@routes.post("/publish/{topic}")
+async def publish_message(request: web.Request) -> web.Response:
+    message_broker = request.app[MESSAGE_BROKER]
+    publish_rate_limiter = request.app[PUBLISH_RATE_LIMITER]
+    topic = request.match_info["topic"].strip()
+    if not Validation.isValidTopic(topic):
+        return _respond(
+            message="Invalid topic, please try again",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+    data = await _get_json(request)
+    logger.debug("Message is requested to be published for topic %s", topic)
+    if not data:
+        return _respond(
+            message="No data found to send",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    # once the request is valid and before any subscriber lookup or broker work
+    retry_after = publish_rate_limiter.acquire_publisher(
+        request.remote
+    ) or publish_rate_limiter.acquire_topic(topic)
+    if retry_after:
+        return _too_many_requests(retry_after)
+
+    subscribers = request.app[SUBSCRIPTION_MANAGER].get_subscribers(topic=topic)
+    if not subscribers:
+        return _respond(
+            message=f"No subscribers found for topic {topic}",
+            status_code=HttpStatus.HTTP_NOT_FOUND,
+        )
+
+    if is_async_publish(request.query.get("async")):
+        try:
+            message_id = message_broker.submit_message(
+                topic=topic, subscribers=subscribers, message=data
+            )
+        except DispatchQueueFullError:
+            return _respond(
+                message="Server is busy, please try again later",
+                status_code=HttpStatus.HTTP_SERVICE_UNAVAILABLE,
+            )
+        return _respond(
+            message="Message has been accepted for delivery",
+            status_code=HttpStatus.HTTP_ACCEPTED,
+            data={"message_id": message_id},
+        )
+
+    try:
+        result = (
+            await message_broker.publish_batch_async([(topic, subscribers, data)])
+        )[0]
+    except JournalError:
+        return _not_persisted()
+    if result.rejected:
+        return _respond(
+            message="Message backlog is full, please try again later",
+            status_code=HttpStatus.HTTP_SERVICE_UNAVAILABLE,
+        )
+    if result.failed_subscribers:
+        return _respond(
+            message=f"Message could not be sent to the following subscribers: {result.failed_subscribers}. \
+            Please contact admin/support for more information.",
+            status_code=HttpStatus.HTTP_INTERNAL_ERR,
+        )
+    if result.queued_subscribers:
+        return _respond(
+            message="Message has been queued for the next batch of some subscribers",
+            status_code=HttpStatus.HTTP_ACCEPTED,
+            data={"queued_subscribers": result.queued_subscribers},
+        )
+    return _respond(
+        message="Message has been sent to all subscribers",
+        status_code=HttpStatus.HTTP_OK,
+    )
+
+
+@routes.get("/publish/status/{message_id}")
+async def get_publish_status(request: web.Request) -> web.Response:
+    message_id = request.match_info["message_id"]
+    status = request.app[MESSAGE_BROKER].get_delivery_status(message_id=message_id)
+    if status is None:
+        return _respond(
+            message=f"No delivery status found for message {message_id}",
+            status_code=HttpStatus.HTTP_NOT_FOUND,
+        )
+    return web.json_response(
+        {"message_id": message_id, "subscribers": status}, status=HttpStatus.HTTP_OK
+    )
+
+
+@routes.get("/poll/{subscriber:.+}")
+async def poll_messages(request: web.Request) -> web.Response:
+    max_count = parse_max_count(request.query.get("max"))
+    if max_count is None:
+        return _respond(
+            message=f"max must be a number between 1 and {Config.POLL_MAX_BATCH}",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    wait = parse_wait(request.query.get("wait"))
+    if wait is None:
+        return _respond(
+            message=f"wait must be a number of seconds between 0 and {Config.LONG_POLL_MAX_WAIT}",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    batch = await _retrieve_messages(
+        request.app[MESSAGE_BROKER], request.match_info["subscriber"], max_count, wait
+    )
+    return web.Response(
+        body=encode_polled_batch(batch),
+        status=HttpStatus.HTTP_OK,
+        content_type="application/json",
+    )
+
+
+@routes.get("/dead_letters/{subscriber:.+}")
+async def poll_dead_letters(request: web.Request) -> web.Response:
+    max_count = parse_max_count(request.query.get("max"))
+    if max_count is None:
+        return _respond(
+            message=f"max must be a number between 1 and {Config.POLL_MAX_BATCH}",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    batch = await asyncio.to_thread(
+        request.app[MESSAGE_BROKER].retrieve_dead_letters,
+        subscriber=request.match_info["subscriber"],
+        max_count=max_count,
+    )
+    return web.Response(
+        body=encode_polled_batch(batch),
+        status=HttpStatus.HTTP_OK,
+        content_type="application/json",
+    )
+
+
+@routes.get("/stream/{subscriber:.+}")
+async def stream_messages(request: web.Request) -> web.StreamResponse:
+    response = web.StreamResponse(
+        headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+    )
+    await response.prepare(request)
+
+    message_broker = request.app[MESSAGE_BROKER]
+    subscriber = request.match_info["subscriber"]
+    while True:
+        batch = await _retrieve_messages(
+            message_broker,
+            subscriber,
+            Config.POLL_MAX_BATCH,
+            Config.STREAM_HEARTBEAT_INTERVAL,
+            peek=True,
+        )
+        if not batch.entries:
+            # comment line, keeps proxies from closing an idle stream
+            await response.write(b": keep-alive\n\n")
+        for entry in batch.entries:
+            await response.write(
+                b"id: %d\ndata: %s\n\n" % (entry.seq, entry.message.body)
+            )
+            # only reached once the event was written, a client that went away leaves it queued
+            await asyncio.to_thread(message_broker.ack_message, subscriber, entry.seq)
+
+
+@routes.get("/metrics")
+async def get_metrics(request: web.Request) -> web.Response:
+    # the gauges read the backlogs, which may be kept in SQLite
+    metrics = await asyncio.to_thread(REGISTRY.render)
+    return web.Response(
+        body=metrics.encode(),
+        status=HttpStatus.HTTP_OK,
+        headers={"Content-Type": METRICS_CONTENT_TYPE},
+    )
+
+
+@routes.get("/event")
+async def setup_event_subscriber(request: web.Request) -> web.Response:
+    messages = {}
+    count: int = 0
+
+    while True:
+        batch = await asyncio.to_thread(
+            request.app[MESSAGE_BROKER].retrieve_messages,
+            subscriber="http://localhost:8000/event",
+            max_count=Config.POLL_MAX_BATCH,
+        )
+        for entry in batch.entries:
+            messages[count] = entry.message.get("message")
+            count += 1
+        if batch.next_cursor is None:
+            break
+
+    return _respond(
+        message=f"Following messages were waiting: {messages}",
+        status_code=HttpStatus.HTTP_OK,
+    )
+
+
+@routes.post("/event")
+async def post_event(request: web.Request) -> web.Response:
+    if not request.app[SETTINGS]["allow_post_event"]:
+        return _respond(
+            message="/event is not accepting any POST requests at this time. Please try again later.",
+            status_code=HttpStatus.HTTP_SERVICE_UNAVAILABLE,
+        )
+
+    data = await _get_json(request)
+    print(f"Got the following data for POST /EVENT {data}")
+    return _respond(message="/event recieved data", status_code=HttpStatus.HTTP_OK)
+
+
+@routes.get("/toggle_post_event")
+async def toggle_post_event(request: web.Request) -> web.Response:
+    # handlers run on a single event loop, no lock needed
+    request.app[SETTINGS]["allow_post_event"] ^= True
+    return _respond(message="Endpoint toggled", status_code=HttpStatus.HTTP_OK)
+
+
+async def _on_startup(app: web.Application) -> None:
+    await app[DELIVERY_ENGINE].start()
+    # replaying the state reads from disk, off the event loop
+    await asyncio.to_thread(
+        recover_state,
+        app[STATE_BACKEND],
+        app[SUBSCRIPTION_MANAGER],
+        app[MESSAGE_BROKER],
+    )
+
+
+async def _on_cleanup(app: web.Application) -> None:
+    # background threads hand deliveries to the event loop, stop them while it still runs
+    await asyncio.to_thread(app[MESSAGE_BROKER].shutdown)
+    app[SUBSCRIPTION_MANAGER].shutdown()
+    await app[DELIVERY_ENGINE].close()
+    app[STATE_BACKEND].close()
+
+
+def create_app() -> web.Application:
+    delivery_engine = AsyncDeliveryEngine(
+        max_connections=Config.ASYNC_DELIVERY_MAX_CONNECTIONS,
+        max_connections_per_host=Config.ASYNC_DELIVERY_MAX_PER_HOST,
+        connect_timeout=Config.DELIVERY_CONNECT_TIMEOUT,
+        read_timeout=Config.DELIVERY_READ_TIMEOUT,
+    )
+    state_backend, subscription_manager, message_broker = create_state(
+        delivery_engine=delivery_engine
+    )
+
+    # oversized bodies are refused with 413 before they are parsed, aiohttp has no unlimited setting
+    app = web.Application(client_max_size=Config.MAX_REQUEST_BYTES or sys.maxsize)
+    app[DELIVERY_ENGINE] = delivery_engine
+    app[STATE_BACKEND] = state_backend
+    app[SUBSCRIPTION_MANAGER] = subscription_manager
+    app[MESSAGE_BROKER] = message_broker
+    app[PUBLISH_RATE_LIMITER] = create_publish_rate_limiter()
+    app[SETTINGS] = {"allow_post_event": False}
+    app.add_routes(routes)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=Config.SERVER_HOST, port=Config.SERVER_PORT)
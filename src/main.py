@@ -3,23 +3,62 @@ from flask import (
     request,
     jsonify,
 )
-from typing import List
-from manager.subscription_manager import SubscriptionManager
-from manager.message_broker import MessageBroker
+from typing import (
+    Tuple,
+)
+from app_common import (
+    create_publish_rate_limiter,
+    create_state,
+    encode_polled_batch,
+    is_async_publish,
+    parse_max_count,
+    parse_subscribe_batch,
+    parse_subscription_options,
+    parse_ttl,
+    parse_wait,
+    publish_result_to_json,
+    recover_state,
+    resolve_publish_batch,
+    retry_after_header,
+    subscribe_results,
+    validate_publish_batch,
+    PUBLISH_ACCEPTED,
+    PUBLISH_REJECTED,
+)
+from manager.message_broker import DispatchQueueFullError
+from manager.delivery_engine import DeliveryEngine
+from manager.journal import JournalError
+from utils.config import Config
+from utils.log import setup_logging
+from utils.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    REGISTRY,
+)
 from utils.response import Response
 from utils.validation import Validation
 from threading import Lock
 import utils.http_codes as HttpStatus
 import logging
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# oversized bodies are refused with 413 before they are read or parsed
+app.config["MAX_CONTENT_LENGTH"] = Config.MAX_REQUEST_BYTES or None
 ALLOW_POST_EVENT_ENDPOINT = False
-subscription_manager = SubscriptionManager()
-message_broker = MessageBroker()
+state_backend, subscription_manager, message_broker = create_state(
+    delivery_engine=DeliveryEngine(
+        max_workers=Config.DELIVERY_MAX_WORKERS,
+        max_hosts=Config.DELIVERY_MAX_HOSTS,
+        connect_timeout=Config.DELIVERY_CONNECT_TIMEOUT,
+        read_timeout=Config.DELIVERY_READ_TIMEOUT,
+    )
+)
 thread_lock = Lock()
+publish_rate_limiter = create_publish_rate_limiter()
+
+recover_state(state_backend, subscription_manager, message_broker)
 
 
 @app.route("/")
@@ -29,7 +68,9 @@ def hello_world():
 
 @app.route("/subscribers/<string:topic>", methods=["GET"])
 def get_subscription_info(topic: str):
-    topic_subscribers: List[str] = subscription_manager.get_subscribers(topic=topic)
+    topic_subscribers: Tuple[str, ...] = subscription_manager.get_subscribers(
+        topic=topic.strip()
+    )
     if topic_subscribers:
         return jsonify(topic_subscribers), HttpStatus.HTTP_OK
     return Response.create(
@@ -38,12 +79,51 @@ def get_subscription_info(topic: str):
     )
 
 
+@app.route("/subscribers/<string:topic>/breakers", methods=["GET"])
+def get_breaker_info(topic: str):
+    topic_subscribers: Tuple[str, ...] = subscription_manager.get_subscribers(
+        topic=topic.strip()
+    )
+    if topic_subscribers:
+        return (
+            jsonify(message_broker.get_breaker_states(topic_subscribers)),
+            HttpStatus.HTTP_OK,
+        )
+    return Response.create(
+        message="Topic either does not exist or has no subscribed endpoints",
+        status_code=HttpStatus.HTTP_NOT_FOUND,
+    )
+
+
+@app.route("/subscribe", methods=["POST"])
+def setup_subscription_batch():
+    data = request.get_json()
+    try:
+        results, indexes, subscriptions = parse_subscribe_batch(data)
+    except ValueError as e:
+        return Response.create(message=str(e), status_code=HttpStatus.HTTP_BAD_REQUEST)
+    logger.debug("Batch of %d subscriptions requested", len(data))
+
+    try:
+        subscribed = subscription_manager.subscribe_batch(subscriptions)
+    except JournalError:
+        return _not_persisted("Subscriptions")
+    return (
+        jsonify({"results": subscribe_results(results, indexes, subscribed)}),
+        HttpStatus.HTTP_OK,
+    )
+
+
 @app.route("/subscribe/<string:topic>", methods=["POST"])
 def setup_subscription(topic: str):
     data = request.get_json()
-    logger.info(f"Subscription requested for topic {topic} with data: {data}")
+    logger.info("Subscription requested for topic %s", topic)
 
-    if not data or "url" not in data or topic.strip() == "":
+    if (
+        not isinstance(data, dict)
+        or not isinstance(data.get("url"), str)
+        or topic.strip() == ""
+    ):
         return Response.create(
             message="Please check topic and URL again. At least one was not found.",
             status_code=HttpStatus.HTTP_BAD_REQUEST,
@@ -54,7 +134,24 @@ def setup_subscription(topic: str):
             message="Invalid URL provided.", status_code=HttpStatus.HTTP_BAD_REQUEST
         )
 
-    isSubscribed = subscription_manager.subscribe(topic=topic, endpoint=data["url"])
+    if not Validation.isValidTopicPattern(topic.strip()):
+        return Response.create(
+            message="Invalid topic, wildcards must fill a whole level and # may only be the last level",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    try:
+        options = parse_subscription_options(data)
+        ttl = parse_ttl(data)
+    except ValueError as e:
+        return Response.create(message=str(e), status_code=HttpStatus.HTTP_BAD_REQUEST)
+
+    try:
+        isSubscribed = subscription_manager.subscribe(
+            topic=topic, endpoint=data["url"], options=options, ttl=ttl
+        )
+    except JournalError:
+        return _not_persisted("Subscription")
     if isSubscribed:
         return Response.create(
             message=f"Subscription created successfully between {topic} and {data['url']}",
@@ -67,23 +164,119 @@ def setup_subscription(topic: str):
     )
 
 
-@app.route("/publish/<string:topic>", methods=["POST"])
-def publish_message(topic: str):
+@app.route("/subscribe/<string:topic>", methods=["DELETE"])
+def remove_subscription(topic: str):
     data = request.get_json()
-    logger.info(f"Message {data} is requested to be published for topic {topic}")
+    logger.info("Unsubscription requested for topic %s", topic)
+
+    if (
+        not isinstance(data, dict)
+        or not isinstance(data.get("url"), str)
+        or topic.strip() == ""
+    ):
+        return Response.create(
+            message="Please check topic and URL again. At least one was not found.",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    try:
+        unsubscribed = subscription_manager.unsubscribe(
+            topic=topic, endpoint=data["url"]
+        )
+    except JournalError:
+        return _not_persisted("Unsubscription")
+    if unsubscribed:
+        return Response.create(
+            message=f"Subscription removed between {topic} and {data['url']}",
+            status_code=HttpStatus.HTTP_OK,
+        )
+    return Response.create(
+        message=f"No subscription found between {topic} and {data['url']}",
+        status_code=HttpStatus.HTTP_NOT_FOUND,
+    )
+
+
+def _too_many_requests(retry_after: float):
+    response = Response.create(
+        message="Too many messages, please try again later",
+        status_code=HttpStatus.HTTP_TOO_MANY_REQUESTS,
+    )
+    response.headers.update(retry_after_header(retry_after))
+    return response
+
+
+def _not_persisted(what: str = "Message"):
+    return Response.create(
+        message=f"{what} could not be persisted, please try again later",
+        status_code=HttpStatus.HTTP_SERVICE_UNAVAILABLE,
+    )
+
+
+@app.route("/publish", methods=["POST"])
+def publish_batch():
+    data = request.get_json()
+    try:
+        results, valid = validate_publish_batch(data)
+    except ValueError as e:
+        return Response.create(message=str(e), status_code=HttpStatus.HTTP_BAD_REQUEST)
+    # a token per valid entry, taken before any subscriber lookup or broker work
+    if valid:
+        retry_after = publish_rate_limiter.acquire_publisher(
+            request.remote_addr, messages=len(valid)
+        )
+        if retry_after:
+            return _too_many_requests(retry_after)
+    indexes, entries = resolve_publish_batch(
+        results,
+        valid,
+        subscription_manager.get_subscribers,
+        acquire_topic=publish_rate_limiter.acquire_topic,
+    )
+    logger.debug("Batch of %d messages is requested to be published", len(data))
 
+    if is_async_publish(request.args.get("async")):
+        for i, (topic, subscribers, message) in zip(indexes, entries):
+            try:
+                message_id = message_broker.submit_message(
+                    topic=topic, subscribers=subscribers, message=message
+                )
+                results[i] = {"status": PUBLISH_ACCEPTED, "message_id": message_id}
+            except DispatchQueueFullError:
+                results[i] = {"status": PUBLISH_REJECTED}
+    elif entries:
+        try:
+            publish_results = message_broker.publish_batch(entries)
+        except JournalError:
+            return _not_persisted()
+        for i, result in zip(indexes, publish_results):
+            results[i] = publish_result_to_json(result)
+
+    return jsonify({"results": results}), HttpStatus.HTTP_OK
+
+
+@app.route("/publish/<string:topic>", methods=["POST"])
+def publish_message(topic: str):
     topic = topic.strip()
-    if not topic:
+    if not Validation.isValidTopic(topic):
         return Response.create(
             message="Invalid topic, please try again",
             status_code=HttpStatus.HTTP_BAD_REQUEST,
         )
+    data = request.get_json()
+    logger.debug("Message is requested to be published for topic %s", topic)
     if not data:
         return Response.create(
             message="No data found to send",
             status_code=HttpStatus.HTTP_BAD_REQUEST,
         )
 
+    # once the request is valid and before any subscriber lookup or broker work
+    retry_after = publish_rate_limiter.acquire_publisher(
+        request.remote_addr
+    ) or publish_rate_limiter.acquire_topic(topic)
+    if retry_after:
+        return _too_many_requests(retry_after)
+
     subscribers = subscription_manager.get_subscribers(topic=topic)
     if not subscribers:
         return Response.create(
@@ -91,18 +284,138 @@ def publish_message(topic: str):
             status_code=HttpStatus.HTTP_NOT_FOUND,
         )
 
-    failed_subscribers = message_broker.publish_message(
-        topic=topic, subscribers=subscribers, message=data
-    )
-    if not failed_subscribers:
+    if is_async_publish(request.args.get("async")):
+        try:
+            message_id = message_broker.submit_message(
+                topic=topic, subscribers=subscribers, message=data
+            )
+        except DispatchQueueFullError:
+            return Response.create(
+                message="Server is busy, please try again later",
+                status_code=HttpStatus.HTTP_SERVICE_UNAVAILABLE,
+            )
         return Response.create(
-            message="Message has been sent to all subscribers",
-            status_code=HttpStatus.HTTP_OK,
+            message="Message has been accepted for delivery",
+            status_code=HttpStatus.HTTP_ACCEPTED,
+            data={"message_id": message_id},
         )
-    return Response.create(
-        message=f"Message could not be sent to the following subscribers: {failed_subscribers}. \
+
+    try:
+        result = message_broker.publish_batch([(topic, subscribers, data)])[0]
+    except JournalError:
+        return _not_persisted()
+    if result.rejected:
+        return Response.create(
+            message="Message backlog is full, please try again later",
+            status_code=HttpStatus.HTTP_SERVICE_UNAVAILABLE,
+        )
+    if result.failed_subscribers:
+        return Response.create(
+            message=f"Message could not be sent to the following subscribers: {result.failed_subscribers}. \
             Please contact admin/support for more information.",
-        status_code=HttpStatus.HTTP_INTERNAL_ERR,
+            status_code=HttpStatus.HTTP_INTERNAL_ERR,
+        )
+    if result.queued_subscribers:
+        return Response.create(
+            message="Message has been queued for the next batch of some subscribers",
+            status_code=HttpStatus.HTTP_ACCEPTED,
+            data={"queued_subscribers": result.queued_subscribers},
+        )
+    return Response.create(
+        message="Message has been sent to all subscribers",
+        status_code=HttpStatus.HTTP_OK,
+    )
+
+
+@app.route("/publish/status/<string:message_id>", methods=["GET"])
+def get_publish_status(message_id: str):
+    status = message_broker.get_delivery_status(message_id=message_id)
+    if status is None:
+        return Response.create(
+            message=f"No delivery status found for message {message_id}",
+            status_code=HttpStatus.HTTP_NOT_FOUND,
+        )
+    return (
+        jsonify({"message_id": message_id, "subscribers": status}),
+        HttpStatus.HTTP_OK,
+    )
+
+
+@app.route("/poll/<path:subscriber>", methods=["GET"])
+def poll_messages(subscriber: str):
+    max_count = parse_max_count(request.args.get("max"))
+    if max_count is None:
+        return Response.create(
+            message=f"max must be a number between 1 and {Config.POLL_MAX_BATCH}",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    wait = parse_wait(request.args.get("wait"))
+    if wait is None:
+        return Response.create(
+            message=f"wait must be a number of seconds between 0 and {Config.LONG_POLL_MAX_WAIT}",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    batch = message_broker.retrieve_messages(
+        subscriber=subscriber, max_count=max_count, timeout=wait
+    )
+    return app.response_class(
+        encode_polled_batch(batch),
+        status=HttpStatus.HTTP_OK,
+        mimetype="application/json",
+    )
+
+
+@app.route("/dead_letters/<path:subscriber>", methods=["GET"])
+def poll_dead_letters(subscriber: str):
+    max_count = parse_max_count(request.args.get("max"))
+    if max_count is None:
+        return Response.create(
+            message=f"max must be a number between 1 and {Config.POLL_MAX_BATCH}",
+            status_code=HttpStatus.HTTP_BAD_REQUEST,
+        )
+
+    batch = message_broker.retrieve_dead_letters(
+        subscriber=subscriber, max_count=max_count
+    )
+    return app.response_class(
+        encode_polled_batch(batch),
+        status=HttpStatus.HTTP_OK,
+        mimetype="application/json",
+    )
+
+
+@app.route("/stream/<path:subscriber>", methods=["GET"])
+def stream_messages(subscriber: str):
+    def events():
+        while True:
+            batch = message_broker.peek_messages(
+                subscriber=subscriber,
+                max_count=Config.POLL_MAX_BATCH,
+                timeout=Config.STREAM_HEARTBEAT_INTERVAL,
+            )
+            if not batch.entries:
+                # comment line, keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            for entry in batch.entries:
+                yield b"id: %d\ndata: %s\n\n" % (entry.seq, entry.message.body)
+                # only reached once the event was written, a client that went away leaves it queued
+                message_broker.ack_message(subscriber, entry.seq)
+
+    return app.response_class(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return app.response_class(
+        REGISTRY.render(),
+        status=HttpStatus.HTTP_OK,
+        content_type=METRICS_CONTENT_TYPE,
     )
 
 
@@ -112,13 +425,14 @@ def setup_event_subscriber():
     count: int = 0
 
     while True:
-        message = message_broker.retrieve_message(
-            subscriber="http://localhost:8000/event"
+        batch = message_broker.retrieve_messages(
+            subscriber="http://localhost:8000/event",
+            max_count=Config.POLL_MAX_BATCH,
         )
-        if message:
-            messages[count] = message.get("message")
+        for entry in batch.entries:
+            messages[count] = entry.message.get("message")
             count += 1
-        else:
+        if batch.next_cursor is None:
             break
 
     return Response.create(
@@ -0,0 +1,182 @@
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+)
+from typing import (
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from manager.delivery_engine import (
+    DeliveryResult,
+    Payload,
+    payload_headers,
+)
+from utils.http_codes import HTTP_OK
+import aiohttp
+import asyncio
+import time
+
+
+class AsyncDeliveryEngine:
+    """
+    Delivers messages to subscriber webhooks with a non-blocking HTTP client, for asyncio servers.
+
+    All deliveries share one aiohttp ClientSession, so keep-alive connections are pooled per host. A delivery
+    waiting on a subscriber costs a suspended coroutine instead of a thread, which lets a single process keep
+    thousands of deliveries in flight.
+
+    Offers the same interface as DeliveryEngine so MessageBroker can use either. Publishes from the event loop
+    use the *_async methods, the broker's background threads (retries, batches, asynchronous dispatch) use the
+    blocking ones, which hand the work over to the event loop. Futures returned by submit() are resolved on a
+    small pool of threads of their own, so the broker's callbacks, which ack and may write to SQLite, never run
+    on the event loop.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 1000,
+        max_connections_per_host: int = 100,
+        connect_timeout: float = 2.0,
+        read_timeout: float = 5.0,
+        callback_workers: int = 4,
+    ) -> None:
+        """
+        :param max_connections: Upper bound of concurrent deliveries across all subscribers
+        :param max_connections_per_host: Upper bound of concurrent deliveries to a single host
+        :param connect_timeout: Seconds to wait for a TCP connection to a subscriber
+        :param read_timeout: Seconds to wait for a subscriber to answer once connected
+        :param callback_workers: Threads running the callbacks of the futures returned by submit()
+        """
+        self._max_connections = max_connections
+        self._max_connections_per_host = max_connections_per_host
+        self._timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._callbacks = ThreadPoolExecutor(
+            max_workers=callback_workers, thread_name_prefix="delivery-callback"
+        )
+
+    async def start(self) -> None:
+        """
+        Open the connection pool on the running event loop, must be called before the first delivery.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self._max_connections,
+                limit_per_host=self._max_connections_per_host,
+            ),
+            timeout=self._timeout,
+        )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def deliver_async(self, subscriber: str, payload: Payload) -> DeliveryResult:
+        """
+        POST an encoded message to a single subscriber. Never raises, failures are reported in the result.
+        """
+        start = time.perf_counter()
+        try:
+            async with self._session.post(
+                subscriber, data=payload, headers=payload_headers(payload)
+            ) as response:
+                if response.status == HTTP_OK:
+                    return DeliveryResult(
+                        subscriber=subscriber,
+                        delivered=True,
+                        status_code=response.status,
+                        elapsed=time.perf_counter() - start,
+                    )
+                return DeliveryResult(
+                    subscriber=subscriber,
+                    delivered=False,
+                    status_code=response.status,
+                    error=await response.text(),
+                    elapsed=time.perf_counter() - start,
+                )
+        except Exception as e:
+            return DeliveryResult(
+                subscriber=subscriber,
+                delivered=False,
+                error=str(e) or repr(e),
+                elapsed=time.perf_counter() - start,
+            )
+
+    async def deliver_many_async(
+        self, deliveries: Sequence[Tuple[str, Payload]]
+    ) -> List[DeliveryResult]:
+        """
+        Perform independent deliveries concurrently.
+
+        :return results: one result per delivery, in the same order as deliveries
+        """
+        return list(
+            await asyncio.gather(
+                *(
+                    self.deliver_async(subscriber, payload)
+                    for subscriber, payload in deliveries
+                )
+            )
+        )
+
+    def submit(self, subscriber: str, payload: Payload) -> Future:
+        """
+        Deliver a message from any thread but the event loop's without waiting for it.
+
+        :return future: resolves to the DeliveryResult, off the event loop
+        """
+        future: Future = Future()
+        asyncio.run_coroutine_threadsafe(
+            self.deliver_async(subscriber, payload), self._loop
+        ).add_done_callback(lambda delivery: self._resolve(future, delivery))
+        return future
+
+    def _resolve(self, future: Future, delivery: Future) -> None:
+        """
+        Runs on the event loop once a delivery is done, hands the result over to a callback thread.
+        """
+        if delivery.cancelled():
+            future.cancel()
+            return
+        try:
+            self._callbacks.submit(future.set_result, delivery.result())
+        except RuntimeError:
+            # shut down, nobody is left to act on the outcome
+            future.cancel()
+
+    def deliver(self, subscriber: str, payload: Payload) -> DeliveryResult:
+        """
+        Blocking delivery for threads other than the event loop's.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.deliver_async(subscriber, payload), self._loop
+        ).result()
+
+    def deliver_many(
+        self, deliveries: Sequence[Tuple[str, Payload]]
+    ) -> List[DeliveryResult]:
+        """
+        Blocking concurrent deliveries for threads other than the event loop's.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.deliver_many_async(deliveries), self._loop
+        ).result()
+
+    def fan_out(
+        self, subscribers: Sequence[str], payload: Payload
+    ) -> List[DeliveryResult]:
+        return self.deliver_many([(subscriber, payload) for subscriber in subscribers])
+
+    def shutdown(self) -> None:
+        """
+        Stop the callback threads once the pending callbacks ran, the connection pool is closed on the event
+        loop with close().
+        """
+        self._callbacks.shutdown()
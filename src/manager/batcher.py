@@ -0,0 +1,128 @@
+from itertools import count
+from threading import (
+    TIMEOUT_MAX,
+    Condition,
+    Thread,
+)
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+from manager.envelope import Envelope
+import heapq
+import logging
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (sequence number, message) of a queued message waiting in a batch
+BatchEntry = Tuple[int, Envelope]
+
+
+class DeliveryBatcher:
+    """
+    Collects messages per subscriber and flushes them as one batch once either the batch is full or the
+    oldest message in it has lingered for long enough.
+
+    Full batches are flushed by the thread adding the last message, lingering batches by a single timer
+    thread keyed on their deadlines. The flush handler must hand the actual delivery off and return quickly.
+    """
+
+    def __init__(self, flush: Callable[[str, List[BatchEntry]], None]) -> None:
+        """
+        :param flush: Called with the subscriber and the entries of a batch that is ready to be delivered
+        """
+        self._flush = flush
+        # subscriber -> (batch id, entries)
+        self._batches: Dict[str, Tuple[int, List[BatchEntry]]] = {}
+        # (deadline, batch id, subscriber)
+        self._deadlines: List[Tuple[float, int, str]] = []
+        self._batch_ids = count()
+        self._cond = Condition()
+        self._thread: Optional[Thread] = None
+        self._stopped = False
+
+    def add(
+        self,
+        subscriber: str,
+        seq: int,
+        message: Envelope,
+        max_size: int,
+        max_linger: float,
+    ) -> None:
+        """
+        Add a queued message to the subscriber's open batch.
+
+        :param max_size: Number of messages after which the batch is flushed straight away
+        :param max_linger: Seconds after which a batch is flushed even if it is not full
+        """
+        ready: Optional[List[BatchEntry]] = None
+        with self._cond:
+            if subscriber not in self._batches:
+                batch_id = next(self._batch_ids)
+                self._batches[subscriber] = (batch_id, [])
+                heapq.heappush(
+                    self._deadlines,
+                    (time.monotonic() + max_linger, batch_id, subscriber),
+                )
+                self._start()
+                self._cond.notify()
+
+            _, entries = self._batches[subscriber]
+            entries.append((seq, message))
+            if len(entries) >= max_size:
+                # the deadline left in the heap no longer matches a batch and is skipped
+                ready = self._batches.pop(subscriber)[1]
+
+        if ready:
+            self._flush(subscriber, ready)
+
+    def shutdown(self) -> None:
+        """
+        Stop the timer thread. Messages of open batches stay in the subscribers' backlogs.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread:
+            thread.join()
+
+    def _start(self) -> None:
+        if self._thread is None and not self._stopped:
+            self._thread = Thread(
+                target=self._run, name="delivery-batcher", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    if self._deadlines and self._deadlines[0][0] <= now:
+                        break
+                    self._cond.wait(
+                        min(self._deadlines[0][0] - now, TIMEOUT_MAX)
+                        if self._deadlines
+                        else None
+                    )
+                if self._stopped:
+                    return
+
+                ready: List[Tuple[str, List[BatchEntry]]] = []
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    _, batch_id, subscriber = heapq.heappop(self._deadlines)
+                    batch = self._batches.get(subscriber)
+                    if batch and batch[0] == batch_id:
+                        ready.append((subscriber, self._batches.pop(subscriber)[1]))
+
+            for subscriber, entries in ready:
+                try:
+                    self._flush(subscriber, entries)
+                except Exception as e:
+                    logger.error("Flushing batch for %s failed: %s", subscriber, e)
@@ -0,0 +1,80 @@
+from threading import Lock
+from typing import (
+    Any,
+    Dict,
+)
+import time
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker guarding deliveries to a single subscriber url.
+
+    closed: deliveries go through, consecutive failures are counted.
+    open: failure threshold reached, deliveries are skipped until the reset timeout has passed.
+    half-open: one probe delivery is let through, its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        """
+        :param failure_threshold: Consecutive failures after which the breaker opens
+        :param reset_timeout: Seconds an open breaker waits before letting a probe through
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = Lock()
+
+    def allow_request(self) -> bool:
+        """
+        :return allowed: True if a delivery may be attempted now
+        """
+        with self._lock:
+            if self._state == STATE_CLOSED:
+                return True
+            if (
+                self._state == STATE_OPEN
+                and time.monotonic() - self._opened_at >= self._reset_timeout
+            ):
+                self._state = STATE_HALF_OPEN
+                return True
+            # open, or half-open with its probe still in flight
+            return False
+
+    def retry_after(self) -> float:
+        """
+        :return seconds: time until an open breaker lets a probe through, 0 if it is not open
+        """
+        with self._lock:
+            if self._state != STATE_OPEN:
+                return 0.0
+            return max(self._opened_at + self._reset_timeout - time.monotonic(), 0.0)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = STATE_CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if (
+                self._state == STATE_HALF_OPEN
+                or self._failures >= self._failure_threshold
+            ):
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self._state, "consecutive_failures": self._failures}
@@ -0,0 +1,156 @@
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+)
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from requests.adapters import HTTPAdapter
+from manager.envelope import (
+    ENCODING_GZIP,
+    is_compressed,
+)
+from utils.http_codes import HTTP_OK
+import requests
+import time
+
+# JSON encoded body of a single message, or of a batch of messages for subscribers with batched delivery,
+# possibly gzip compressed for subscribers accepting it
+Payload = bytes
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+GZIP_JSON_HEADERS = {
+    "Content-Type": "application/json",
+    "Content-Encoding": ENCODING_GZIP,
+}
+
+
+def payload_headers(payload: Payload) -> Dict[str, str]:
+    """
+    Headers of a webhook POST, compressed payloads are sent with their Content-Encoding.
+    """
+    return GZIP_JSON_HEADERS if is_compressed(payload) else JSON_HEADERS
+
+
+class DeliveryResult(NamedTuple):
+    subscriber: str
+    delivered: bool
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    # seconds the POST took, until it failed or the subscriber answered
+    elapsed: float = 0.0
+
+
+class DeliveryEngine:
+    """
+    Delivers messages to subscriber webhooks.
+
+    All deliveries share one requests Session, so keep-alive connections are pooled per host and reused
+    across publishes. Fan-out runs on a bounded thread pool, which means a publish to N subscribers costs
+    roughly one round trip instead of N. Every request is bound by a connect and a read timeout so a slow
+    or dead endpoint can never hold a worker indefinitely.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 32,
+        max_hosts: int = 64,
+        connect_timeout: float = 2.0,
+        read_timeout: float = 5.0,
+    ) -> None:
+        """
+        :param max_workers: Upper bound of concurrent deliveries, also the connection pool size per host
+        :param max_hosts: Number of per-host connection pools kept alive
+        :param connect_timeout: Seconds to wait for a TCP connection to a subscriber
+        :param read_timeout: Seconds to wait for a subscriber to answer once connected
+        """
+        self._timeout = (connect_timeout, read_timeout)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=max_workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="delivery"
+        )
+
+    def deliver(self, subscriber: str, payload: Payload) -> DeliveryResult:
+        """
+        POST an encoded message to a single subscriber. Never raises, failures are reported in the result.
+        """
+        start = time.perf_counter()
+        try:
+            response = self._session.post(
+                url=subscriber,
+                data=payload,
+                headers=payload_headers(payload),
+                timeout=self._timeout,
+            )
+        except Exception as e:
+            return DeliveryResult(
+                subscriber=subscriber,
+                delivered=False,
+                error=str(e),
+                elapsed=time.perf_counter() - start,
+            )
+
+        elapsed = time.perf_counter() - start
+        if response.status_code == HTTP_OK:
+            return DeliveryResult(
+                subscriber=subscriber,
+                delivered=True,
+                status_code=response.status_code,
+                elapsed=elapsed,
+            )
+        return DeliveryResult(
+            subscriber=subscriber,
+            delivered=False,
+            status_code=response.status_code,
+            error=response.text,
+            elapsed=elapsed,
+        )
+
+    def submit(self, subscriber: str, payload: Payload) -> Future:
+        """
+        Deliver a message to a single subscriber on the worker pool without waiting for it.
+
+        :return future: resolves to the DeliveryResult
+        """
+        return self._executor.submit(self.deliver, subscriber, payload)
+
+    def fan_out(
+        self, subscribers: Sequence[str], payload: Payload
+    ) -> List[DeliveryResult]:
+        """
+        Deliver a message to all subscribers concurrently, the same encoded payload is sent to all of them.
+
+        :return results: one result per subscriber, in the same order as subscribers
+        """
+        return self.deliver_many([(subscriber, payload) for subscriber in subscribers])
+
+    def deliver_many(
+        self, deliveries: Sequence[Tuple[str, Payload]]
+    ) -> List[DeliveryResult]:
+        """
+        Perform independent deliveries concurrently, e.g. several messages to several subscribers.
+
+        :param deliveries: (subscriber, payload) pairs
+        :return results: one result per delivery, in the same order as deliveries
+        """
+        if len(deliveries) == 1:
+            # no point in paying for a thread hand-off
+            return [self.deliver(*deliveries[0])]
+
+        futures = [
+            self._executor.submit(self.deliver, subscriber, payload)
+            for subscriber, payload in deliveries
+        ]
+        return [future.result() for future in futures]
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._session.close()
@@ -0,0 +1,203 @@
+from collections.abc import Mapping
+from datetime import (
+    datetime,
+    timezone,
+)
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
+import base64
+import gzip
+import json
+import sys
+import uuid
+
+# the only content coding messages are stored and delivered with besides identity
+ENCODING_GZIP = "gzip"
+GZIP_MAGIC = b"\x1f\x8b"
+# favours speed, compression runs on the publish path
+GZIP_LEVEL = 1
+
+
+class Envelope(Mapping):
+    """
+    A published message as it is delivered to subscribers: the message itself plus its topic and timestamp,
+    JSON encoded once when it is published.
+
+    The encoded body is posted as is to every subscriber and the same envelope is shared by reference by
+    every backlog it is queued in, so a publish costs one encoding no matter how wide its fan-out is.
+    Envelopes are immutable, a publisher changing its message afterwards does not affect what was queued.
+
+    Backlogs may hold millions of envelopes, so they are kept compact: the id and the publish time are stored
+    as integers and the topic is interned, all messages of a topic share one string. Large bodies may be
+    kept gzip compressed, data then holds the compressed bytes and body decompresses them on access.
+
+    The mapping interface reads the delivered message, decoding the body on every access. It is meant for
+    the odd lookup, hot paths only ever touch the body.
+    """
+
+    __slots__ = ("_id", "topic", "published_at", "data")
+
+    def __init__(
+        self, message_id: int, topic: str, published_at: int, data: bytes
+    ) -> None:
+        """
+        :param message_id: Unique id of the message, a 128 bit integer
+        :param topic: Topic the message was published to
+        :param published_at: Time the message was published at, in microseconds since the epoch
+        :param data: JSON encoding of the message as delivered, or its gzip compression
+        """
+        object.__setattr__(self, "_id", message_id)
+        object.__setattr__(self, "topic", sys.intern(topic))
+        object.__setattr__(self, "published_at", published_at)
+        object.__setattr__(self, "data", data)
+
+    @classmethod
+    def create(
+        cls,
+        topic: str,
+        message: Dict[str, Any],
+        published_at: Optional[datetime] = None,
+        compress_threshold: int = 0,
+    ) -> "Envelope":
+        """
+        Seal a published message, the caller's dict is not modified.
+
+        :param published_at: Time of the publish, now if not given
+        :param compress_threshold: Bodies of at least this many bytes are kept compressed if that makes them
+            smaller, 0 never compresses
+        """
+        published_at = published_at or datetime.now(timezone.utc)
+        body = json.dumps(
+            {
+                **message,
+                "topic": topic,
+                "message_timestamp_utc": published_at.isoformat(),
+            },
+            separators=(",", ":"),
+        ).encode()
+        if compress_threshold and len(body) >= compress_threshold:
+            compressed = compress(body)
+            if len(compressed) < len(body):
+                body = compressed
+        return cls(
+            uuid.uuid4().int,
+            topic,
+            round(published_at.timestamp() * 1_000_000),
+            body,
+        )
+
+    @property
+    def body(self) -> bytes:
+        """
+        JSON encoding of the message as delivered.
+        """
+        data = self.data
+        return gzip.decompress(data) if is_compressed(data) else data
+
+    @property
+    def compressed(self) -> bool:
+        return is_compressed(self.data)
+
+    @property
+    def id(self) -> str:
+        """
+        Id of the message as handed out to publishers, 32 hexadecimal digits.
+        """
+        return f"{self._id:032x}"
+
+    @property
+    def timestamp(self) -> str:
+        """
+        ISO 8601 time the message was published at.
+        """
+        return datetime.fromtimestamp(
+            self.published_at / 1_000_000, timezone.utc
+        ).isoformat()
+
+    def to_record(self) -> List[Union[str, int]]:
+        """
+        Compact JSON compatible form, for journal records. Compressed bodies are kept compressed, base64
+        encoded and tagged with their encoding.
+        """
+        if self.compressed:
+            return [
+                self.id,
+                self.topic,
+                self.published_at,
+                base64.b64encode(self.data).decode(),
+                ENCODING_GZIP,
+            ]
+        return [self.id, self.topic, self.published_at, self.data.decode()]
+
+    @classmethod
+    def from_record(
+        cls, record: Union[List[Union[str, int]], Dict[str, Any]]
+    ) -> "Envelope":
+        """
+        Rebuild an envelope from to_record(), or from the plain message dict journaled by older versions.
+        """
+        if isinstance(record, dict):
+            return cls(
+                uuid.uuid4().int,
+                record.get("topic", ""),
+                _parse_timestamp(record.get("message_timestamp_utc")),
+                json.dumps(record, separators=(",", ":")).encode(),
+            )
+        message_id, topic, published_at, body, *encoding = record
+        if isinstance(published_at, str):
+            # records written before timestamps were stored as integers
+            published_at = _parse_timestamp(published_at)
+        data = base64.b64decode(body) if encoding else body.encode()
+        return cls(int(message_id, 16), topic, published_at, data)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("Envelopes are immutable")
+
+    def __getitem__(self, key: str) -> Any:
+        return json.loads(self.body)[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(json.loads(self.body))
+
+    def __len__(self) -> int:
+        return len(json.loads(self.body))
+
+    def __repr__(self) -> str:
+        return f"Envelope(id={self.id!r}, topic={self.topic!r}, data={self.data!r})"
+
+
+def _parse_timestamp(timestamp: Optional[str]) -> int:
+    """
+    Microseconds since the epoch of an ISO 8601 time, 0 if it is missing.
+    """
+    if not timestamp:
+        return 0
+    return round(datetime.fromisoformat(timestamp).timestamp() * 1_000_000)
+
+
+def compress(data: bytes) -> bytes:
+    """
+    gzip compression of a body, deterministic so equal bodies compress to equal bytes.
+    """
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def is_compressed(data: bytes) -> bool:
+    """
+    True if a body is gzip compressed, JSON never starts with the gzip magic number.
+    """
+    return data[:2] == GZIP_MAGIC
+
+
+def encode_batch(envelopes: Sequence[Envelope]) -> bytes:
+    """
+    JSON array of the given envelopes' bodies, built without decoding them.
+    """
+    return b"[" + b",".join(envelope.body for envelope in envelopes) + b"]"
@@ -0,0 +1,282 @@
+from threading import (
+    Condition,
+    Event,
+    Lock,
+    Thread,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+import json
+import logging
+import os
+import re
+import time
+import zlib
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SEGMENT_PATTERN = re.compile(r"^wal-(\d{8})\.log$")
+SNAPSHOT_PATTERN = re.compile(r"^snapshot-(\d{8})\.log$")
+
+# record operations
+OP_SUBSCRIBE = "sub"
+OP_UNSUBSCRIBE = "unsub"
+OP_ENQUEUE = "enq"
+OP_DELETE = "del"
+OP_SEQUENCE = "seq"
+OP_DROP = "drop"
+# records of dead-letter queues carry this kind, those of backlogs carry none
+KIND_DEAD_LETTERS = "dead"
+
+
+class JournalError(Exception):
+    """Raised when records cannot be made durable because writing the journal failed."""
+
+
+class Journal:
+    """
+    Append-only write-ahead log for broker and subscription state.
+
+    Records are appended to segment files, one checksummed JSON record per line. Appends only buffer the
+    record, a single flusher thread writes and fsyncs everything buffered in one go (group commit), so the
+    cost of an fsync is shared by all writers waiting on it. Callers that need durability wait on sync().
+
+    A checkpoint rotates to a new segment, writes a snapshot of the current state and deletes all older
+    segments, which keeps recovery bounded by the checkpoint interval. Replaying the records is idempotent,
+    so a snapshot does not need to be taken at an exact log position.
+
+    A failed write or fsync stops the journal for good: the state of the file is then unknown, e.g. after a
+    failed fsync the kernel may have dropped the unwritten pages. Every later sync() raises JournalError.
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        commit_interval: float = 0,
+    ) -> None:
+        """
+        :param data_dir: Directory holding segments and snapshots, created if missing
+        :param segment_bytes: Size after which the flusher rolls over to a new segment
+        :param commit_interval: Seconds the flusher waits to gather more records into one fsync
+        """
+        os.makedirs(data_dir, exist_ok=True)
+        self._data_dir = data_dir
+        self._segment_bytes = segment_bytes
+        self._commit_interval = commit_interval
+
+        existing = self._list(SEGMENT_PATTERN) + self._list(SNAPSHOT_PATTERN)
+        self._segment_index = max(existing, default=0) + 1
+        self._file = open(self._segment_path(self._segment_index), "ab")
+        self._file_lock = Lock()
+
+        self._buffer: List[bytes] = []
+        self._appended_lsn = 0
+        self._flushed_lsn = 0
+        self._closed = False
+        # why the flusher stopped, records are no longer made durable once set
+        self._error: Optional[Exception] = None
+        self._cond = Condition()
+        self._flusher = Thread(
+            target=self._flush_loop, name="journal-flusher", daemon=True
+        )
+        self._flusher.start()
+        self._checkpointer: Optional[Thread] = None
+        self._stopped = Event()
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """
+        Buffer a record for the next group commit. Does not wait for the disk.
+
+        :return lsn: log sequence number of the record, to be passed to sync()
+        """
+        payload = json.dumps(record, separators=(",", ":")).encode()
+        line = b"%08x %s\n" % (zlib.crc32(payload), payload)
+        with self._cond:
+            if self._error is None:
+                self._buffer.append(line)
+            self._appended_lsn += 1
+            self._cond.notify_all()
+            return self._appended_lsn
+
+    def sync(self, lsn: Optional[int] = None) -> None:
+        """
+        Block until the record with the given lsn, or everything appended so far, is fsynced.
+
+        :raises JournalError: if the record could not be written
+        """
+        with self._cond:
+            target = self._appended_lsn if lsn is None else lsn
+            self._cond.wait_for(
+                lambda: self._flushed_lsn >= target
+                or self._closed
+                or self._error is not None
+            )
+            if self._flushed_lsn < target and self._error is not None:
+                raise JournalError(
+                    f"Journal write failed: {self._error}"
+                ) from self._error
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the records of the latest snapshot followed by all records appended after it.
+        A torn or corrupt record ends its segment, everything before it is kept.
+        """
+        snapshots = [
+            index
+            for index in self._list(SNAPSHOT_PATTERN)
+            if index < self._segment_index
+        ]
+        start = 0
+        if snapshots:
+            start = snapshots[-1]
+            yield from self._read(self._snapshot_path(start))
+
+        for index in self._list(SEGMENT_PATTERN):
+            if start <= index < self._segment_index:
+                yield from self._read(self._segment_path(index))
+
+    def checkpoint(self, records: Iterable[Dict[str, Any]]) -> None:
+        """
+        Write a snapshot of the given state records and drop the segments it supersedes.
+        The state must be captured after this call started, i.e. records must be a lazy iterable.
+        """
+        self.sync()
+        with self._file_lock:
+            self._rotate()
+            index = self._segment_index
+
+        temp_path = self._snapshot_path(index) + ".tmp"
+        with open(temp_path, "wb") as snapshot:
+            for record in records:
+                payload = json.dumps(record, separators=(",", ":")).encode()
+                snapshot.write(b"%08x %s\n" % (zlib.crc32(payload), payload))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temp_path, self._snapshot_path(index))
+
+        for old in self._list(SEGMENT_PATTERN):
+            if old < index:
+                os.remove(self._segment_path(old))
+        for old in self._list(SNAPSHOT_PATTERN):
+            if old < index:
+                os.remove(self._snapshot_path(old))
+        logger.info("Journal checkpoint written at segment %d", index)
+
+    def start_checkpointing(
+        self, records: Callable[[], Iterable[Dict[str, Any]]], interval: float
+    ) -> None:
+        """
+        Run checkpoint() every interval seconds in a background thread.
+
+        :param records: Called on every checkpoint to capture the current state
+        """
+
+        def checkpoint_loop() -> None:
+            while not self._stopped.wait(interval):
+                try:
+                    self.checkpoint(records())
+                except Exception as e:
+                    logger.error("Journal checkpoint failed: %s", e)
+
+        self._checkpointer = Thread(
+            target=checkpoint_loop, name="journal-checkpoint", daemon=True
+        )
+        self._checkpointer.start()
+
+    def close(self) -> None:
+        """
+        Flush everything appended so far and stop the background threads.
+        """
+        try:
+            self.sync()
+        except JournalError:
+            # already logged by the flusher, nothing more can be written
+            pass
+        self._stopped.set()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        if self._checkpointer:
+            self._checkpointer.join()
+        with self._file_lock:
+            self._file.close()
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._closed)
+                if not self._buffer:
+                    return
+            if self._commit_interval:
+                # let more writers join this commit
+                time.sleep(self._commit_interval)
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+                lsn = self._appended_lsn
+
+            try:
+                with self._file_lock:
+                    self._file.write(b"".join(batch))
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    if self._file.tell() >= self._segment_bytes:
+                        self._rotate()
+            except Exception as e:
+                logger.error(
+                    "Journal write failed, records are no longer persisted: %s", e
+                )
+                with self._cond:
+                    self._error = e
+                    self._buffer = []
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self._flushed_lsn = lsn
+                self._cond.notify_all()
+
+    def _rotate(self) -> None:
+        """Switch appends to a new segment. Must be called with the file lock held."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment_index += 1
+        self._file = open(self._segment_path(self._segment_index), "ab")
+
+    def _read(self, path: str) -> Iterator[Dict[str, Any]]:
+        with open(path, "rb") as file:
+            for line in file:
+                checksum, _, payload = line.rstrip(b"\n").partition(b" ")
+                try:
+                    valid = int(checksum, 16) == zlib.crc32(payload)
+                except ValueError:
+                    valid = False
+                if not valid:
+                    logger.error(
+                        "Corrupt journal record in %s, ignoring the rest", path
+                    )
+                    return
+                yield json.loads(payload)
+
+    def _list(self, pattern: re.Pattern) -> List[int]:
+        return sorted(
+            int(match.group(1))
+            for match in map(pattern.match, os.listdir(self._data_dir))
+            if match
+        )
+
+    def _segment_path(self, index: int) -> str:
+        return os.path.join(self._data_dir, f"wal-{index:08d}.log")
+
+    def _snapshot_path(self, index: int) -> str:
+        return os.path.join(self._data_dir, f"snapshot-{index:08d}.log")
@@ -1,87 +1,1153 @@
-from collections import deque
+from collections import OrderedDict
+from contextlib import ExitStack
 from typing import (
+    Any,
+    Callable,
     Dict,
+    Iterator,
     List,
+    NamedTuple,
     Optional,
+    Sequence,
+    Set,
+    Tuple,
 )
 from datetime import (
     datetime,
     timezone,
 )
-from utils.http_codes import HTTP_OK
-from threading import Lock
+from manager.delivery_engine import (
+    DeliveryEngine,
+    DeliveryResult,
+    Payload,
+)
+from manager.envelope import (
+    Envelope,
+    compress,
+    encode_batch,
+)
+from manager.batcher import (
+    BatchEntry,
+    DeliveryBatcher,
+)
+from manager.rate_limiter import TokenBucketLimiter
+from manager.retry_scheduler import RetryScheduler
+from manager.circuit_breaker import CircuitBreaker
+from manager.journal import (
+    Journal,
+    KIND_DEAD_LETTERS,
+    OP_DELETE,
+    OP_DROP,
+    OP_ENQUEUE,
+    OP_SEQUENCE,
+)
+from manager.subscriber_queue import (
+    BacklogBudget,
+    BacklogFullError,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_REJECT,
+    QueueEntry,
+    SubscriberQueue,
+)
+from manager.state_backend import (
+    MemoryStateBackend,
+    StateBackend,
+)
+from manager.subscription_manager import SubscriptionOptions
+from utils.log import LogSampler
+from utils.metrics import REGISTRY
+from threading import (
+    Event,
+    Lock,
+    Thread,
+)
+import asyncio
 import logging
-import requests
-import traceback
+import queue
+import sys
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+PUBLISH_SECONDS = REGISTRY.histogram(
+    "leafi_publish_seconds",
+    "Time taken by synchronous publishes, from sealing the messages to the outcome of their deliveries",
+)
+PUBLISHED_MESSAGES = REGISTRY.counter(
+    "leafi_published_messages_total", "Messages published"
+)
+DELIVERY_SECONDS = REGISTRY.histogram(
+    "leafi_delivery_seconds",
+    "Time taken by webhook POSTs, per subscriber",
+    ("subscriber",),
+)
+DELIVERIES = REGISTRY.counter(
+    "leafi_deliveries_total",
+    "Webhook POSTs attempted, per subscriber and outcome",
+    ("subscriber", "outcome"),
+)
+RETRIES = REGISTRY.counter(
+    "leafi_retries_total",
+    "Webhook redeliveries attempted, per subscriber",
+    ("subscriber",),
+)
+DEAD_LETTERED = REGISTRY.counter(
+    "leafi_dead_lettered_total",
+    "Messages dead-lettered after their redeliveries ran out, per subscriber",
+    ("subscriber",),
+)
+POLLED_MESSAGES = REGISTRY.counter(
+    "leafi_polled_messages_total",
+    "Messages handed out to pollers, per subscriber",
+    ("subscriber",),
+)
+LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    "leafi_queue_lock_wait_seconds",
+    "Time spent waiting for subscriber queue locks, per operation",
+    ("operation",),
+    buckets=(0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0),
+)
+
+DELIVERY_PENDING = "pending"
+# handed to the batcher, sent with the subscriber's next batch
+DELIVERY_QUEUED = "queued"
+DELIVERY_DELIVERED = "delivered"
+DELIVERY_FAILED = "failed"
+DELIVERY_DEAD_LETTERED = "dead_lettered"
+
+
+class PolledBatch(NamedTuple):
+    entries: List[QueueEntry]
+    # sequence number of the next waiting message, None once the backlog is drained
+    next_cursor: Optional[int]
+
+
+class PublishResult(NamedTuple):
+    # subscribers that did not receive the message, it is kept in their backlog
+    failed_subscribers: List[str]
+    # True if the message was not queued at all because a backlog is full
+    rejected: bool = False
+    # subscribers with batched delivery, the message goes out with their next batch
+    queued_subscribers: List[str] = []
+
+
+# a published message and the subscribers to deliver it to
+_Sealed = Tuple[Envelope, Sequence[str]]
+
+
+class _PendingBatch(NamedTuple):
+    entries: Sequence[_Sealed]
+    sequence_numbers: List[Dict[str, Optional[int]]]
+    queues: Dict[str, SubscriberQueue]
+    # indexes of entries rejected because of a full backlog
+    rejected: Set[int]
+    # subscribers that did not receive each entry, so far
+    failed: List[Set[str]]
+    # batched subscribers each entry was handed to the batcher for
+    queued: List[Set[str]]
+    # (entry index, subscriber) of every delivery to attempt
+    targets: List[Tuple[int, str]]
+    # (subscriber, encoded message) of every delivery to attempt, in the same order as targets
+    deliveries: List[Tuple[str, Payload]]
+
+
+class DispatchQueueFullError(Exception):
+    """Raised when an asynchronous publish cannot be accepted because the dispatch queue is full."""
+
+
 class MessageBroker:
-    def __init__(self) -> None:
-        self._messages_map: Dict[str, deque] = {}
+    def __init__(
+        self,
+        delivery_engine: Optional[DeliveryEngine] = None,
+        dispatch_workers: int = 4,
+        dispatch_queue_size: int = 10000,
+        status_retention: int = 10000,
+        max_queue_messages: int = 0,
+        max_queue_bytes: int = 0,
+        max_total_messages: int = 0,
+        max_total_bytes: int = 0,
+        overflow_policy: str = OVERFLOW_DROP_OLDEST,
+        journal: Optional[Journal] = None,
+        retry_max_attempts: int = 0,
+        retry_base_delay: float = 1.0,
+        retry_max_delay: float = 300.0,
+        dead_letter_max_messages: int = 1000,
+        breaker_failure_threshold: int = 5,
+        breaker_reset_timeout: float = 30.0,
+        subscription_options: Optional[
+            Callable[[str], Optional[SubscriptionOptions]]
+        ] = None,
+        state_backend: Optional[StateBackend] = None,
+        compress_threshold: int = 0,
+        delivery_rate_limiter: Optional[TokenBucketLimiter] = None,
+    ) -> None:
+        """
+        :param delivery_engine: Engine used to POST messages to subscribers
+        :param dispatch_workers: Number of background workers draining asynchronous publishes
+        :param dispatch_queue_size: Maximum number of asynchronous publishes waiting for a worker
+        :param status_retention: Number of most recent asynchronous publishes whose delivery status is kept
+        :param max_queue_messages: Maximum number of messages queued per subscriber, 0 for unlimited
+        :param max_queue_bytes: Maximum bytes queued per subscriber, 0 for unlimited
+        :param max_total_messages: Maximum number of messages queued across all subscribers, 0 for unlimited
+        :param max_total_bytes: Maximum bytes queued across all subscribers, 0 for unlimited
+        :param overflow_policy: What to do when a cap is reached: drop-oldest, drop-newest or reject
+        :param journal: Write-ahead log that queued messages and acks are persisted to, unless a state
+            backend is given
+        :param retry_max_attempts: Default number of webhook redeliveries of a failed message, 0 disables retries
+        :param retry_base_delay: Delay in seconds before the first redelivery, doubled for every further attempt
+        :param retry_max_delay: Upper bound of the delay between two redeliveries
+        :param dead_letter_max_messages: Number of dead-lettered messages kept per subscriber
+        :param breaker_failure_threshold: Consecutive failures after which deliveries to a subscriber are skipped
+        :param breaker_reset_timeout: Seconds before a delivery to a skipped subscriber is attempted again
+        :param subscription_options: Looks up the delivery options a subscriber subscribed with
+        :param state_backend: Where backlogs are kept, in memory and persisted to journal by default
+        :param compress_threshold: Messages encoded to at least this many bytes are kept gzip compressed in
+            backlogs and sent compressed to subscribers accepting gzip, 0 disables compression
+        :param delivery_rate_limiter: Webhook POSTs per second allowed per subscriber, messages over the rate
+            stay queued and are retried later
+        """
+        self._messages_map: Dict[str, SubscriberQueue] = {}
+        # listeners waiting for the first message of a subscriber that has no queue yet, moved to its queue
+        # once created, so waiting for an unknown subscriber creates nothing that outlives the wait
+        self._watchers: Dict[str, List[Callable[[], None]]] = {}
+        # guards creation of queues and workers only, every queue has its own lock
         self._lock = Lock()
+        self._delivery_engine = delivery_engine or DeliveryEngine()
+
+        self._max_queue_messages = max_queue_messages
+        self._max_queue_bytes = max_queue_bytes
+        self._overflow_policy = overflow_policy
+        self._budget = BacklogBudget(
+            max_messages=max_total_messages, max_bytes=max_total_bytes
+        )
+        self._state_backend = state_backend or MemoryStateBackend(journal=journal)
+        self._journal = self._state_backend.journal
+        # highest sequence number of a dropped queue, new queues start past it so that retries and batches
+        # still pending for a dropped queue never match a message of a later one
+        self._seq_floor = 0
+        self._subscription_options = subscription_options
+        self._compress_threshold = compress_threshold
+        self._delivery_rate_limiter = delivery_rate_limiter
+        # failures can happen for every message of a subscriber, only a sample of them is logged
+        self._failure_log_sampler = LogSampler()
+
+        self._retry_scheduler = RetryScheduler(
+            handler=self._redeliver,
+            max_attempts=retry_max_attempts,
+            base_delay=retry_base_delay,
+            max_delay=retry_max_delay,
+            max_attempts_override=self._get_max_attempts,
+        )
+        self._batcher = DeliveryBatcher(flush=self._flush_batch)
+        self._dead_letters_map: Dict[str, SubscriberQueue] = {}
+        self._dead_letter_max_messages = dead_letter_max_messages
+
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._breaker_failure_threshold = breaker_failure_threshold
+        self._breaker_reset_timeout = breaker_reset_timeout
+
+        self._dispatch_queue: queue.Queue = queue.Queue(maxsize=dispatch_queue_size)
+        self._dispatch_workers_count = dispatch_workers
+        self._dispatch_workers: List[Thread] = []
+        self._status_retention = status_retention
+        self._delivery_status: OrderedDict[str, Dict[str, str]] = OrderedDict()
+        self._status_lock = Lock()
 
     def publish_message(
-        self, topic: str, subscribers: List[str], message: Dict[str, str]
+        self, topic: str, subscribers: Sequence[str], message: Dict[str, str]
     ) -> List:
         """
         Method publishes messages to all subscribers for a given topic.
         If a subscriber is unable to receive messages at this time, they're stored for polling at a later time.
+        Subscribers with batched delivery get the message with their next batch, they are not reported as
+        failed, see publish_batch() for a result that lists them.
 
         :return failed_subscribers_list: returns a list of subscribers that did not receive the message
+        :raises BacklogFullError: if a backlog cap is reached and the overflow policy is reject
         """
-        logger.info(f"Publishing message for topic: {topic}")
-        message["topic"] = topic
-        message["message_timestamp_utc"] = datetime.now(timezone.utc).isoformat()
+        result = self.publish_batch([(topic, subscribers, message)])[0]
+        if result.rejected:
+            raise BacklogFullError(f"Backlog is full, message for {topic} rejected")
+        return result.failed_subscribers
 
-        failed_subscribers = []
+    def publish_batch(
+        self, entries: Sequence[Tuple[str, Sequence[str], Dict[str, str]]]
+    ) -> List[PublishResult]:
+        """
+        Publish many messages, each to the subscribers of its topic, in one go.
+
+        Every message is sealed into an Envelope, i.e. encoded once, then enqueued grouped by subscriber,
+        taking every queue lock once for the whole batch, made durable with a single journal sync and
+        delivered concurrently. The callers' dicts are not modified. Entries are independent of each other:
+        an entry that hits a full backlog under the reject policy is rejected as a whole without affecting
+        the others.
+
+        :param entries: (topic, subscribers, message) per message to publish
+        :return results: one result per entry, in the same order as entries
+        """
+        start = time.perf_counter()
+        results = self._publish(self._seal(entries))
+        PUBLISH_SECONDS.observe(time.perf_counter() - start)
+        return results
 
+    async def publish_batch_async(
+        self, entries: Sequence[Tuple[str, Sequence[str], Dict[str, str]]]
+    ) -> List[PublishResult]:
+        """
+        Same as publish_batch() for asyncio servers, the webhook deliveries are awaited instead of blocking.
+        The broker must have been given a delivery engine with deliver_many_async().
+        """
+        start = time.perf_counter()
+        sealed = self._seal(entries)
+        # waiting for the journal to be synced, or writing to the shared state, must not stall the event loop
+        blocking = bool(self._journal) or self._state_backend.shared
+        if blocking:
+            pending = await asyncio.to_thread(self._enqueue_batch, sealed)
+        else:
+            pending = self._enqueue_batch(sealed)
+        results = (
+            await self._delivery_engine.deliver_many_async(pending.deliveries)
+            if pending.deliveries
+            else []
+        )
+        if blocking:
+            publish_results = await asyncio.to_thread(
+                self._complete_batch, pending, results
+            )
+        else:
+            publish_results = self._complete_batch(pending, results)
+        PUBLISH_SECONDS.observe(time.perf_counter() - start)
+        return publish_results
+
+    def retrieve_message(self, subscriber: str) -> Optional[Envelope]:
+        """
+        Poll one message at a time for a given subscriber.
+
+        TODO: ONLY THE TRUE SUBSCRIBER CAN CALL THIS! URL X CANNOT FETCH FOR Y.
+            THIS WOULD REQUIRE AN AUTHENTICATION LAYER, OUT OF SCOPE AT THE MOMENT
+        """
+        subscriber_queue = self._find_queue(subscriber)
+        if subscriber_queue is None:
+            return None
+        entry = subscriber_queue.popleft()
+        if entry is None:
+            return None
+        POLLED_MESSAGES.inc(subscriber)
+        return entry.message
+
+    def retrieve_messages(
+        self, subscriber: str, max_count: int, timeout: float = 0
+    ) -> PolledBatch:
+        """
+        Poll up to max_count messages at once for a given subscriber, oldest first.
+        The batch is drained in a single critical section.
+
+        :param timeout: Seconds to wait for a message if the backlog is empty (long polling).
+            Waiting parks the caller on the subscriber's queue, it does not spin.
+        :return batch: polled entries and the cursor of the next waiting message
+        """
+        return self._poll(subscriber, max_count, timeout, remove=True)
+
+    def peek_messages(
+        self, subscriber: str, max_count: int, timeout: float = 0
+    ) -> PolledBatch:
+        """
+        Like retrieve_messages(), but the entries stay queued until acked with ack_message(), for consumers
+        that must not lose a message they failed to hand on, e.g. an event stream whose client went away.
+        """
+        return self._poll(subscriber, max_count, timeout, remove=False)
+
+    def ack_message(self, subscriber: str, seq: int) -> bool:
+        """
+        Remove an entry returned by peek_messages().
+
+        :return acked: True if the entry was still queued
+        """
+        subscriber_queue = self._messages_map.get(subscriber)
+        if subscriber_queue is None or not subscriber_queue.ack(seq):
+            return False
+        POLLED_MESSAGES.inc(subscriber)
+        return True
+
+    def _poll(
+        self, subscriber: str, max_count: int, timeout: float, remove: bool
+    ) -> PolledBatch:
+        subscriber_queue = self._find_queue(subscriber)
+        if subscriber_queue is None and timeout > 0:
+            # nothing was ever queued for it, wait for a first message without creating its queue
+            deadline = time.monotonic() + timeout
+            arrived = Event()
+            listener = arrived.set
+            self.watch(subscriber, listener)
+            try:
+                subscriber_queue = self._find_queue(subscriber)
+                if subscriber_queue is None:
+                    arrived.wait(timeout)
+                    subscriber_queue = self._find_queue(subscriber)
+            finally:
+                self.unwatch(subscriber, listener)
+            timeout = deadline - time.monotonic()
+        if subscriber_queue is None:
+            return PolledBatch(entries=[], next_cursor=None)
+
+        start = time.perf_counter()
+        with subscriber_queue.lock:
+            LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, "poll")
+            if timeout > 0:
+                subscriber_queue.wait(timeout)
+            if remove:
+                entries = subscriber_queue.popleft_many(max_count)
+                next_cursor = subscriber_queue.head_seq()
+            else:
+                entries = subscriber_queue.peek_many(max_count)
+                next_cursor = entries[0].seq if entries else None
+        if entries and remove:
+            POLLED_MESSAGES.inc(subscriber, amount=len(entries))
+        return PolledBatch(entries=entries, next_cursor=next_cursor)
+
+    def watch(self, subscriber: str, listener: Callable[[], None]) -> None:
+        """
+        Call listener every time a message is queued for the subscriber, see SubscriberQueue.add_listener().
+        Lets asyncio servers long poll without parking a thread per waiter. Watching a subscriber nothing was
+        queued for yet does not create its queue, call unwatch() once done.
+        """
+        subscriber_queue = self._find_queue(subscriber)
+        if subscriber_queue is None:
+            with self._lock:
+                subscriber_queue = self._messages_map.get(subscriber)
+                if subscriber_queue is None:
+                    self._watchers.setdefault(subscriber, []).append(listener)
+                    return
+        subscriber_queue.add_listener(listener)
+
+    def unwatch(self, subscriber: str, listener: Callable[[], None]) -> None:
+        with self._lock:
+            listeners = self._watchers.get(subscriber)
+            if listeners is not None and listener in listeners:
+                listeners.remove(listener)
+                if not listeners:
+                    del self._watchers[subscriber]
+                return
+        subscriber_queue = self._messages_map.get(subscriber)
+        if subscriber_queue is not None:
+            subscriber_queue.remove_listener(listener)
+
+    def retrieve_dead_letters(self, subscriber: str, max_count: int) -> PolledBatch:
+        """
+        Poll up to max_count messages that exhausted their webhook redeliveries for a given subscriber.
+        """
+        dead_letters = (
+            self._get_dead_letters(subscriber)
+            if self._state_backend.shared
+            else self._dead_letters_map.get(subscriber)
+        )
+        if dead_letters is None:
+            return PolledBatch(entries=[], next_cursor=None)
+
+        with dead_letters.lock:
+            entries = dead_letters.popleft_many(max_count)
+            next_cursor = dead_letters.head_seq()
+        return PolledBatch(entries=entries, next_cursor=next_cursor)
+
+    def get_breaker_states(
+        self, subscribers: Sequence[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Circuit breaker state of each given subscriber, subscribers never delivered to are reported closed.
+        """
+        return {
+            subscriber: self._get_breaker(subscriber).to_dict()
+            for subscriber in subscribers
+        }
+
+    def remove_subscriber(self, subscriber: str) -> int:
+        """
+        Reclaim everything held for a subscriber that has no subscriptions left: its backlog, dead letters
+        and circuit breaker. Pending retries and open batches of it are skipped once they come due.
+
+        :return dropped: number of backlog messages dropped
+        """
         with self._lock:
+            subscriber_queue = self._messages_map.pop(subscriber, None)
+            dead_letters = self._dead_letters_map.pop(subscriber, None)
+            self._breakers.pop(subscriber, None)
+            if subscriber_queue is not None and not self._state_backend.shared:
+                self._seq_floor = max(self._seq_floor, subscriber_queue.last_seq)
+        for metric in (DELIVERY_SECONDS, DELIVERIES, RETRIES, DEAD_LETTERED):
+            metric.remove(subscriber)
+        POLLED_MESSAGES.remove(subscriber)
+        if self._state_backend.shared:
+            # the backlog may have been created by another process, drop it from the shared state all the same
+            subscriber_queue = subscriber_queue or self._create_queue(subscriber)
+            dead_letters = dead_letters or self._create_dead_letters(subscriber)
+        if dead_letters is not None:
+            dead_letters.clear()
+        if subscriber_queue is None:
+            return 0
+        dropped = subscriber_queue.clear()
+        logger.info("Reclaimed backlog of %d messages for %s", dropped, subscriber)
+        return dropped
+
+    def submit_message(
+        self, topic: str, subscribers: Sequence[str], message: Dict[str, str]
+    ) -> str:
+        """
+        Accept a message for asynchronous publishing and return straight away.
+        Delivery is performed by background workers, outcome can be looked up with get_delivery_status().
+
+        :return message_id: id to look up the delivery status with
+        :raises DispatchQueueFullError: if the dispatch queue is full
+        """
+        self._start_dispatch_workers()
+        # sealed right away, later changes to the message by the caller are not published
+        envelope = self._seal([(topic, subscribers, message)])[0][0]
+        message_id = envelope.id
+
+        with self._status_lock:
+            self._delivery_status[message_id] = {
+                subscriber: DELIVERY_PENDING for subscriber in subscribers
+            }
+            while len(self._delivery_status) > self._status_retention:
+                self._delivery_status.popitem(last=False)
+
+        try:
+            self._dispatch_queue.put_nowait((envelope, subscribers))
+        except queue.Full:
+            with self._status_lock:
+                self._delivery_status.pop(message_id, None)
+            raise DispatchQueueFullError(
+                f"Dispatch queue is full, could not accept message for topic {topic}"
+            )
+
+        logger.debug("Accepted message %s for topic %s", message_id, topic)
+        return message_id
+
+    def get_delivery_status(self, message_id: str) -> Optional[Dict[str, str]]:
+        """
+        Look up the per subscriber delivery outcome of an asynchronously published message.
+
+        The first attempt sets a subscriber to delivered or failed, or to queued if it takes batched
+        deliveries until its batch was sent. A later redelivery can still turn failed into delivered and
+        retries running out turn it into dead_lettered.
+
+        :return status: map of subscriber to pending/queued/delivered/failed/dead_lettered, None if the
+            message id is unknown
+        """
+        with self._status_lock:
+            status = self._delivery_status.get(message_id)
+            return dict(status) if status is not None else None
+
+    def _update_status(self, envelope: Envelope, subscriber: str, state: str) -> None:
+        """
+        Record a later outcome of a message published with submit_message(), other messages have no status.
+        """
+        if not self._delivery_status:
+            return
+        with self._status_lock:
+            status = self._delivery_status.get(envelope.id)
+            if status is not None and subscriber in status:
+                status[subscriber] = state
+
+    def queue_stats(self) -> List[Tuple[str, int, int]]:
+        """
+        (subscriber, messages, bytes) of every backlog held by this broker, for metrics.
+        """
+        return [
+            (subscriber, len(subscriber_queue), subscriber_queue.bytes)
+            for subscriber, subscriber_queue in list(self._messages_map.items())
+        ]
+
+    def restore(self, record: Dict[str, Any]) -> None:
+        """
+        Apply a journal record while recovering the backlogs and dead letters at startup.
+        """
+        op = record["op"]
+        dead_letters = record.get("kind") == KIND_DEAD_LETTERS
+        if op == OP_DROP:
+            queues = self._dead_letters_map if dead_letters else self._messages_map
+            dropped = queues.pop(record["sub"], None)
+            if dropped is not None:
+                dropped.discard()
+            return
+        if op not in (OP_ENQUEUE, OP_DELETE, OP_SEQUENCE):
+            return
+        subscriber_queue = (
+            self._get_dead_letters(record["sub"])
+            if dead_letters
+            else self._get_queue(record["sub"])
+        )
+        if op == OP_ENQUEUE:
+            subscriber_queue.restore(
+                record["seq"], Envelope.from_record(record["msg"]), record["size"]
+            )
+        elif op == OP_DELETE:
+            subscriber_queue.discard(record["seqs"])
+        else:
+            subscriber_queue.restore_sequence(record["seq"])
+
+    def snapshot_records(self) -> Iterator[Dict[str, Any]]:
+        """
+        Journal records that rebuild all backlogs and dead letters, used for journal checkpoints.
+        """
+        for subscriber_queue in list(self._messages_map.values()):
+            yield from subscriber_queue.snapshot_records()
+        for dead_letters in list(self._dead_letters_map.values()):
+            yield from dead_letters.snapshot_records()
+
+    def shutdown(self) -> None:
+        """
+        Stop background workers once all accepted messages have been dispatched.
+        """
+        with self._lock:
+            workers, self._dispatch_workers = self._dispatch_workers, []
+        for _ in workers:
+            self._dispatch_queue.put(None)
+        for worker in workers:
+            worker.join()
+        self._batcher.shutdown()
+        self._retry_scheduler.shutdown()
+        self._delivery_engine.shutdown()
+
+    def _seal(
+        self, entries: Sequence[Tuple[str, Sequence[str], Dict[str, str]]]
+    ) -> List[_Sealed]:
+        published_at = datetime.now(timezone.utc)
+        PUBLISHED_MESSAGES.inc(amount=len(entries))
+        return [
+            (
+                Envelope.create(
+                    topic,
+                    message,
+                    published_at,
+                    compress_threshold=self._compress_threshold,
+                ),
+                subscribers,
+            )
+            for topic, subscribers, message in entries
+        ]
+
+    def _publish(self, entries: Sequence[_Sealed]) -> List[PublishResult]:
+        pending = self._enqueue_batch(entries)
+        results = (
+            self._delivery_engine.deliver_many(pending.deliveries)
+            if pending.deliveries
+            else []
+        )
+        return self._complete_batch(pending, results)
+
+    def _enqueue_batch(self, entries: Sequence[_Sealed]) -> _PendingBatch:
+        """
+        First half of a publish: enqueue and journal every entry, hand messages of batched subscribers to the
+        batcher and work out which webhook deliveries to attempt now.
+        """
+        by_subscriber: Dict[str, List[int]] = {}
+        for i, (envelope, subscribers) in enumerate(entries):
             for subscriber in subscribers:
-                if subscriber not in self._messages_map:
-                    self._messages_map[subscriber] = deque()
-                self._messages_map[subscriber].append(message)
-                logger.info(f"added message to queue for {subscriber}")
+                by_subscriber.setdefault(subscriber, []).append(i)
 
-        for subscriber in subscribers:
-            # send message
-            try:
-                response = requests.post(
-                    url=subscriber,
-                    json=message,
-                    headers={"Content-Type": "application/json"},
-                )
-                if response.status_code == HTTP_OK:
-                    logger.info(f"Message successfully sent to {subscriber}")
+        sequence_numbers: List[Dict[str, Optional[int]]] = [{} for _ in entries]
+        queues: Dict[str, SubscriberQueue] = {}
+        rejected: Set[int] = set()
+        if self._overflow_policy == OVERFLOW_REJECT:
+            # an entry rejected by one backlog is rolled back from those it already went to. Every backlog
+            # of the batch is held until then, so no poll or redelivery sees the entry in between. Locks are
+            # taken in subscriber order, concurrent batches never wait on each other in a cycle
+            for subscriber in sorted(by_subscriber):
+                queues[subscriber] = self._get_queue(subscriber)
+            with ExitStack() as stack:
+                start = time.perf_counter()
+                for subscriber_queue in queues.values():
+                    stack.enter_context(subscriber_queue.lock)
+                LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, "publish")
+                stack.enter_context(self._state_backend.atomic())
+                for subscriber, indexes in by_subscriber.items():
+                    self._append_entries(
+                        subscriber,
+                        queues[subscriber],
+                        indexes,
+                        entries,
+                        sequence_numbers,
+                        rejected,
+                    )
+                for i in rejected:
+                    # reject the entry as a whole, nothing of it is left behind
+                    for subscriber, seq in sequence_numbers[i].items():
+                        if seq is not None:
+                            queues[subscriber].ack(seq)
+        else:
+            # nothing is rejected, every backlog is locked on its own
+            for subscriber, indexes in by_subscriber.items():
+                subscriber_queue = queues[subscriber] = self._get_queue(subscriber)
+                start = time.perf_counter()
+                with subscriber_queue.lock:
+                    LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, "publish")
+                    self._append_entries(
+                        subscriber,
+                        subscriber_queue,
+                        indexes,
+                        entries,
+                        sequence_numbers,
+                        rejected,
+                    )
 
-                    with self._lock:
-                        if self._messages_map.get(subscriber):
-                            self._messages_map[subscriber].popleft()
+        if self._journal:
+            # messages are durable before any delivery is attempted
+            self._journal.sync()
+
+        failed: List[Set[str]] = [set() for _ in entries]
+        queued: List[Set[str]] = [set() for _ in entries]
+        targets: List[Tuple[int, str]] = []
+        deliveries: List[Tuple[str, Payload]] = []
+        for i, (envelope, subscribers) in enumerate(entries):
+            if i in rejected:
+                continue
+            # decompressed at most once per message, whatever its fan-out
+            body: Optional[bytes] = None
+            for subscriber in subscribers:
+                seq = sequence_numbers[i][subscriber]
+                options = self._get_options(subscriber)
+                if options is not None and options.batched:
+                    if seq is not None:
+                        queued[i].add(subscriber)
+                        self._batcher.add(
+                            subscriber,
+                            seq,
+                            envelope,
+                            max_size=options.batch_max_size,
+                            max_linger=options.batch_max_linger,
+                        )
+                elif not self._delivery_limited(subscriber) and (
+                    self._get_breaker(subscriber).allow_request()
+                ):
+                    targets.append((i, subscriber))
+                    if envelope.compressed and options and options.accepts_gzip:
+                        deliveries.append((subscriber, envelope.data))
+                        continue
+                    if body is None:
+                        body = envelope.body
+                    deliveries.append((subscriber, body))
                 else:
-                    failed_subscribers.append(subscriber)
+                    # behind an open circuit breaker, or over the subscriber's delivery rate, the message stays
+                    # in the backlog without a network attempt
+                    logger.debug(
+                        "Delivery to %s held back, message kept for polling", subscriber
+                    )
+                    failed[i].add(subscriber)
+                    if seq is not None:
+                        self._retry_scheduler.schedule(
+                            subscriber, seq, attempt=1, message_id=envelope.id
+                        )
+
+        return _PendingBatch(
+            entries=entries,
+            sequence_numbers=sequence_numbers,
+            queues=queues,
+            rejected=rejected,
+            failed=failed,
+            queued=queued,
+            targets=targets,
+            deliveries=deliveries,
+        )
+
+    def _append_entries(
+        self,
+        subscriber: str,
+        subscriber_queue: SubscriberQueue,
+        indexes: List[int],
+        entries: Sequence[_Sealed],
+        sequence_numbers: List[Dict[str, Optional[int]]],
+        rejected: Set[int],
+    ) -> None:
+        """
+        Enqueue the entries of a batch going to one subscriber, its queue lock must be held.
+        """
+        for i in indexes:
+            if i in rejected:
+                continue
+            envelope = entries[i][0]
+            try:
+                sequence_numbers[i][subscriber] = subscriber_queue.append(
+                    envelope, len(envelope.data)
+                )
+            except BacklogFullError:
+                rejected.add(i)
+                if self._failure_log_sampler.sample(subscriber):
                     logger.error(
-                        f"Failed to send message to {subscriber}, \
-                            adding to queue for polling. Client returned: {response.text}"
+                        "Rejected message for topic %s, backlog of %s is full",
+                        envelope.topic,
+                        subscriber,
                     )
-            except Exception as e:
-                failed_subscribers.append(subscriber)
+        logger.debug("Added %d messages to queue for %s", len(indexes), subscriber)
+
+    def _complete_batch(
+        self, pending: _PendingBatch, results: List[DeliveryResult]
+    ) -> List[PublishResult]:
+        """
+        Second half of a publish: ack what was delivered and schedule retries for what was not.
+        """
+        entries, sequence_numbers = pending.entries, pending.sequence_numbers
+        failed = pending.failed
+        for (i, subscriber), result in zip(pending.targets, results):
+            self._record_outcome(result)
+            seq = sequence_numbers[i][subscriber]
+            if result.delivered:
+                logger.debug("Message successfully sent to %s", subscriber)
+
+                # ack exactly the message that was delivered, a poller might have taken it already
+                if seq is not None:
+                    pending.queues[subscriber].ack(seq)
+                continue
+
+            failed[i].add(subscriber)
+            if seq is not None:
+                self._retry_scheduler.schedule(
+                    subscriber, seq, attempt=1, message_id=entries[i][0].id
+                )
+            if not self._failure_log_sampler.sample(subscriber):
+                continue
+            if result.status_code is not None:
                 logger.error(
-                    f"Error occured while sending message for topic {topic}: {e}"
+                    "Failed to send message to %s, adding to queue for polling. Client returned %d: %s",
+                    subscriber,
+                    result.status_code,
+                    result.error,
+                )
+            else:
+                logger.error(
+                    "Error occured while sending message for topic %s to %s: %s",
+                    entries[i][0].topic,
+                    subscriber,
+                    result.error,
                 )
-                logger.error(f"Stacktrace: {traceback.format_exc()}")
 
-        return failed_subscribers
+        return [
+            PublishResult(
+                failed_subscribers=[
+                    subscriber for subscriber in subscribers if subscriber in failed[i]
+                ],
+                rejected=i in pending.rejected,
+                queued_subscribers=[
+                    subscriber
+                    for subscriber in subscribers
+                    if subscriber in pending.queued[i]
+                ],
+            )
+            for i, (_, subscribers) in enumerate(entries)
+        ]
 
-    def retrieve_message(self, subscriber: str) -> Optional[Dict[str, str]]:
+    def _redeliver(
+        self, subscriber: str, seq: int, attempt: int, message_id: Optional[str]
+    ) -> None:
         """
-        Poll one message at a time for a given subscriber.
+        Retry scheduler handler, hands the redelivery of a queued message to the delivery engine.
+        """
+        subscriber_queue = self._messages_map.get(subscriber)
+        envelope = subscriber_queue.get(seq) if subscriber_queue is not None else None
+        if envelope is None or envelope.id != message_id:
+            # polled, evicted or unsubscribed in the meantime, nothing left to deliver
+            return
+        if self._delivery_limited(subscriber):
+            # not an attempt, the same retry is tried again later
+            self._retry_scheduler.schedule(
+                subscriber, seq, attempt, message_id=message_id
+            )
+            return
+        breaker = self._get_breaker(subscriber)
+        if not breaker.allow_request():
+            # not an attempt either, tried again once the breaker lets a probe through
+            self._retry_scheduler.schedule(
+                subscriber,
+                seq,
+                attempt,
+                delay=max(
+                    breaker.retry_after(), self._retry_scheduler.backoff(attempt)
+                ),
+                message_id=message_id,
+            )
+            return
+        options = self._get_options(subscriber)
+        if options is not None and options.batched:
+            # batched endpoints always receive an array, retries go out one message at a time
+            payload = self._encode_batch([envelope], options)
+        elif envelope.compressed and options is not None and options.accepts_gzip:
+            payload = envelope.data
+        else:
+            payload = envelope.body
+        RETRIES.inc(subscriber)
+        self._delivery_engine.submit(subscriber, payload).add_done_callback(
+            lambda future: self._on_redelivered(envelope, seq, attempt, future.result())
+        )
 
-        TODO: ONLY THE TRUE SUBSCRIBER CAN CALL THIS! URL X CANNOT FETCH FOR Y.
-            THIS WOULD REQUIRE AN AUTHENTICATION LAYER, OUT OF SCOPE AT THE MOMENT
+    def _on_redelivered(
+        self,
+        envelope: Envelope,
+        seq: int,
+        attempt: int,
+        result: DeliveryResult,
+    ) -> None:
+        subscriber = result.subscriber
+        self._record_outcome(result)
+        subscriber_queue = self._messages_map.get(subscriber)
+        if subscriber_queue is None:
+            return
+        if result.delivered:
+            logger.debug("Message redelivered to %s on attempt %d", subscriber, attempt)
+            subscriber_queue.ack(seq)
+            self._update_status(envelope, subscriber, DELIVERY_DELIVERED)
+            return
+
+        if self._retry_scheduler.schedule(
+            subscriber, seq, attempt + 1, message_id=envelope.id
+        ):
+            return
+
+        # retries exhausted, move the message to the dead-letter queue. It is recorded there before it leaves
+        # the backlog, so a crash in between keeps it rather than losing it
+        dead_letters = self._get_dead_letters(subscriber)
+        with subscriber_queue.lock, self._state_backend.atomic():
+            message = subscriber_queue.get(seq)
+            if message is None or message.id != envelope.id:
+                return
+            dead_letters.append(message)
+            subscriber_queue.ack(seq)
+        DEAD_LETTERED.inc(subscriber)
+        self._update_status(envelope, subscriber, DELIVERY_DEAD_LETTERED)
+        logger.error(
+            "Message %d for %s dead-lettered after %d redeliveries",
+            seq,
+            subscriber,
+            attempt,
+        )
+
+    def _flush_batch(self, subscriber: str, entries: List[BatchEntry]) -> None:
+        """
+        Batcher handler, hands a batch of queued messages to the delivery engine as one POST.
+        """
+        subscriber_queue = self._messages_map.get(subscriber)
+        if subscriber_queue is None:
+            return
+        # polled or evicted messages have nothing left to deliver, nor has a queue that was dropped since
+        entries = [
+            (seq, envelope)
+            for seq, envelope in entries
+            if _holds(subscriber_queue, seq, envelope)
+        ]
+        if not entries:
+            return
+
+        if self._delivery_limited(subscriber) or (
+            not self._get_breaker(subscriber).allow_request()
+        ):
+            logger.debug("Batch for %s held back, kept for polling", subscriber)
+            for seq, envelope in entries:
+                self._retry_scheduler.schedule(
+                    subscriber, seq, attempt=1, message_id=envelope.id
+                )
+            return
+
+        self._delivery_engine.submit(
+            subscriber,
+            self._encode_batch(
+                [envelope for _, envelope in entries], self._get_options(subscriber)
+            ),
+        ).add_done_callback(
+            lambda future: self._on_batch_delivered(entries, future.result())
+        )
+
+    def _on_batch_delivered(
+        self, entries: List[BatchEntry], result: DeliveryResult
+    ) -> None:
+        subscriber = result.subscriber
+        self._record_outcome(result)
+        if result.delivered:
+            logger.debug("Batch of %d messages sent to %s", len(entries), subscriber)
+            subscriber_queue = self._messages_map.get(subscriber)
+            for seq, envelope in entries:
+                if subscriber_queue is not None:
+                    subscriber_queue.ack(seq)
+                self._update_status(envelope, subscriber, DELIVERY_DELIVERED)
+            return
+
+        if self._failure_log_sampler.sample(subscriber):
+            logger.error(
+                "Failed to send batch of %d messages to %s: %s",
+                len(entries),
+                subscriber,
+                result.error,
+            )
+        for seq, envelope in entries:
+            self._update_status(envelope, subscriber, DELIVERY_FAILED)
+            self._retry_scheduler.schedule(
+                subscriber, seq, attempt=1, message_id=envelope.id
+            )
+
+    def _encode_batch(
+        self, envelopes: List[Envelope], options: Optional[SubscriptionOptions]
+    ) -> Payload:
+        """
+        Payload of a batched delivery, compressed as a whole for subscribers accepting gzip.
+        """
+        payload = encode_batch(envelopes)
+        if (
+            options is not None
+            and options.accepts_gzip
+            and self._compress_threshold
+            and len(payload) >= self._compress_threshold
+        ):
+            return compress(payload)
+        return payload
+
+    def _delivery_limited(self, subscriber: str) -> bool:
+        """
+        Take a webhook POST from the subscriber's delivery rate, True if it is used up. Checked before the
+        circuit breaker, so a half-open breaker never lets its probe through without an attempt.
+        """
+        if self._delivery_rate_limiter is None:
+            return False
+        return self._delivery_rate_limiter.acquire(subscriber) > 0
+
+    def _get_options(self, subscriber: str) -> Optional[SubscriptionOptions]:
+        if self._subscription_options is None:
+            return None
+        return self._subscription_options(subscriber)
+
+    def _get_max_attempts(self, subscriber: str) -> Optional[int]:
+        options = self._get_options(subscriber)
+        return options.max_attempts if options is not None else None
+
+    def _get_breaker(self, subscriber: str) -> CircuitBreaker:
+        breaker = self._breakers.get(subscriber)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    subscriber,
+                    CircuitBreaker(
+                        failure_threshold=self._breaker_failure_threshold,
+                        reset_timeout=self._breaker_reset_timeout,
+                    ),
+                )
+        return breaker
+
+    def _record_outcome(self, result: DeliveryResult) -> None:
+        breaker = self._get_breaker(result.subscriber)
+        DELIVERY_SECONDS.observe(result.elapsed, result.subscriber)
+        if result.delivered:
+            breaker.record_success()
+            DELIVERIES.inc(result.subscriber, DELIVERY_DELIVERED)
+        else:
+            breaker.record_failure()
+            DELIVERIES.inc(result.subscriber, DELIVERY_FAILED)
+
+    def _get_queue(self, subscriber: str) -> SubscriberQueue:
+        """
+        Return the queue of a subscriber, creating it if needed.
+        Lookups are lock free, only the first enqueue for a subscriber takes the broker lock.
+        """
+        subscriber_queue = self._messages_map.get(subscriber)
+        if subscriber_queue is None:
+            with self._lock:
+                subscriber_queue = self._messages_map.get(subscriber)
+                if subscriber_queue is None:
+                    # one string per subscriber, shared with the subscription manager
+                    subscriber = sys.intern(subscriber)
+                    subscriber_queue = self._create_queue(subscriber)
+                    if self._seq_floor:
+                        subscriber_queue.restore_sequence(self._seq_floor)
+                    for listener in self._watchers.pop(subscriber, ()):
+                        subscriber_queue.add_listener(listener)
+                    self._messages_map[subscriber] = subscriber_queue
+        return subscriber_queue
+
+    def _find_queue(self, subscriber: str) -> Optional[SubscriberQueue]:
         """
+        Return the queue of a subscriber for polling, None if nothing was ever queued for it.
+        With a shared state backend the backlog may have been filled by another process.
+        """
+        if self._state_backend.shared:
+            return self._get_queue(subscriber)
+        return self._messages_map.get(subscriber)
+
+    def _create_queue(self, subscriber: str) -> SubscriberQueue:
+        return self._state_backend.create_queue(
+            subscriber,
+            max_messages=self._max_queue_messages,
+            max_bytes=self._max_queue_bytes,
+            overflow_policy=self._overflow_policy,
+            budget=self._budget,
+        )
+
+    def _get_dead_letters(self, subscriber: str) -> SubscriberQueue:
+        dead_letters = self._dead_letters_map.get(subscriber)
+        if dead_letters is None:
+            with self._lock:
+                dead_letters = self._dead_letters_map.get(subscriber)
+                if dead_letters is None:
+                    subscriber = sys.intern(subscriber)
+                    dead_letters = self._create_dead_letters(subscriber)
+                    self._dead_letters_map[subscriber] = dead_letters
+        return dead_letters
+
+    def _create_dead_letters(self, subscriber: str) -> SubscriberQueue:
+        return self._state_backend.create_dead_letter_queue(
+            subscriber, max_messages=self._dead_letter_max_messages
+        )
+
+    def _start_dispatch_workers(self) -> None:
+        if self._dispatch_workers:
+            return
         with self._lock:
-            if self._messages_map.get(subscriber):
-                return self._messages_map.get(subscriber).popleft()
-        return None
+            if self._dispatch_workers:
+                return
+            for i in range(self._dispatch_workers_count):
+                worker = Thread(
+                    target=self._dispatch_loop, name=f"dispatch-{i}", daemon=True
+                )
+                worker.start()
+                self._dispatch_workers.append(worker)
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            item: Optional[_Sealed] = self._dispatch_queue.get()
+            if item is None:
+                return
+
+            envelope, subscribers = item
+            message_id = envelope.id
+            queued_subscribers: Set[str] = set()
+            try:
+                result = self._publish([item])[0]
+                failed_subscribers = (
+                    set(subscribers)
+                    if result.rejected
+                    else set(result.failed_subscribers)
+                )
+                queued_subscribers = set(result.queued_subscribers)
+            except Exception as e:
+                logger.error(
+                    "Error occured while dispatching message %s: %s", message_id, e
+                )
+                failed_subscribers = set(subscribers)
+
+            with self._status_lock:
+                status = self._delivery_status.get(message_id)
+                if status is not None:
+                    for subscriber in subscribers:
+                        # a redelivery may have finished first, its outcome is the later one
+                        if status.get(subscriber) != DELIVERY_PENDING:
+                            continue
+                        if subscriber in failed_subscribers:
+                            status[subscriber] = DELIVERY_FAILED
+                        elif subscriber in queued_subscribers:
+                            status[subscriber] = DELIVERY_QUEUED
+                        else:
+                            status[subscriber] = DELIVERY_DELIVERED
+
+
+def _holds(subscriber_queue: SubscriberQueue, seq: int, envelope: Envelope) -> bool:
+    """
+    True if the entry seq of a queue is still the given message.
+    """
+    queued = subscriber_queue.get(seq)
+    return queued is not None and queued.id == envelope.id
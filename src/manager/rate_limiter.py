@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+import time
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float) -> None:
+        self.tokens = tokens
+        self.updated = updated
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets keyed by an arbitrary string, e.g. a topic, a publisher address or a subscriber url.
+
+    Every bucket holds up to burst tokens and regains rate tokens per second. Refill is lazy: a bucket is
+    only brought up to date when it is used, so idle buckets cost no work. A bucket that has refilled is the
+    same as a new one, so the least recently used buckets are dropped once max_keys are held.
+
+    A request for more tokens than the burst is let through once the bucket is full and leaves it in debt,
+    which keeps large batches possible while still holding them to the rate on average.
+    """
+
+    def __init__(self, rate: float, burst: float = 0, max_keys: int = 100000) -> None:
+        """
+        :param rate: Tokens regained per second
+        :param burst: Capacity of a bucket, one second worth of tokens if 0
+        :param max_keys: Number of buckets kept, the least recently used are dropped first
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self._rate = rate
+        self._burst = burst or rate
+        self._max_keys = max_keys
+        self._buckets: OrderedDict[str, _Bucket] = OrderedDict()
+        self._lock = Lock()
+
+    def acquire(self, key: str, tokens: float = 1) -> float:
+        """
+        Take tokens from the bucket of a key.
+
+        :return retry_after: 0 if the tokens were taken, otherwise seconds until they can be, nothing is
+            taken in that case
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(self._burst, now)
+                if len(self._buckets) > self._max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket.tokens = min(
+                    self._burst, bucket.tokens + (now - bucket.updated) * self._rate
+                )
+                bucket.updated = now
+
+            needed = min(tokens, self._burst)
+            if bucket.tokens < needed:
+                return (needed - bucket.tokens) / self._rate
+            bucket.tokens -= tokens
+            return 0.0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class PublishRateLimiter:
+    """
+    Limits checked by the publish endpoints before any subscriber lookup or broker work: messages per
+    second of each topic and of each publisher address. A limit with a rate of 0 is disabled and keeps no
+    state at all.
+    """
+
+    def __init__(
+        self,
+        topic_rate: float = 0,
+        topic_burst: float = 0,
+        publisher_rate: float = 0,
+        publisher_burst: float = 0,
+        max_keys: int = 100000,
+    ) -> None:
+        """
+        :param topic_rate: Messages per second accepted for a topic, 0 for unlimited
+        :param topic_burst: Messages a topic may publish at once, one second worth if 0
+        :param publisher_rate: Messages per second accepted from a publisher address, 0 for unlimited
+        :param publisher_burst: Messages a publisher may publish at once, one second worth if 0
+        :param max_keys: Number of buckets kept per limit
+        """
+        self._topics: Optional[TokenBucketLimiter] = (
+            TokenBucketLimiter(topic_rate, topic_burst, max_keys)
+            if topic_rate > 0
+            else None
+        )
+        self._publishers: Optional[TokenBucketLimiter] = (
+            TokenBucketLimiter(publisher_rate, publisher_burst, max_keys)
+            if publisher_rate > 0
+            else None
+        )
+
+    def acquire_topic(self, topic: str, messages: int = 1) -> float:
+        """
+        :return retry_after: 0 if the messages may be published to the topic, otherwise seconds to wait
+        """
+        if self._topics is None:
+            return 0.0
+        return self._topics.acquire(topic, messages)
+
+    def acquire_publisher(self, publisher: Optional[str], messages: int = 1) -> float:
+        """
+        :param publisher: Address of the publisher, unknown addresses share one bucket
+        :return retry_after: 0 if the publisher may publish the messages, otherwise seconds to wait
+        """
+        if self._publishers is None:
+            return 0.0
+        return self._publishers.acquire(publisher or "", messages)
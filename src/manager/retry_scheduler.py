@@ -0,0 +1,150 @@
+from itertools import count
+from threading import (
+    Condition,
+    Thread,
+)
+from typing import (
+    Callable,
+    List,
+    Optional,
+    Tuple,
+)
+import heapq
+import logging
+import random
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class RetryScheduler:
+    """
+    Schedules redelivery attempts of queued messages with exponential backoff and jitter.
+
+    Pending retries live in a single heap keyed by their next attempt time and are driven by one timer
+    thread, so scheduling costs O(log n) and no thread is spent per message. When an attempt is due the
+    handler is called from the timer thread, it must hand the actual delivery off and return quickly.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, int, int, Optional[str]], None],
+        max_attempts: int = 8,
+        base_delay: float = 1.0,
+        max_delay: float = 300.0,
+        max_attempts_override: Optional[Callable[[str], Optional[int]]] = None,
+    ) -> None:
+        """
+        :param handler: Called with subscriber, sequence number, attempt number and message id when a retry is
+            due
+        :param max_attempts: Default number of retries per message before it is dead-lettered
+        :param base_delay: Delay in seconds before the first retry, doubled for every further attempt
+        :param max_delay: Upper bound of the delay between two attempts
+        :param max_attempts_override: Returns the number of retries configured for a subscriber, if any
+        """
+        self._handler = handler
+        self._default_max_attempts = max_attempts
+        self._max_attempts_override = max_attempts_override
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+
+        # (due time, tie breaker, subscriber, seq, attempt, message id)
+        self._heap: List[Tuple[float, int, str, int, int, Optional[str]]] = []
+        self._counter = count()
+        self._cond = Condition()
+        self._thread: Optional[Thread] = None
+        self._stopped = False
+
+    def get_max_attempts(self, subscriber: str) -> int:
+        if self._max_attempts_override:
+            max_attempts = self._max_attempts_override(subscriber)
+            if max_attempts is not None:
+                return max_attempts
+        return self._default_max_attempts
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Delay before the given attempt: exponential, capped, with the upper half randomised.
+        """
+        delay = min(self._max_delay, self._base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def schedule(
+        self,
+        subscriber: str,
+        seq: int,
+        attempt: int,
+        delay: Optional[float] = None,
+        message_id: Optional[str] = None,
+    ) -> bool:
+        """
+        Schedule a retry of the given queued message.
+
+        :param attempt: Number of the retry being scheduled, starting at 1
+        :param delay: Seconds to wait instead of the backoff of the attempt
+        :param message_id: Id of the message at seq, handed back to the handler so it can tell whether seq
+            still holds that message
+        :return scheduled: False if the subscriber's retries are exhausted
+        """
+        if attempt > self.get_max_attempts(subscriber):
+            return False
+
+        due = time.monotonic() + (self.backoff(attempt) if delay is None else delay)
+        with self._cond:
+            if self._stopped:
+                return False
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._run, name="retry-scheduler", daemon=True
+                )
+                self._thread.start()
+            heapq.heappush(
+                self._heap,
+                (due, next(self._counter), subscriber, seq, attempt, message_id),
+            )
+            if self._heap[0][0] == due:
+                # the timer thread sleeps until the previous head, wake it up
+                self._cond.notify()
+        return True
+
+    def shutdown(self) -> None:
+        """
+        Stop the timer thread, pending retries are dropped.
+        """
+        with self._cond:
+            self._stopped = True
+            self._heap.clear()
+            self._cond.notify()
+            thread = self._thread
+        if thread:
+            thread.join()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                if self._stopped:
+                    return
+
+                due: List[Tuple[str, int, int, Optional[str]]] = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, subscriber, seq, attempt, message_id = heapq.heappop(
+                        self._heap
+                    )
+                    due.append((subscriber, seq, attempt, message_id))
+
+            for subscriber, seq, attempt, message_id in due:
+                try:
+                    self._handler(subscriber, seq, attempt, message_id)
+                except Exception as e:
+                    logger.error(
+                        "Retry of message %d for %s failed: %s", seq, subscriber, e
+                    )
@@ -0,0 +1,570 @@
+from contextlib import contextmanager
+from threading import (
+    Condition,
+    Event,
+    RLock,
+    Thread,
+    local,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+from manager.envelope import Envelope
+from manager.state_backend import StateBackend
+from manager.subscriber_queue import (
+    BacklogBudget,
+    BacklogFullError,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_POLICIES,
+    OVERFLOW_REJECT,
+    QueueEntry,
+)
+import json
+import logging
+import queue
+import sqlite3
+import time
+import weakref
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KIND_BACKLOG = "backlog"
+KIND_DEAD_LETTERS = "dead"
+# backlogs row holding the totals across all backlogs, endpoints are never empty
+TOTALS_ROW = ""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscription_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    url TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS subscription_log_key ON subscription_log (topic, url, id);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    message_id TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    published_at INTEGER NOT NULL,
+    body BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_queue ON messages (kind, name, seq);
+CREATE TABLE IF NOT EXISTS backlogs (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    messages INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+"""
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    State shared by every process that opens the same SQLite database, e.g. the workers of a gunicorn server.
+
+    The database runs in WAL mode, so readers never block the single writer and commits do not fsync.
+    Backlogs live in the database only: every queue operation is a short transaction, and pops delete the
+    entries they hand out in the same transaction, so no two processes ever hand out the same message.
+
+    Subscriptions are appended to a shared log instead, each process keeps its TopicIndex in memory and
+    follows the log, so subscriber lookups on the publish path never touch the database. A follower thread
+    applies the log every poll interval and wakes long polls of this process when another process queued a
+    message. The log is compacted down to the latest record per subscription.
+
+    SQLite locking requires all processes to run on the same host. Spreading workers across hosts takes a
+    backend built on a networked store, behind the same interface.
+    """
+
+    shared = True
+
+    def __init__(
+        self,
+        path: str,
+        poll_interval: float = 0.1,
+        compact_interval: float = 60.0,
+        busy_timeout: float = 5.0,
+    ) -> None:
+        """
+        :param path: Database file, created if missing
+        :param poll_interval: Seconds between two checks for changes made by other processes
+        :param compact_interval: Seconds between two compactions of the subscription log
+        :param busy_timeout: Seconds to wait for another process to release the write lock
+        """
+        self._path = path
+        self._poll_interval = poll_interval
+        self._compact_interval = compact_interval
+        self._busy_timeout = busy_timeout
+        # idle connections, a connection is used by one thread at a time
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        # transaction of atomic() the calling thread is in, and what to run once it commits
+        self._local = local()
+        self._journal = _SharedLog(self)
+
+        with self.connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+        # id of the last subscription log record applied
+        self._cursor = 0
+        # sequence number of the last message seen queued, by any process
+        self._last_seq = 0
+        self._queues: weakref.WeakSet = weakref.WeakSet()
+        self._apply: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._follower: Optional[Thread] = None
+        self._stopped = Event()
+
+    @property
+    def journal(self) -> "_SharedLog":
+        return self._journal
+
+    def create_queue(
+        self,
+        name: str,
+        max_messages: int = 0,
+        max_bytes: int = 0,
+        overflow_policy: str = OVERFLOW_DROP_OLDEST,
+        budget: Optional[BacklogBudget] = None,
+    ) -> "SQLiteSubscriberQueue":
+        subscriber_queue = SQLiteSubscriberQueue(
+            backend=self,
+            kind=KIND_BACKLOG,
+            name=name,
+            max_messages=max_messages,
+            max_bytes=max_bytes,
+            overflow_policy=overflow_policy,
+            budget=budget,
+        )
+        self._queues.add(subscriber_queue)
+        return subscriber_queue
+
+    def create_dead_letter_queue(
+        self, name: str, max_messages: int = 0
+    ) -> "SQLiteSubscriberQueue":
+        return SQLiteSubscriberQueue(
+            backend=self, kind=KIND_DEAD_LETTERS, name=name, max_messages=max_messages
+        )
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """
+        Subscription records, backlogs need no recovery. Leaves the follower at the end of the log.
+        """
+        return self._read_log()
+
+    def start(
+        self,
+        snapshot_records: Callable[[], Iterable[Dict[str, Any]]],
+        apply: Callable[[Dict[str, Any]], None],
+    ) -> None:
+        self._apply = apply
+        self._follower = Thread(target=self._follow, name="state-follower", daemon=True)
+        self._follower.start()
+
+    def catch_up(self) -> int:
+        """
+        Apply the subscription changes made since the last call and wake the long polls of this process if
+        messages were queued in the meantime. Called by the follower thread every poll interval.
+
+        :return applied: number of subscription records applied
+        """
+        applied = 0
+        for record in self._read_log():
+            if self._apply:
+                self._apply(record)
+            applied += 1
+
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'messages'"
+            ).fetchone()
+        last_seq = row[0] if row else 0
+        if last_seq != self._last_seq:
+            self._last_seq = last_seq
+            for subscriber_queue in list(self._queues):
+                subscriber_queue.wake()
+        return applied
+
+    def compact(self) -> int:
+        """
+        Drop subscription log records superseded by a later record of the same subscription.
+
+        :return removed: number of records dropped
+        """
+        with self.transaction() as connection:
+            return connection.execute(
+                """
+                DELETE FROM subscription_log WHERE id < (
+                    SELECT MAX(later.id) FROM subscription_log AS later
+                    WHERE later.topic = subscription_log.topic AND later.url = subscription_log.url
+                )
+                """
+            ).rowcount
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._follower:
+            self._follower.join()
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection in autocommit mode, for reads.
+        """
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = sqlite3.connect(
+                self._path,
+                timeout=self._busy_timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            # in WAL mode commits are durable against crashes of the process without an fsync
+            connection.execute("PRAGMA synchronous=NORMAL")
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection inside a write transaction, committed unless the block raises.
+        Inside atomic() the block joins its transaction, which commits at the end of atomic().
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+        with self.connection() as connection:
+            # take the write lock up front, a deferred transaction could fail to upgrade later on
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    @contextmanager
+    def atomic(self) -> Iterator[None]:
+        if getattr(self._local, "connection", None) is not None:
+            yield
+            return
+        self._local.after_commit = []
+        try:
+            with self.transaction() as connection:
+                self._local.connection = connection
+                try:
+                    yield
+                finally:
+                    self._local.connection = None
+            for callback in self._local.after_commit:
+                callback()
+        finally:
+            self._local.after_commit = None
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Run callback once the changes made so far are visible, i.e. at the end of atomic() if the calling
+        thread is in one, right away otherwise.
+        """
+        callbacks = getattr(self._local, "after_commit", None)
+        if callbacks is None:
+            callback()
+        else:
+            callbacks.append(callback)
+
+    def _read_log(self) -> Iterator[Dict[str, Any]]:
+        with self.connection() as connection:
+            rows = connection.execute(
+                "SELECT id, record FROM subscription_log WHERE id > ? ORDER BY id",
+                (self._cursor,),
+            ).fetchall()
+        for log_id, record in rows:
+            self._cursor = log_id
+            yield json.loads(record)
+
+    def _follow(self) -> None:
+        compacted_at = time.monotonic()
+        while not self._stopped.wait(self._poll_interval):
+            try:
+                self.catch_up()
+                if time.monotonic() - compacted_at >= self._compact_interval:
+                    compacted_at = time.monotonic()
+                    self.compact()
+            except Exception as e:
+                logger.error("Following the shared state failed: %s", e)
+
+
+class _SharedLog:
+    """
+    Journal stand-in recording subscription changes in the shared database. Every append is committed right
+    away, there is nothing to wait for in sync().
+    """
+
+    def __init__(self, backend: SQLiteStateBackend) -> None:
+        self._backend = backend
+
+    def append(self, record: Dict[str, Any]) -> int:
+        with self._backend.transaction() as connection:
+            return connection.execute(
+                "INSERT INTO subscription_log (topic, url, record) VALUES (?, ?, ?)",
+                (record["topic"], record["url"], json.dumps(record)),
+            ).lastrowid
+
+    def sync(self, lsn: Optional[int] = None) -> None:
+        pass
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        return self._backend.replay()
+
+
+class SQLiteSubscriberQueue:
+    """
+    Ordered backlog of a subscriber kept in a SQLite database, offers the interface of SubscriberQueue.
+
+    Caps and the overflow policy are enforced inside the transaction that queues a message, against running
+    totals kept in the database, so they hold across all processes. Sequence numbers come from a counter
+    shared by all queues: they increase per queue but have gaps.
+
+    The lock only orders the operations of this process, every operation is atomic across processes on its
+    own. wait() and listeners are woken by appends of this process and by the backend's follower thread.
+    """
+
+    def __init__(
+        self,
+        backend: SQLiteStateBackend,
+        kind: str,
+        name: str,
+        max_messages: int = 0,
+        max_bytes: int = 0,
+        overflow_policy: str = OVERFLOW_DROP_OLDEST,
+        budget: Optional[BacklogBudget] = None,
+    ) -> None:
+        """
+        :param backend: Backend holding the database
+        :param kind: Backlog or dead letters, queues of both kinds may share a name
+        :param name: Subscriber owning this queue
+        :param budget: Global caps, enforced against the totals across all backlogs in the database
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow_policy}")
+
+        self._backend = backend
+        self._kind = kind
+        self.name = name
+        self._max_messages = max_messages
+        self._max_bytes = max_bytes
+        self._overflow_policy = overflow_policy
+        self._budget = budget
+        self.dropped = 0
+        self.lock = RLock()
+        self._not_empty = Condition(self.lock)
+        self._listeners: List[Callable[[], None]] = []
+
+    @property
+    def bytes(self) -> int:
+        with self._backend.connection() as connection:
+            return self._totals(connection, self.name)[1]
+
+    def append(self, message: Envelope, size: int = 0) -> Optional[int]:
+        """
+        See SubscriberQueue.append(), the envelope's data is stored as is, compressed or not.
+        """
+        with self.lock:
+            with self._backend.transaction() as connection:
+                if not self._make_room(connection, size):
+                    if self._overflow_policy == OVERFLOW_REJECT:
+                        raise BacklogFullError("Subscriber backlog is full")
+                    self.dropped += 1
+                    return None
+                seq = connection.execute(
+                    """
+                    INSERT INTO messages (kind, name, size, message_id, topic, published_at, body)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        self._kind,
+                        self.name,
+                        size,
+                        message.id,
+                        message.topic,
+                        message.published_at,
+                        message.data,
+                    ),
+                ).lastrowid
+                self._account(connection, 1, size)
+            # waiters read through connections of their own, they only see the message once committed
+            self._backend.after_commit(self.wake)
+            return seq
+
+    def ack(self, seq: int) -> bool:
+        with self._backend.transaction() as connection:
+            row = connection.execute(
+                "DELETE FROM messages WHERE seq = ? AND kind = ? AND name = ? RETURNING size",
+                (seq, self._kind, self.name),
+            ).fetchone()
+            if row is None:
+                return False
+            self._account(connection, -1, -row[0])
+            return True
+
+    def get(self, seq: int) -> Optional[Envelope]:
+        with self._backend.connection() as connection:
+            row = connection.execute(
+                """
+                SELECT message_id, topic, published_at, body FROM messages
+                WHERE seq = ? AND kind = ? AND name = ?
+                """,
+                (seq, self._kind, self.name),
+            ).fetchone()
+        return _to_envelope(*row) if row else None
+
+    def popleft(self) -> Optional[QueueEntry]:
+        entries = self.popleft_many(1)
+        return entries[0] if entries else None
+
+    def popleft_many(self, max_count: int) -> List[QueueEntry]:
+        with self._backend.transaction() as connection:
+            rows = connection.execute(
+                """
+                DELETE FROM messages WHERE seq IN (
+                    SELECT seq FROM messages WHERE kind = ? AND name = ? ORDER BY seq LIMIT ?
+                ) RETURNING seq, size, message_id, topic, published_at, body
+                """,
+                (self._kind, self.name, max_count),
+            ).fetchall()
+            if rows:
+                self._account(connection, -len(rows), -sum(row[1] for row in rows))
+        rows.sort()
+        return [QueueEntry(seq=row[0], message=_to_envelope(*row[2:])) for row in rows]
+
+    def peek_many(self, max_count: int) -> List[QueueEntry]:
+        with self._backend.connection() as connection:
+            rows = connection.execute(
+                """
+                SELECT seq, message_id, topic, published_at, body FROM messages
+                WHERE kind = ? AND name = ? ORDER BY seq LIMIT ?
+                """,
+                (self._kind, self.name, max_count),
+            ).fetchall()
+        return [QueueEntry(seq=row[0], message=_to_envelope(*row[1:])) for row in rows]
+
+    def clear(self) -> int:
+        with self._backend.transaction() as connection:
+            messages, size = self._totals(connection, self.name)
+            connection.execute(
+                "DELETE FROM messages WHERE kind = ? AND name = ?",
+                (self._kind, self.name),
+            )
+            self._account(connection, -messages, -size)
+            return messages
+
+    def head_seq(self) -> Optional[int]:
+        with self._backend.connection() as connection:
+            row = connection.execute(
+                "SELECT seq FROM messages WHERE kind = ? AND name = ? ORDER BY seq LIMIT 1",
+                (self._kind, self.name),
+            ).fetchone()
+        return row[0] if row else None
+
+    def wait(self, timeout: float) -> bool:
+        with self.lock:
+            return self._not_empty.wait_for(lambda: len(self) > 0, timeout=timeout)
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        with self.lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        with self.lock:
+            self._listeners.remove(listener)
+
+    def wake(self) -> None:
+        """
+        Wake waiters and listeners, they re-check the queue themselves.
+        """
+        with self.lock:
+            self._not_empty.notify_all()
+            for listener in self._listeners:
+                listener()
+
+    def _make_room(self, connection: sqlite3.Connection, size: int) -> bool:
+        if self._max_bytes and size > self._max_bytes:
+            return False
+
+        while True:
+            messages, used = self._totals(connection, self.name)
+            fits = (not self._max_messages or messages < self._max_messages) and (
+                not self._max_bytes or used + size <= self._max_bytes
+            )
+            if fits and self._fits_budget(connection, size):
+                return True
+            if self._overflow_policy != OVERFLOW_DROP_OLDEST:
+                return False
+
+            oldest = connection.execute(
+                "SELECT seq, size FROM messages WHERE kind = ? AND name = ? ORDER BY seq LIMIT 1",
+                (self._kind, self.name),
+            ).fetchone()
+            if oldest is None:
+                # the global budget can only be freed from this queue, drop the new message otherwise
+                return False
+            connection.execute("DELETE FROM messages WHERE seq = ?", (oldest[0],))
+            self._account(connection, -1, -oldest[1])
+            self.dropped += 1
+
+    def _fits_budget(self, connection: sqlite3.Connection, size: int) -> bool:
+        if self._budget is None or self._kind != KIND_BACKLOG:
+            return True
+        messages, used = self._totals(connection, TOTALS_ROW)
+        if self._budget.max_messages and messages + 1 > self._budget.max_messages:
+            return False
+        return not self._budget.max_bytes or used + size <= self._budget.max_bytes
+
+    def _totals(self, connection: sqlite3.Connection, name: str) -> Tuple[int, int]:
+        row = connection.execute(
+            "SELECT messages, bytes FROM backlogs WHERE kind = ? AND name = ?",
+            (self._kind, name),
+        ).fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+
+    def _account(
+        self, connection: sqlite3.Connection, messages: int, size: int
+    ) -> None:
+        names = [self.name, TOTALS_ROW] if self._kind == KIND_BACKLOG else [self.name]
+        connection.executemany(
+            """
+            INSERT INTO backlogs (kind, name, messages, bytes) VALUES (?, ?, ?, ?)
+            ON CONFLICT (kind, name) DO UPDATE SET
+                messages = messages + excluded.messages, bytes = bytes + excluded.bytes
+            """,
+            [(self._kind, name, messages, size) for name in names],
+        )
+
+    def __len__(self) -> int:
+        with self._backend.connection() as connection:
+            return self._totals(connection, self.name)[0]
+
+
+def _to_envelope(
+    message_id: str, topic: str, published_at: int, data: bytes
+) -> Envelope:
+    return Envelope(int(message_id, 16), topic, published_at, data)
@@ -0,0 +1,154 @@
+from contextlib import (
+    AbstractContextManager,
+    nullcontext,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+)
+from manager.journal import Journal
+from manager.subscriber_queue import (
+    BacklogBudget,
+    OVERFLOW_DROP_OLDEST,
+    SubscriberQueue,
+)
+
+
+class StateBackend:
+    """
+    Where subscriptions and backlogs are kept.
+
+    SubscriptionManager and MessageBroker keep working copies of the state in memory and record every change
+    through the backend's journal: subscription changes directly, backlog changes through the queues the
+    backend creates. A backend that is shared between processes is the source of truth, changes made by other
+    processes are applied to the working copies as they are followed.
+    """
+
+    # True if several processes, e.g. gunicorn workers, share the state
+    shared = False
+
+    @property
+    def journal(self) -> Optional[Journal]:
+        """
+        Log subscription changes are recorded in, None if they are not persisted.
+        """
+        raise NotImplementedError
+
+    def create_queue(
+        self,
+        name: str,
+        max_messages: int = 0,
+        max_bytes: int = 0,
+        overflow_policy: str = OVERFLOW_DROP_OLDEST,
+        budget: Optional[BacklogBudget] = None,
+    ) -> SubscriberQueue:
+        """
+        Backlog of a subscriber, see SubscriberQueue for the arguments.
+        """
+        raise NotImplementedError
+
+    def create_dead_letter_queue(
+        self, name: str, max_messages: int = 0
+    ) -> SubscriberQueue:
+        """
+        Queue of the messages that exhausted their webhook redeliveries for a subscriber.
+        """
+        raise NotImplementedError
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """
+        Journal records that rebuild the working copies at startup.
+        """
+        raise NotImplementedError
+
+    def atomic(self) -> AbstractContextManager:
+        """
+        Group the backlog changes the calling thread makes in the block, other processes see all of them or
+        none. Within a process the queue locks do that, so only shared backends need it.
+        """
+        return nullcontext()
+
+    def start(
+        self,
+        snapshot_records: Callable[[], Iterable[Dict[str, Any]]],
+        apply: Callable[[Dict[str, Any]], None],
+    ) -> None:
+        """
+        Start background maintenance once the state has been recovered.
+
+        :param snapshot_records: Captures the current state, for backends that checkpoint it
+        :param apply: Applies a record changed by another process, for shared backends
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    State private to a single process, optionally persisted by a write-ahead journal.
+    """
+
+    def __init__(
+        self, journal: Optional[Journal] = None, checkpoint_interval: float = 60.0
+    ) -> None:
+        """
+        :param journal: Write-ahead log that every change is persisted to
+        :param checkpoint_interval: Seconds between two checkpoints of the journal
+        """
+        self._journal = journal
+        self._checkpoint_interval = checkpoint_interval
+
+    @property
+    def journal(self) -> Optional[Journal]:
+        return self._journal
+
+    def create_queue(
+        self,
+        name: str,
+        max_messages: int = 0,
+        max_bytes: int = 0,
+        overflow_policy: str = OVERFLOW_DROP_OLDEST,
+        budget: Optional[BacklogBudget] = None,
+    ) -> SubscriberQueue:
+        return SubscriberQueue(
+            max_messages=max_messages,
+            max_bytes=max_bytes,
+            overflow_policy=overflow_policy,
+            budget=budget,
+            name=name,
+            journal=self._journal,
+        )
+
+    def create_dead_letter_queue(
+        self, name: str, max_messages: int = 0
+    ) -> SubscriberQueue:
+        return SubscriberQueue(
+            max_messages=max_messages,
+            name=name,
+            journal=self._journal,
+            dead_letters=True,
+        )
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        if self._journal:
+            yield from self._journal.replay()
+
+    def start(
+        self,
+        snapshot_records: Callable[[], Iterable[Dict[str, Any]]],
+        apply: Callable[[Dict[str, Any]], None],
+    ) -> None:
+        if self._journal:
+            self._journal.start_checkpointing(
+                records=snapshot_records, interval=self._checkpoint_interval
+            )
+
+    def close(self) -> None:
+        if self._journal:
+            self._journal.close()
@@ -0,0 +1,393 @@
+from itertools import islice
+from threading import (
+    Condition,
+    Lock,
+    RLock,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+from manager.envelope import Envelope
+from manager.journal import (
+    Journal,
+    KIND_DEAD_LETTERS,
+    OP_DELETE,
+    OP_DROP,
+    OP_ENQUEUE,
+    OP_SEQUENCE,
+)
+
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_DROP_NEWEST = "drop-newest"
+OVERFLOW_REJECT = "reject"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_REJECT)
+
+
+class BacklogFullError(Exception):
+    """Raised when a message cannot be queued because a backlog cap is reached and the policy is reject."""
+
+
+class QueueEntry(NamedTuple):
+    seq: int
+    message: Envelope
+
+
+class BacklogBudget:
+    """
+    Running totals of messages and bytes held across all subscriber queues, checked against global caps.
+    A cap of 0 means unlimited.
+    """
+
+    def __init__(self, max_messages: int = 0, max_bytes: int = 0) -> None:
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.messages = 0
+        self.bytes = 0
+        self._lock = Lock()
+
+    def reserve(self, size: int) -> bool:
+        """
+        Account for one more message of the given size.
+
+        :return reserved: False if a global cap would be exceeded, nothing is accounted in that case
+        """
+        with self._lock:
+            if self.max_messages and self.messages + 1 > self.max_messages:
+                return False
+            if self.max_bytes and self.bytes + size > self.max_bytes:
+                return False
+            self.messages += 1
+            self.bytes += size
+            return True
+
+    def add(self, messages: int, size: int) -> None:
+        """Account for messages without checking the caps, used when restoring state."""
+        with self._lock:
+            self.messages += messages
+            self.bytes += size
+
+    def release(self, messages: int, size: int) -> None:
+        with self._lock:
+            self.messages -= messages
+            self.bytes -= size
+
+
+class SubscriberQueue:
+    """
+    Ordered backlog of messages for a single subscriber.
+
+    Every message is given a sequence number when enqueued. An entry stays pending until it is either acked
+    by its sequence number (webhook delivery succeeded) or handed out to a poller, so a delivery only ever
+    removes the message that was actually delivered, no matter how many publishes run concurrently.
+    Enqueue, ack and popleft are all O(1), popleft amortized over the entries acked before it.
+
+    The queue can be capped by message count and by bytes, with the overflow policy deciding whether the
+    oldest entries are evicted, the new message is dropped or BacklogFullError is raised. Bytes held are kept
+    as a running total so caps never re-measure the queue.
+
+    Every queue is guarded by its own lock, so operations on different subscribers never block each other.
+    Consumers can park on the queue with wait() and are woken up the moment a message is enqueued. Consumers
+    that must not block a thread, e.g. asyncio tasks, register a listener instead.
+
+    If a journal is given, every change is recorded in it while the lock is held, so the journal always
+    sees the changes of a queue in the order they were applied.
+    """
+
+    def __init__(
+        self,
+        lock: Optional[RLock] = None,
+        max_messages: int = 0,
+        max_bytes: int = 0,
+        overflow_policy: str = OVERFLOW_DROP_OLDEST,
+        budget: Optional[BacklogBudget] = None,
+        name: str = "",
+        journal: Optional[Journal] = None,
+        dead_letters: bool = False,
+    ) -> None:
+        """
+        :param lock: Re-entrant lock guarding this queue, a private one is created if not provided.
+            Callers may hold it to run several queue operations atomically.
+        :param max_messages: Maximum number of pending entries, 0 for unlimited
+        :param max_bytes: Maximum total size of pending entries, 0 for unlimited
+        :param overflow_policy: One of drop-oldest, drop-newest or reject
+        :param budget: Global budget shared with the other queues of a broker
+        :param name: Subscriber owning this queue, used to key journal records
+        :param journal: Journal recording every change of this queue
+        :param dead_letters: True for a dead-letter queue, whose journal records are kept apart from the backlog
+            of the same subscriber
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow_policy}")
+
+        # envelopes are shared with the other queues they were published to, never copied. A plain dict
+        # costs less per entry than an OrderedDict, the oldest entry is found from _first_seq instead:
+        # sequence numbers are consecutive and no pending entry has one lower than _first_seq
+        self._entries: Dict[int, Tuple[Envelope, int]] = {}
+        self._first_seq = 1
+        self._last_seq = 0
+        self.lock = lock or RLock()
+        self._not_empty = Condition(self.lock)
+
+        self._max_messages = max_messages
+        self._max_bytes = max_bytes
+        self._overflow_policy = overflow_policy
+        self._budget = budget or BacklogBudget()
+        self.bytes = 0
+        self.dropped = 0
+        self.name = name
+        self._journal = journal
+        self._record_key = (
+            {"sub": name, "kind": KIND_DEAD_LETTERS} if dead_letters else {"sub": name}
+        )
+        self._listeners: List[Callable[[], None]] = []
+
+    def append(self, message: Envelope, size: int = 0) -> Optional[int]:
+        """
+        Enqueue a message at the tail.
+
+        :param size: Size of the message in bytes, used for byte caps and accounting
+        :return seq: sequence number of the new entry, None if the message was dropped
+        :raises BacklogFullError: if a cap is reached and the overflow policy is reject
+        """
+        with self.lock:
+            if not self._make_room(size):
+                if self._overflow_policy == OVERFLOW_REJECT:
+                    raise BacklogFullError("Subscriber backlog is full")
+                self.dropped += 1
+                return None
+
+            self._last_seq += 1
+            seq = self._last_seq
+            if not self._entries:
+                self._first_seq = seq
+            self._entries[seq] = (message, size)
+            self.bytes += size
+            if self._journal:
+                self._journal.append(
+                    {
+                        "op": OP_ENQUEUE,
+                        **self._record_key,
+                        "seq": seq,
+                        "size": size,
+                        "msg": message.to_record(),
+                    }
+                )
+            self._not_empty.notify_all()
+            for listener in self._listeners:
+                listener()
+            return seq
+
+    def ack(self, seq: int) -> bool:
+        """
+        Remove exactly the entry with the given sequence number.
+
+        :return acked: True if the entry was pending, False if it was already acked or polled
+        """
+        with self.lock:
+            entry = self._entries.pop(seq, None)
+            if entry is None:
+                return False
+            self._release(1, entry[1])
+            self._record_delete([seq])
+            return True
+
+    def get(self, seq: int) -> Optional[Envelope]:
+        """
+        Return the message of a pending entry without removing it, None if it is no longer pending.
+        """
+        with self.lock:
+            entry = self._entries.get(seq)
+            return entry[0] if entry else None
+
+    def popleft(self) -> Optional[QueueEntry]:
+        """
+        Remove and return the oldest pending entry, None if the queue is empty.
+        """
+        with self.lock:
+            if not self._entries:
+                return None
+            seq, (message, size) = self._pop_oldest()
+            self._release(1, size)
+            self._record_delete([seq])
+        return QueueEntry(seq=seq, message=message)
+
+    def popleft_many(self, max_count: int) -> List[QueueEntry]:
+        """
+        Remove and return up to max_count of the oldest pending entries in a single lock acquisition.
+        """
+        with self.lock:
+            entries = []
+            size = 0
+            for _ in range(min(max_count, len(self._entries))):
+                seq, (message, entry_size) = self._pop_oldest()
+                entries.append(QueueEntry(seq=seq, message=message))
+                size += entry_size
+            self._release(len(entries), size)
+            if entries:
+                self._record_delete([entry.seq for entry in entries])
+            return entries
+
+    def peek_many(self, max_count: int) -> List[QueueEntry]:
+        """
+        Return up to max_count of the oldest pending entries without removing them, for consumers that ack
+        an entry once they handed it on.
+        """
+        with self.lock:
+            # entries are inserted in sequence order, so the dict yields the oldest first and skips gaps
+            return [
+                QueueEntry(seq=seq, message=message)
+                for seq, (message, _) in islice(self._entries.items(), max_count)
+            ]
+
+    def clear(self) -> int:
+        """
+        Drop every pending entry, used when the subscriber goes away. The journal records the queue as
+        dropped, if the subscriber comes back the broker starts its new queue past last_seq.
+
+        :return cleared: number of entries dropped
+        """
+        with self.lock:
+            cleared = len(self._entries)
+            self._release(cleared, self.bytes)
+            self._entries.clear()
+            if self._journal:
+                self._journal.append({"op": OP_DROP, **self._record_key})
+            return cleared
+
+    def head_seq(self) -> Optional[int]:
+        """
+        Sequence number of the oldest pending entry, None if the queue is empty.
+        """
+        with self.lock:
+            if not self._entries:
+                return None
+            while self._first_seq not in self._entries:
+                self._first_seq += 1
+            return self._first_seq
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the newest entry ever appended, pending or not."""
+        return self._last_seq
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Block until the queue holds at least one pending entry or the timeout expires.
+
+        :return has_entries: True if there are pending entries
+        """
+        with self.lock:
+            return self._not_empty.wait_for(lambda: self._entries, timeout=timeout)
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Register a callable invoked, with the lock held, every time a message is enqueued.
+        It must return quickly, e.g. by scheduling a wake-up on an event loop.
+        """
+        with self.lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        with self.lock:
+            self._listeners.remove(listener)
+
+    def _make_room(self, size: int) -> bool:
+        """
+        Check the caps for a new entry of the given size, evicting the oldest entries if the policy allows it.
+        Must be called with the lock held.
+
+        :return has_room: True if the entry fits, it is then accounted in the global budget
+        """
+        if self._max_bytes and size > self._max_bytes:
+            return False
+
+        while True:
+            fits = (
+                not self._max_messages or len(self._entries) < self._max_messages
+            ) and (not self._max_bytes or self.bytes + size <= self._max_bytes)
+            if fits and self._budget.reserve(size):
+                return True
+            if self._overflow_policy != OVERFLOW_DROP_OLDEST or not self._entries:
+                # the global budget can only be freed from this queue, drop the new message otherwise
+                return False
+
+            evicted_seq, (_, evicted_size) = self._pop_oldest()
+            self._release(1, evicted_size)
+            self._record_delete([evicted_seq])
+            self.dropped += 1
+
+    def restore(self, seq: int, message: Envelope, size: int) -> None:
+        """
+        Re-insert an entry while replaying the journal. Caps are not enforced and nothing is journaled.
+        Entries at or below the last known sequence number are skipped, which makes replay idempotent.
+        """
+        with self.lock:
+            if seq <= self._last_seq:
+                return
+            self._last_seq = seq
+            if not self._entries:
+                self._first_seq = seq
+            self._entries[seq] = (message, size)
+            self.bytes += size
+            self._budget.add(1, size)
+
+    def restore_sequence(self, seq: int) -> None:
+        """Advance the sequence number while replaying the journal, or past those of a dropped queue."""
+        with self.lock:
+            self._last_seq = max(self._last_seq, seq)
+
+    def discard(self, seqs: Optional[List[int]] = None) -> None:
+        """Remove entries, or all of them if no seqs are given, while replaying the journal. Nothing is journaled."""
+        with self.lock:
+            for seq in list(self._entries) if seqs is None else seqs:
+                entry = self._entries.pop(seq, None)
+                if entry is not None:
+                    self._release(1, entry[1])
+
+    def snapshot_records(self) -> Iterator[Dict[str, Any]]:
+        """
+        Journal records that rebuild the current state of the queue, captured under the lock.
+        """
+        with self.lock:
+            last_seq = self._last_seq
+            entries = list(self._entries.items())
+        for seq, (message, size) in entries:
+            yield {
+                "op": OP_ENQUEUE,
+                **self._record_key,
+                "seq": seq,
+                "size": size,
+                "msg": message.to_record(),
+            }
+        # after the entries, restore() skips anything at or below the last sequence number
+        yield {"op": OP_SEQUENCE, **self._record_key, "seq": last_seq}
+
+    def _pop_oldest(self) -> Tuple[int, Tuple[Envelope, int]]:
+        """
+        Remove the oldest pending entry, the queue must not be empty. Must be called with the lock held.
+        Sequence numbers of acked entries are skipped once, so this is amortized O(1).
+        """
+        while True:
+            seq = self._first_seq
+            self._first_seq += 1
+            entry = self._entries.pop(seq, None)
+            if entry is not None:
+                return seq, entry
+
+    def _record_delete(self, seqs: List[int]) -> None:
+        if self._journal:
+            self._journal.append({"op": OP_DELETE, **self._record_key, "seqs": seqs})
+
+    def _release(self, messages: int, size: int) -> None:
+        self.bytes -= size
+        self._budget.release(messages, size)
+
+    def __len__(self) -> int:
+        return len(self._entries)
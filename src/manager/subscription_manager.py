@@ -1,37 +1,371 @@
+from threading import (
+    TIMEOUT_MAX,
+    Condition,
+    Thread,
+)
 from typing import (
+    Any,
+    Callable,
     Dict,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Sequence,
     Set,
     List,
+    Tuple,
+)
+from manager.envelope import ENCODING_GZIP
+from manager.journal import (
+    Journal,
+    JournalError,
+    OP_SUBSCRIBE,
+    OP_UNSUBSCRIBE,
+)
+from manager.topic_index import TopicIndex
+from utils.metrics import REGISTRY
+from utils.validation import Validation
+import heapq
+import logging
+import sys
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_CHANGES = REGISTRY.counter(
+    "leafi_subscription_changes_total",
+    "Subscriptions created, removed and expired",
+    ("change",),
 )
 
 
+class SubscriptionOptions(NamedTuple):
+    # webhook redeliveries before a message is dead-lettered, None for the broker default
+    max_attempts: Optional[int] = None
+    # messages coalesced into one POST, 0 delivers every message on its own
+    batch_max_size: int = 0
+    # seconds a batch waits for more messages before it is flushed anyway
+    batch_max_linger: float = 0.0
+    # content coding the endpoint accepts on webhook POSTs, gzip or None for uncompressed bodies only
+    accept_encoding: Optional[str] = None
+
+    @property
+    def batched(self) -> bool:
+        return self.batch_max_size > 0
+
+    @property
+    def accepts_gzip(self) -> bool:
+        return self.accept_encoding == ENCODING_GZIP
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
 class SubscriptionManager:
-    def __init__(self) -> None:
-        # map topics with subscribed endpoints
+    def __init__(
+        self,
+        journal: Optional[Journal] = None,
+        on_endpoint_removed: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """
+        :param journal: Write-ahead log that new subscriptions are persisted to
+        :param on_endpoint_removed: Called with an endpoint once its last subscription is removed or expired
+        """
+        # map topics, or topic patterns with wildcards, with subscribed endpoints
         self._subscription_map: Dict[str, Set[str]] = {}
+        # resolves concrete topics to the endpoints of every matching pattern
+        self._topic_index = TopicIndex()
+        # delivery options per endpoint, shared by all topics it is subscribed to
+        self._options: Dict[str, SubscriptionOptions] = {}
+        # topics and patterns each endpoint is subscribed to
+        self._endpoint_topics: Dict[str, Set[str]] = {}
+        self._journal = journal
+        self._on_endpoint_removed = on_endpoint_removed
 
-    def subscribe(self, topic: str, endpoint: str) -> bool:
+        # (topic, endpoint) -> unix time the subscription expires at
+        self._leases: Dict[Tuple[str, str], float] = {}
+        # (expires at, topic, endpoint), entries whose lease was renewed or removed are skipped
+        self._expiry_heap: List[Tuple[float, str, str]] = []
+        # guards changes to subscriptions, lookups are lock free
+        self._cond = Condition()
+        self._expiry_thread: Optional[Thread] = None
+        self._stopped = False
+
+    def subscribe(
+        self,
+        topic: str,
+        endpoint: str,
+        options: Optional[SubscriptionOptions] = None,
+        ttl: Optional[float] = None,
+    ) -> bool:
         """
         Create a subscription between a topic and an endpoint.
+        Subscribing again renews the lease of the subscription, or makes it permanent if no ttl is given.
 
-        :param topic: Topic to be subscribed
+        :param topic: Topic to be subscribed, levels are separated by "." and may be "*" (any one level)
+            or a trailing "#" (any number of levels)
         :param endpoint: Subscribing url
+        :param options: Delivery options of the endpoint, replace the ones of earlier subscriptions if given
+        :param ttl: Seconds after which the subscription expires, None for a permanent subscription
         :return isSubscribed: True if mapping is successful, False otherwise
         """
+        return self.subscribe_batch([(topic, endpoint, options, ttl)])[0]
+
+    def subscribe_batch(
+        self,
+        subscriptions: Sequence[
+            Tuple[str, str, Optional[SubscriptionOptions], Optional[float]]
+        ],
+    ) -> List[bool]:
+        """
+        Create many subscriptions at once, as subscribe() would one by one. The lock is taken once and all of
+        them are made durable with a single journal sync, waited for once the lock is released.
+
+        :param subscriptions: (topic, endpoint, options, ttl) of every subscription
+        :return isSubscribed: per subscription, True if mapping is successful, False otherwise
+        """
+        results = []
+        lsn: Optional[int] = None
+        with self._cond:
+            for topic, endpoint, options, ttl in subscriptions:
+                if not topic or not endpoint:
+                    results.append(False)
+                    continue
+                # interned, so the endpoint is held once however many topics it subscribes to
+                topic = sys.intern(topic.strip())
+                endpoint = sys.intern(endpoint.strip())
+                if len(endpoint) == 0 or not Validation.isValidTopicPattern(topic):
+                    results.append(False)
+                    continue
+
+                options_changed = options is not None and options != self._options.get(
+                    endpoint, SubscriptionOptions()
+                )
+                if options_changed:
+                    self._options[endpoint] = options
+
+                key = (topic, endpoint)
+                lease_changed = ttl is not None or key in self._leases
+                if ttl is not None:
+                    self._lease(topic, endpoint, time.time() + ttl)
+                    self._start_expiry()
+                else:
+                    self._leases.pop(key, None)
+
+                added = self._add(topic, endpoint)
+                if added:
+                    SUBSCRIPTION_CHANGES.inc("created")
+                if (added or options_changed or lease_changed) and self._journal:
+                    lsn = self._journal.append(self._subscribe_record(topic, endpoint))
+                results.append(True)
+        if lsn is not None:
+            # other subscription changes and lookups go on while the disk catches up
+            self._journal.sync(lsn)
+        return results
+
+    def unsubscribe(self, topic: str, endpoint: str) -> bool:
+        """
+        Remove a subscription between a topic and an endpoint.
+        Once the endpoint has no subscriptions left, everything held for it is reclaimed.
+
+        :return isUnsubscribed: False if no such subscription exists
+        """
         if not topic or not endpoint:
             return False
         topic = topic.strip()
         endpoint = endpoint.strip()
 
-        if len(topic) == 0 or len(endpoint) == 0:
+        lsn: Optional[int] = None
+        with self._cond:
+            if endpoint not in self._subscription_map.get(topic, ()):
+                return False
+            endpoint_removed = self._remove(topic, endpoint)
+            SUBSCRIPTION_CHANGES.inc("removed")
+            if self._journal:
+                lsn = self._journal.append(
+                    {"op": OP_UNSUBSCRIBE, "topic": topic, "url": endpoint}
+                )
+        if lsn is not None:
+            self._journal.sync(lsn)
+        if endpoint_removed:
+            self._endpoint_removed(endpoint)
+        return True
+
+    def get_subscribers(self, topic: str) -> Tuple[str, ...]:
+        """
+        Lock free lookup on the publish path. The returned tuple is a shared snapshot, subscriptions
+        changing afterwards are not reflected in it.
+
+        :param topic: Concrete topic, without wildcards or surrounding whitespace
+        :return subscribers: endpoints subscribed to the topic or to a pattern matching it
+        """
+        return self._topic_index.match(topic)
+
+    def get_options(self, endpoint: str) -> Optional[SubscriptionOptions]:
+        """
+        :return options: Delivery options of the endpoint, None if it never set any
+        """
+        return self._options.get(endpoint)
+
+    def subscription_counts(self) -> List[Tuple[str, int]]:
+        """
+        (topic or pattern, number of subscribed endpoints) of every topic, for metrics.
+        """
+        return [
+            (topic, len(endpoints))
+            for topic, endpoints in list(self._subscription_map.items())
+        ]
+
+    def restore(self, record: Dict[str, Any]) -> None:
+        """
+        Apply a journal record while recovering subscriptions at startup.
+        Leases that ran out while the server was down expire once start_expiry() is called.
+        """
+        if record["op"] not in (OP_SUBSCRIBE, OP_UNSUBSCRIBE):
+            return
+        topic = sys.intern(record["topic"])
+        endpoint = sys.intern(record["url"])
+        with self._cond:
+            if record["op"] == OP_SUBSCRIBE:
+                self._add(topic, endpoint)
+                if "opts" in record:
+                    self._options[endpoint] = SubscriptionOptions(**record["opts"])
+                if "expires_at" in record:
+                    self._lease(topic, endpoint, record["expires_at"])
+                else:
+                    self._leases.pop((topic, endpoint), None)
+            elif record["op"] == OP_UNSUBSCRIBE:
+                if endpoint in self._subscription_map.get(topic, ()):
+                    self._remove(topic, endpoint)
+
+    def start_expiry(self) -> None:
+        """
+        Start expiring leased subscriptions. Happens on the first subscription with a ttl, recovery calls it
+        once the journal has been replayed.
+        """
+        with self._cond:
+            self._start_expiry()
+
+    def shutdown(self) -> None:
+        """
+        Stop the expiry thread.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._expiry_thread
+        if thread:
+            thread.join()
+
+    def snapshot_records(self) -> Iterator[Dict[str, Any]]:
+        """
+        Journal records that rebuild all subscriptions, used for journal checkpoints.
+        """
+        for topic, endpoints in list(self._subscription_map.items()):
+            for endpoint in list(endpoints):
+                yield self._subscribe_record(topic, endpoint)
+
+    def _subscribe_record(self, topic: str, endpoint: str) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"op": OP_SUBSCRIBE, "topic": topic, "url": endpoint}
+        options = self._options.get(endpoint)
+        if options is not None:
+            record["opts"] = options.to_dict()
+        expires_at = self._leases.get((topic, endpoint))
+        if expires_at is not None:
+            record["expires_at"] = expires_at
+        return record
+
+    def _add(self, topic: str, endpoint: str) -> bool:
+        """
+        :return added: False if the subscription already existed
+        """
+        endpoints = self._subscription_map.setdefault(topic, set())
+        if endpoint in endpoints:
             return False
+        endpoints.add(endpoint)
+        self._endpoint_topics.setdefault(endpoint, set()).add(topic)
+        self._topic_index.add(topic, endpoint)
+        return True
 
-        if topic not in self._subscription_map:
-            self._subscription_map[topic] = set()
+    def _remove(self, topic: str, endpoint: str) -> bool:
+        """
+        :return endpoint_removed: True if this was the last subscription of the endpoint
+        """
+        endpoints = self._subscription_map[topic]
+        endpoints.discard(endpoint)
+        if not endpoints:
+            del self._subscription_map[topic]
+        self._topic_index.remove(topic, endpoint)
+        self._leases.pop((topic, endpoint), None)
 
-        self._subscription_map[topic].add(endpoint)
+        topics = self._endpoint_topics[endpoint]
+        topics.discard(topic)
+        if topics:
+            return False
+        del self._endpoint_topics[endpoint]
+        self._options.pop(endpoint, None)
         return True
 
-    def get_subscribers(self, topic: str) -> List[str]:
-        subscribers = self._subscription_map.get(topic.strip(), set())
-        return list(subscribers)
+    def _endpoint_removed(self, endpoint: str) -> None:
+        logger.info("Last subscription of %s removed", endpoint)
+        if self._on_endpoint_removed:
+            self._on_endpoint_removed(endpoint)
+
+    def _lease(self, topic: str, endpoint: str, expires_at: float) -> None:
+        self._leases[(topic, endpoint)] = expires_at
+        heapq.heappush(self._expiry_heap, (expires_at, topic, endpoint))
+        if self._expiry_heap[0][0] == expires_at:
+            # the expiry thread sleeps until the previous head, wake it up
+            self._cond.notify()
+
+    def _start_expiry(self) -> None:
+        if self._expiry_thread is None and not self._stopped:
+            self._expiry_thread = Thread(
+                target=self._run_expiry, name="subscription-expiry", daemon=True
+            )
+            self._expiry_thread.start()
+
+    def _run_expiry(self) -> None:
+        while True:
+            removed_endpoints = []
+            lsn: Optional[int] = None
+            with self._cond:
+                while not self._stopped:
+                    now = time.time()
+                    if self._expiry_heap and self._expiry_heap[0][0] <= now:
+                        break
+                    # leases recovered from the journal were not checked against the maximum ttl
+                    self._cond.wait(
+                        min(self._expiry_heap[0][0] - now, TIMEOUT_MAX)
+                        if self._expiry_heap
+                        else None
+                    )
+                if self._stopped:
+                    return
+
+                while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                    expires_at, topic, endpoint = heapq.heappop(self._expiry_heap)
+                    if self._leases.get((topic, endpoint)) != expires_at:
+                        # renewed, made permanent or removed since
+                        continue
+                    logger.info("Subscription of %s to %s expired", endpoint, topic)
+                    SUBSCRIPTION_CHANGES.inc("expired")
+                    if self._remove(topic, endpoint):
+                        removed_endpoints.append(endpoint)
+                    if self._journal:
+                        lsn = self._journal.append(
+                            {"op": OP_UNSUBSCRIBE, "topic": topic, "url": endpoint}
+                        )
+            if lsn is not None:
+                try:
+                    self._journal.sync(lsn)
+                except JournalError:
+                    # logged by the journal, expiries still apply in memory
+                    pass
+
+            for endpoint in removed_endpoints:
+                try:
+                    self._endpoint_removed(endpoint)
+                except Exception as e:
+                    logger.error("Reclaiming %s failed: %s", endpoint, e)
@@ -0,0 +1,127 @@
+from threading import Lock
+from typing import (
+    Dict,
+    List,
+    Set,
+    Tuple,
+)
+
+SEPARATOR = "."
+# matches exactly one level of a topic
+WILDCARD_ONE = "*"
+# matches zero or more trailing levels of a topic, only allowed as the last level of a pattern
+WILDCARD_MANY = "#"
+
+
+class _TrieNode:
+    __slots__ = ("children", "endpoints")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.endpoints: Set[str] = set()
+
+
+class TopicIndex:
+    """
+    Trie of subscription patterns keyed by topic level, e.g. orders.*.created or orders.#
+
+    Resolving the endpoints of a concrete topic walks the trie level by level, so its cost depends on the
+    depth of the topic and the wildcards along the way, not on the number of patterns.
+
+    Resolved topics are cached as immutable tuples that are shared with every caller. Changes never mutate a
+    cached tuple, they drop it and the next lookup builds a new one, so a cache hit is a single lock free
+    dict lookup that allocates nothing. A change to an exact topic only drops that topic from the cache,
+    a change to a wildcard pattern drops all of it.
+    """
+
+    def __init__(self, max_cached_topics: int = 10000) -> None:
+        """
+        :param max_cached_topics: Number of resolved topics kept, the oldest are evicted first
+        """
+        self._root = _TrieNode()
+        self._cache: Dict[str, Tuple[str, ...]] = {}
+        self._max_cached_topics = max_cached_topics
+        # guards the trie and cache fills, cache hits are lock free
+        self._lock = Lock()
+
+    def add(self, pattern: str, endpoint: str) -> bool:
+        """
+        :return added: False if the endpoint was already subscribed to the pattern
+        """
+        with self._lock:
+            node = self._root
+            for level in pattern.split(SEPARATOR):
+                node = node.children.setdefault(level, _TrieNode())
+            if endpoint in node.endpoints:
+                return False
+            node.endpoints.add(endpoint)
+            self._invalidate(pattern)
+            return True
+
+    def remove(self, pattern: str, endpoint: str) -> bool:
+        """
+        :return removed: False if the endpoint was not subscribed to the pattern
+        """
+        with self._lock:
+            path = [self._root]
+            for level in pattern.split(SEPARATOR):
+                node = path[-1].children.get(level)
+                if node is None:
+                    return False
+                path.append(node)
+            if endpoint not in path[-1].endpoints:
+                return False
+            path[-1].endpoints.discard(endpoint)
+
+            # prune the branch back up to the first node still in use
+            levels = pattern.split(SEPARATOR)
+            for depth in range(len(levels), 0, -1):
+                node = path[depth]
+                if node.endpoints or node.children:
+                    break
+                del path[depth - 1].children[levels[depth - 1]]
+            self._invalidate(pattern)
+            return True
+
+    def match(self, topic: str) -> Tuple[str, ...]:
+        """
+        :return endpoints: every endpoint subscribed to a pattern matching the concrete topic
+        """
+        endpoints = self._cache.get(topic)
+        if endpoints is not None:
+            return endpoints
+
+        with self._lock:
+            endpoints = self._cache.get(topic)
+            if endpoints is None:
+                matched: Set[str] = set()
+                self._collect(self._root, topic.split(SEPARATOR), 0, matched)
+                endpoints = tuple(matched)
+                if len(self._cache) >= self._max_cached_topics:
+                    del self._cache[next(iter(self._cache))]
+                self._cache[topic] = endpoints
+        return endpoints
+
+    def _invalidate(self, pattern: str) -> None:
+        if WILDCARD_ONE in pattern or WILDCARD_MANY in pattern:
+            # swap in a fresh dict, readers still holding the old one see a consistent state
+            self._cache = {}
+        else:
+            self._cache.pop(pattern, None)
+
+    def _collect(
+        self, node: _TrieNode, levels: List[str], depth: int, matched: Set[str]
+    ) -> None:
+        many = node.children.get(WILDCARD_MANY)
+        if many is not None:
+            matched.update(many.endpoints)
+        if depth == len(levels):
+            matched.update(node.endpoints)
+            return
+
+        exact = node.children.get(levels[depth])
+        if exact is not None:
+            self._collect(exact, levels, depth + 1, matched)
+        one = node.children.get(WILDCARD_ONE)
+        if one is not None:
+            self._collect(one, levels, depth + 1, matched)
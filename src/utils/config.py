@@ -0,0 +1,132 @@
+import os
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+class Config:
+    """
+    Server tunables. Every value can be overridden through an environment variable of the same name
+    prefixed with LEAFI_, e.g. LEAFI_DELIVERY_READ_TIMEOUT=10.
+    """
+
+    # listening address of the asyncio server, the Flask server is started by flask run
+    SERVER_HOST: str = os.environ.get("LEAFI_SERVER_HOST", "127.0.0.1")
+    SERVER_PORT: int = _env_int("LEAFI_SERVER_PORT", 8000)
+
+    # webhook delivery
+    DELIVERY_MAX_WORKERS: int = _env_int("LEAFI_DELIVERY_MAX_WORKERS", 32)
+    DELIVERY_MAX_HOSTS: int = _env_int("LEAFI_DELIVERY_MAX_HOSTS", 64)
+    DELIVERY_CONNECT_TIMEOUT: float = _env_float("LEAFI_DELIVERY_CONNECT_TIMEOUT", 2.0)
+    DELIVERY_READ_TIMEOUT: float = _env_float("LEAFI_DELIVERY_READ_TIMEOUT", 5.0)
+    # webhook delivery of the asyncio server, see async_main.py
+    ASYNC_DELIVERY_MAX_CONNECTIONS: int = _env_int(
+        "LEAFI_ASYNC_DELIVERY_MAX_CONNECTIONS", 1000
+    )
+    ASYNC_DELIVERY_MAX_PER_HOST: int = _env_int(
+        "LEAFI_ASYNC_DELIVERY_MAX_PER_HOST", 100
+    )
+
+    # asynchronous publishing
+    PUBLISH_ASYNC: bool = os.environ.get("LEAFI_PUBLISH_ASYNC", "").lower() in (
+        "1",
+        "true",
+        "yes",
+    )
+    DISPATCH_WORKERS: int = _env_int("LEAFI_DISPATCH_WORKERS", 4)
+    DISPATCH_QUEUE_SIZE: int = _env_int("LEAFI_DISPATCH_QUEUE_SIZE", 10000)
+    DELIVERY_STATUS_RETENTION: int = _env_int("LEAFI_DELIVERY_STATUS_RETENTION", 10000)
+
+    # batch publishing, maximum number of entries per request
+    PUBLISH_MAX_BATCH: int = _env_int("LEAFI_PUBLISH_MAX_BATCH", 1000)
+
+    # batch subscribing, maximum number of subscriptions per request
+    SUBSCRIBE_MAX_BATCH: int = _env_int("LEAFI_SUBSCRIBE_MAX_BATCH", 1000)
+    # longest lease a subscribe request may ask for, in seconds
+    SUBSCRIPTION_MAX_TTL: float = _env_float(
+        "LEAFI_SUBSCRIPTION_MAX_TTL", 30 * 24 * 3600.0
+    )
+    # longest batch.max_linger_ms a subscribe request may ask for
+    BATCH_MAX_LINGER_MS: float = _env_float("LEAFI_BATCH_MAX_LINGER_MS", 60000.0)
+    # results of url validation kept, the least recently used are dropped first
+    URL_VALIDATION_CACHE_SIZE: int = _env_int("LEAFI_URL_VALIDATION_CACHE_SIZE", 65536)
+
+    # request bodies larger than this are rejected with 413 before they are read, 0 means unlimited
+    MAX_REQUEST_BYTES: int = _env_int("LEAFI_MAX_REQUEST_BYTES", 1024 * 1024)
+    # messages encoded to at least this many bytes are kept gzip compressed in backlogs and delivered
+    # compressed to subscribers accepting gzip, 0 disables compression
+    COMPRESS_THRESHOLD: int = _env_int("LEAFI_COMPRESS_THRESHOLD", 0)
+
+    # polling
+    POLL_DEFAULT_BATCH: int = _env_int("LEAFI_POLL_DEFAULT_BATCH", 100)
+    POLL_MAX_BATCH: int = _env_int("LEAFI_POLL_MAX_BATCH", 1000)
+    LONG_POLL_MAX_WAIT: float = _env_float("LEAFI_LONG_POLL_MAX_WAIT", 30.0)
+    STREAM_HEARTBEAT_INTERVAL: float = _env_float(
+        "LEAFI_STREAM_HEARTBEAT_INTERVAL", 15.0
+    )
+
+    # backlog caps, 0 means unlimited
+    MAX_QUEUE_MESSAGES: int = _env_int("LEAFI_MAX_QUEUE_MESSAGES", 10000)
+    MAX_QUEUE_BYTES: int = _env_int("LEAFI_MAX_QUEUE_BYTES", 16 * 1024 * 1024)
+    MAX_TOTAL_MESSAGES: int = _env_int("LEAFI_MAX_TOTAL_MESSAGES", 0)
+    MAX_TOTAL_BYTES: int = _env_int("LEAFI_MAX_TOTAL_BYTES", 512 * 1024 * 1024)
+    # one of drop-oldest, drop-newest or reject
+    OVERFLOW_POLICY: str = os.environ.get("LEAFI_OVERFLOW_POLICY", "drop-oldest")
+
+    # persistence, disabled unless a data directory is configured
+    DATA_DIR: str = os.environ.get("LEAFI_DATA_DIR", "")
+    JOURNAL_SEGMENT_BYTES: int = _env_int(
+        "LEAFI_JOURNAL_SEGMENT_BYTES", 64 * 1024 * 1024
+    )
+    JOURNAL_COMMIT_INTERVAL: float = _env_float("LEAFI_JOURNAL_COMMIT_INTERVAL", 0.0)
+    JOURNAL_CHECKPOINT_INTERVAL: float = _env_float(
+        "LEAFI_JOURNAL_CHECKPOINT_INTERVAL", 60.0
+    )
+
+    # where subscriptions and backlogs are kept: memory, private to the process and persisted to DATA_DIR if
+    # set, or sqlite, a database at STATE_PATH shared by all processes of the host, e.g. gunicorn workers
+    STATE_BACKEND: str = os.environ.get("LEAFI_STATE_BACKEND", "memory")
+    STATE_PATH: str = os.environ.get("LEAFI_STATE_PATH", "leafi-state.db")
+    STATE_POLL_INTERVAL: float = _env_float("LEAFI_STATE_POLL_INTERVAL", 0.1)
+
+    # webhook redelivery, off by default: messages whose retries run out are moved from the backlog to the dead
+    # letters, so they are no longer handed out by /poll
+    RETRY_MAX_ATTEMPTS: int = _env_int("LEAFI_RETRY_MAX_ATTEMPTS", 0)
+    RETRY_BASE_DELAY: float = _env_float("LEAFI_RETRY_BASE_DELAY", 1.0)
+    RETRY_MAX_DELAY: float = _env_float("LEAFI_RETRY_MAX_DELAY", 300.0)
+    DEAD_LETTER_MAX_MESSAGES: int = _env_int("LEAFI_DEAD_LETTER_MAX_MESSAGES", 1000)
+
+    # token bucket rate limits in messages per second, 0 means unlimited. A burst of 0 allows one second worth
+    # of messages at once. Publishes over a limit are refused with 429, deliveries over a subscriber's limit
+    # stay queued and are retried later
+    RATE_LIMIT_TOPIC: float = _env_float("LEAFI_RATE_LIMIT_TOPIC", 0.0)
+    RATE_LIMIT_TOPIC_BURST: float = _env_float("LEAFI_RATE_LIMIT_TOPIC_BURST", 0.0)
+    RATE_LIMIT_PUBLISHER: float = _env_float("LEAFI_RATE_LIMIT_PUBLISHER", 0.0)
+    RATE_LIMIT_PUBLISHER_BURST: float = _env_float(
+        "LEAFI_RATE_LIMIT_PUBLISHER_BURST", 0.0
+    )
+    RATE_LIMIT_DELIVERY: float = _env_float("LEAFI_RATE_LIMIT_DELIVERY", 0.0)
+    RATE_LIMIT_DELIVERY_BURST: float = _env_float(
+        "LEAFI_RATE_LIMIT_DELIVERY_BURST", 0.0
+    )
+    # buckets kept per limit, the least recently used are dropped first
+    RATE_LIMIT_MAX_KEYS: int = _env_int("LEAFI_RATE_LIMIT_MAX_KEYS", 100000)
+
+    # circuit breakers per subscriber url
+    BREAKER_FAILURE_THRESHOLD: int = _env_int("LEAFI_BREAKER_FAILURE_THRESHOLD", 5)
+    BREAKER_RESET_TIMEOUT: float = _env_float("LEAFI_BREAKER_RESET_TIMEOUT", 30.0)
+
+    # logging, records are written by a background thread and dropped if LOG_QUEUE_SIZE are already waiting
+    LOG_LEVEL: str = os.environ.get("LEAFI_LOG_LEVEL", "INFO").upper()
+    LOG_QUEUE_SIZE: int = _env_int("LEAFI_LOG_QUEUE_SIZE", 10000)
+    # one in every LOG_SAMPLE_EVERY failures per subscriber is logged, metrics count all of them
+    LOG_SAMPLE_EVERY: int = _env_int("LEAFI_LOG_SAMPLE_EVERY", 100)
+    # subscribers whose failures are counted for sampling, the counts start over once exceeded
+    LOG_SAMPLE_MAX_KEYS: int = _env_int("LEAFI_LOG_SAMPLE_MAX_KEYS", 10000)
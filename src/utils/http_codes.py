@@ -2,10 +2,13 @@
 
 HTTP_OK = 200
 HTTP_CREATED = 201
+HTTP_ACCEPTED = 202
 
 HTTP_NOT_FOUND = 404
 HTTP_BAD_REQUEST = 400
+HTTP_PAYLOAD_TOO_LARGE = 413
 HTTP_UNSUPPORTED_MEDIA_TYPE = 415
+HTTP_TOO_MANY_REQUESTS = 429
 
 HTTP_INTERNAL_ERR = 500
 HTTP_SERVICE_UNAVAILABLE = 503
@@ -0,0 +1,110 @@
+"""
+Logging pipeline of the servers: request and worker threads hand records to a queue and never wait for a
+stream or a file, a background thread formats and writes them.
+"""
+
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+)
+from typing import (
+    Dict,
+    Hashable,
+    Optional,
+)
+from utils.config import Config
+import atexit
+import logging
+import queue
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Puts records on a bounded queue without waiting, records that do not fit are dropped and counted.
+
+    Records are queued as they are, message and arguments are only formatted by the listener thread. Log
+    arguments must therefore not be changed after the call, which holds for the strings and numbers logged
+    here.
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(
+    level: str = Config.LOG_LEVEL, queue_size: int = Config.LOG_QUEUE_SIZE
+) -> QueueListener:
+    """
+    Route every record through a NonBlockingQueueHandler. The handlers the root logger had, or a stream
+    handler as set up by logging.basicConfig(), are moved behind the queue. Calling it again only sets the
+    level.
+
+    :param level: Level of the root logger, e.g. INFO or DEBUG
+    :param queue_size: Records waiting to be written before new ones are dropped
+    :return listener: Background thread writing the records, stopped at exit
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return _listener
+
+    handlers = root.handlers[:]
+    for handler in handlers:
+        root.removeHandler(handler)
+    if not handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        handlers = [handler]
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    root.addHandler(NonBlockingQueueHandler(log_queue))
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+class LogSampler:
+    """
+    Lets through the first and then one in every `every` occurrences of an event per key, for events that
+    may happen for every message of a subscriber, e.g. failed deliveries to an endpoint that is down.
+    """
+
+    def __init__(
+        self,
+        every: int = Config.LOG_SAMPLE_EVERY,
+        max_keys: int = Config.LOG_SAMPLE_MAX_KEYS,
+    ) -> None:
+        """
+        :param every: 1 logs every occurrence
+        :param max_keys: Keys counted, all counts start over once exceeded
+        """
+        self.every = max(every, 1)
+        self._max_keys = max_keys
+        self._counts: Dict[Hashable, int] = {}
+
+    def sample(self, key: Hashable) -> bool:
+        """
+        Count an occurrence, lock free so concurrent occurrences may be counted once.
+
+        :return sampled: True if this occurrence is to be logged
+        """
+        count = self._counts.get(key, 0)
+        if count == 0 and len(self._counts) >= self._max_keys:
+            self._counts.clear()
+        self._counts[key] = count + 1
+        return count % self.every == 0
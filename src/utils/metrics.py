@@ -0,0 +1,275 @@
+"""
+Counters, histograms and gauges exposed on /metrics in the Prometheus text format.
+
+Recording is lock free: every thread updates values of its own and a scrape adds them up. The values of a
+thread that ends are folded into the metric, so short lived request threads do not pile up. Gauges are not
+recorded at all, they are read from the server state when scraped.
+"""
+
+from bisect import bisect_left
+from threading import (
+    Lock,
+    local,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Sequence,
+    Tuple,
+)
+import weakref
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds, from a local subscriber answering straight away to one running into the read timeout
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Labels = Tuple[str, ...]
+
+
+class _ThreadValues:
+    """Values recorded by one thread, the metric is told when the thread ends."""
+
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self) -> None:
+        self.values: Dict[Labels, Any] = {}
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = local()
+        # guards the list of per thread values, never taken while recording
+        self._lock = Lock()
+        self._threads: List[Dict[Labels, Any]] = []
+        # values of threads that ended
+        self._retired: Dict[Labels, Any] = {}
+
+    def remove(self, *labels: str) -> None:
+        """
+        Drop every series whose label values start with the given ones, e.g. those of a removed subscriber.
+        """
+        n = len(labels)
+        with self._lock:
+            for values in [self._retired, *self._threads]:
+                for key in [key for key in list(values) if key[:n] == labels]:
+                    values.pop(key, None)
+
+    def collect(self) -> Dict[Labels, Any]:
+        """
+        :return values: current value of every series, summed across threads
+        """
+        with self._lock:
+            totals: Dict[Labels, Any] = {}
+            for values in [self._retired, *self._threads]:
+                self._merge(totals, values.copy())
+        return totals
+
+    def _values(self) -> Dict[Labels, Any]:
+        """
+        Values of the calling thread, only ever changed by it.
+        """
+        try:
+            return self._local.thread.values
+        except AttributeError:
+            thread = self._local.thread = _ThreadValues()
+            with self._lock:
+                self._threads.append(thread.values)
+            weakref.finalize(thread, self._retire, thread.values)
+            return thread.values
+
+    def _retire(self, values: Dict[Labels, Any]) -> None:
+        with self._lock:
+            self._threads.remove(values)
+            self._merge(self._retired, values)
+
+    def _merge(self, into: Dict[Labels, Any], values: Dict[Labels, Any]) -> None:
+        raise NotImplementedError
+
+    def render(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def _merge(self, into: Dict[Labels, Any], values: Dict[Labels, Any]) -> None:
+        for labels, value in values.items():
+            into[labels] = into.get(labels, 0) + value
+
+    def render(self) -> Iterable[str]:
+        for labels, value in sorted(self.collect().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        values = self._values()
+        # count per bucket, not cumulative, one more for +Inf and the sum last
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, into: Dict[Labels, Any], values: Dict[Labels, Any]) -> None:
+        for labels, counts in values.items():
+            total = into.get(labels)
+            if total is None:
+                into[labels] = list(counts)
+            else:
+                into[labels] = [a + b for a, b in zip(total, counts)]
+
+    def render(self) -> Iterable[str]:
+        labelnames = self.labelnames + ("le",)
+        for labels, counts in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(labelnames, labels + (le,))} {cumulative}"
+            series = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{series} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{series} {cumulative}"
+
+
+class Gauge:
+    """
+    A value read from the server state on every scrape, e.g. the depth of every backlog.
+    """
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        collect: Callable[[], Iterable[Tuple[Labels, float]]],
+    ) -> None:
+        """
+        :param collect: Returns the label values and value of every series
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._collect = collect
+
+    def render(self) -> Iterable[str]:
+        for labels, value in sorted(self._collect()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Any] = {}
+        self._lock = Lock()
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        collect: Callable[[], Iterable[Tuple[Labels, float]]],
+    ) -> Gauge:
+        """
+        Register a gauge, replacing any gauge of the same name, so the latest server state is the one read.
+        """
+        gauge = Gauge(name, documentation, labelnames, collect)
+        with self._lock:
+            self._metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: Any) -> Any:
+        """
+        Counters and histograms are registered once, registering one again returns the existing one.
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+
+def _format_labels(labelnames: Sequence[str], labels: Labels) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+# metrics of the server process, rendered by /metrics
+REGISTRY = MetricsRegistry()
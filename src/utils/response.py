@@ -1,3 +1,8 @@
+from typing import (
+    Any,
+    Dict,
+    Optional,
+)
 from flask import (
     make_response,
     jsonify,
@@ -6,12 +11,13 @@ from flask import (
 
 class Response:
     @staticmethod
-    def create(message: str, status_code: int):
+    def create(message: str, status_code: int, data: Optional[Dict[str, Any]] = None):
+        body = {
+            "message": message,
+        }
+        if data:
+            body.update(data)
         return make_response(
-            jsonify(
-                {
-                    "message": message,
-                }
-            ),
+            jsonify(body),
             status_code,
         )
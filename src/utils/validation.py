@@ -1,25 +1,72 @@
-import re
+from functools import lru_cache
 from validators.url import url as isNormalURL
+from manager.topic_index import (
+    SEPARATOR,
+    WILDCARD_MANY,
+    WILDCARD_ONE,
+)
+from utils.config import Config
+import re
+
+# adapted from the following sources:
+# https://www.geeksforgeeks.org/check-if-an-url-is-valid-or-not-using-regular-expression/
+# https://www.regextester.com/111391
+# https://github.com/python-validators/validators/blob/master/src/validators/url.py
+
+# http[s]://localhost:PORT/PATH
+LOCALHOST_URL = re.compile(r"^https?://localhost(:[0-9]+)?(/.*)?$")
+# scheme://something without whitespace, anything else is rejected without the full check
+URL_SHAPE = re.compile(r"^[A-Za-z][A-Za-z0-9+.-]*://\S+$")
+
+
+@lru_cache(maxsize=Config.URL_VALIDATION_CACHE_SIZE)
+def _is_valid_url(url: str) -> bool:
+    if LOCALHOST_URL.match(url):
+        return True
+    if not URL_SHAPE.match(url):
+        return False
+    try:
+        return bool(isNormalURL(url))
+    except Exception:
+        # older versions of validators raise instead of returning a falsy ValidationError
+        return False
 
 
 class Validation:
     @staticmethod
     def isValidUrl(url: str) -> bool:
-        # adapted from the following sources:
-        # https://www.geeksforgeeks.org/check-if-an-url-is-valid-or-not-using-regular-expression/
-        # https://www.regextester.com/111391
-        # https://github.com/python-validators/validators/blob/master/src/validators/url.py
-
-        if not url:
+        """
+        Results are cached, subscribers are validated again every time they renew or change a subscription.
+        """
+        if not url or not isinstance(url, str):
             return False
+        return _is_valid_url(url)
 
-        pattern = re.compile(
-            "^https?://localhost(:[0-9]+)?(/.*)?$"
-        )  # patter for http[s]://localhost:PORT/PATH
-        try:
-            if re.search(pattern, url) or isNormalURL(url):
-                return True
-        except:  # noqa
-            pass  # isNormalURL throws an error if not True.
+    @staticmethod
+    def isValidTopic(topic: str) -> bool:
+        """
+        Concrete topics are published to, none of their levels may be empty or contain a wildcard.
+        """
+        if not topic:
+            return False
+        return all(
+            level and WILDCARD_ONE not in level and WILDCARD_MANY not in level
+            for level in topic.split(SEPARATOR)
+        )
 
-        return False
+    @staticmethod
+    def isValidTopicPattern(pattern: str) -> bool:
+        """
+        Patterns are subscribed to, a wildcard must fill a whole level and # may only be the last level.
+        """
+        if not pattern:
+            return False
+        levels = pattern.split(SEPARATOR)
+        for i, level in enumerate(levels):
+            if level == WILDCARD_ONE or (
+                level == WILDCARD_MANY and i == len(levels) - 1
+            ):
+                continue
+            if not Validation.isValidTopic(level):
+                return False
+        return True
@@ -0,0 +1,7 @@
+#!/bin/bash
+
+source venv/bin/activate
+
+export LEAFI_SERVER_PORT=8000
+
+python src/async_main.py
@@ -0,0 +1,51 @@
+import threading
+import unittest
+from manager.batcher import DeliveryBatcher
+
+
+class TestDeliveryBatcher(unittest.TestCase):
+    def setUp(self) -> None:
+        self.flushed = []
+        self.called = threading.Event()
+
+        def flush(subscriber, entries):
+            self.flushed.append((subscriber, entries))
+            self.called.set()
+
+        self.batcher = DeliveryBatcher(flush=flush)
+
+    def tearDown(self) -> None:
+        self.batcher.shutdown()
+
+    def test_full_batch_is_flushed_inline(self):
+        for seq in range(3):
+            self.batcher.add("subscriber", seq, {"n": seq}, max_size=3, max_linger=60)
+
+        self.assertEqual(
+            self.flushed,
+            [("subscriber", [(0, {"n": 0}), (1, {"n": 1}), (2, {"n": 2})])],
+        )
+
+    def test_lingering_batch_is_flushed_by_timer(self):
+        self.batcher.add("subscriber", 1, {"n": 1}, max_size=10, max_linger=0.01)
+        self.batcher.add("other", 2, {"n": 2}, max_size=10, max_linger=60)
+
+        self.assertTrue(self.called.wait(timeout=5))
+        self.assertEqual(self.flushed, [("subscriber", [(1, {"n": 1})])])
+
+    def test_stale_deadline_does_not_flush_next_batch(self):
+        self.batcher.add("subscriber", 1, {"n": 1}, max_size=1, max_linger=0.01)
+        self.batcher.add("subscriber", 2, {"n": 2}, max_size=10, max_linger=60)
+        self.called.clear()
+
+        # the deadline of the first batch passes without touching the second one
+        self.assertFalse(self.called.wait(timeout=0.1))
+        self.assertEqual(self.flushed, [("subscriber", [(1, {"n": 1})])])
+
+    def test_far_deadline_keeps_timer_running(self):
+        self.batcher.add("far", 1, {"n": 1}, max_size=10, max_linger=1e308)
+        self.called.wait(timeout=0.05)
+        self.batcher.add("subscriber", 2, {"n": 2}, max_size=10, max_linger=0.01)
+
+        self.assertTrue(self.called.wait(timeout=5))
+        self.assertEqual(self.flushed, [("subscriber", [(2, {"n": 2})])])
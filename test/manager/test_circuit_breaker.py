@@ -0,0 +1,55 @@
+import unittest
+from unittest.mock import patch
+from manager.circuit_breaker import (
+    CircuitBreaker,
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self) -> None:
+        self.circuit_breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+
+    def test_opens_after_consecutive_failures(self):
+        self.circuit_breaker.record_failure()
+        self.circuit_breaker.record_failure()
+        self.circuit_breaker.record_success()
+        self.circuit_breaker.record_failure()
+        self.circuit_breaker.record_failure()
+        self.assertEqual(self.circuit_breaker.state, STATE_CLOSED)
+        self.assertTrue(self.circuit_breaker.allow_request())
+
+        self.circuit_breaker.record_failure()
+        self.assertEqual(self.circuit_breaker.state, STATE_OPEN)
+        self.assertFalse(self.circuit_breaker.allow_request())
+        self.assertEqual(
+            self.circuit_breaker.to_dict(),
+            {"state": STATE_OPEN, "consecutive_failures": 3},
+        )
+
+    @patch("manager.circuit_breaker.time")
+    def test_half_open_probe(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        for _ in range(3):
+            self.circuit_breaker.record_failure()
+
+        time_mock.monotonic.return_value = 104
+        self.assertEqual(self.circuit_breaker.retry_after(), 6)
+
+        time_mock.monotonic.return_value = 111
+        self.assertTrue(self.circuit_breaker.allow_request())
+        self.assertEqual(self.circuit_breaker.state, STATE_HALF_OPEN)
+        # only a single probe is let through
+        self.assertFalse(self.circuit_breaker.allow_request())
+
+        self.circuit_breaker.record_failure()
+        self.assertEqual(self.circuit_breaker.state, STATE_OPEN)
+        self.assertFalse(self.circuit_breaker.allow_request())
+
+        time_mock.monotonic.return_value = 122
+        self.assertTrue(self.circuit_breaker.allow_request())
+        self.circuit_breaker.record_success()
+        self.assertEqual(self.circuit_breaker.state, STATE_CLOSED)
+        self.assertEqual(self.circuit_breaker.retry_after(), 0)
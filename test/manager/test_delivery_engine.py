@@ -0,0 +1,76 @@
+import time
+import unittest
+from unittest.mock import patch
+from manager.delivery_engine import DeliveryEngine
+from manager.envelope import compress
+from utils.http_codes import (
+    HTTP_OK,
+    HTTP_SERVICE_UNAVAILABLE,
+)
+from requests.exceptions import ConnectTimeout
+
+
+class TestDeliveryEngine(unittest.TestCase):
+    def setUp(self) -> None:
+        self.delivery_engine = DeliveryEngine(
+            max_workers=8, connect_timeout=1.5, read_timeout=3.0
+        )
+        self.subscribers = [f"http://localhost:8000/testing/{i}" for i in range(8)]
+        self.payload = b'{"message": "this is a test message"}'
+
+    def tearDown(self) -> None:
+        self.delivery_engine.shutdown()
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_deliver_success(self, post_mock):
+        post_mock.return_value.status_code = HTTP_OK
+
+        result = self.delivery_engine.deliver(self.subscribers[0], self.payload)
+
+        self.assertTrue(result.delivered)
+        self.assertEqual(result.status_code, HTTP_OK)
+        self.assertEqual(post_mock.call_args.kwargs["timeout"], (1.5, 3.0))
+        self.assertEqual(post_mock.call_args.kwargs["data"], self.payload)
+        self.assertNotIn("Content-Encoding", post_mock.call_args.kwargs["headers"])
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_deliver_compressed(self, post_mock):
+        post_mock.return_value.status_code = HTTP_OK
+
+        self.delivery_engine.deliver(self.subscribers[0], compress(self.payload))
+        self.assertEqual(
+            post_mock.call_args.kwargs["headers"]["Content-Encoding"], "gzip"
+        )
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_deliver_failures(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        post_mock.return_value.text = "unavailable"
+
+        result = self.delivery_engine.deliver(self.subscribers[0], self.payload)
+        self.assertFalse(result.delivered)
+        self.assertEqual(result.status_code, HTTP_SERVICE_UNAVAILABLE)
+        self.assertEqual(result.error, "unavailable")
+
+        post_mock.side_effect = ConnectTimeout("Testing timeout")
+        result = self.delivery_engine.deliver(self.subscribers[0], self.payload)
+        self.assertFalse(result.delivered)
+        self.assertIsNone(result.status_code)
+        self.assertIn("Testing timeout", result.error)
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_fan_out_is_concurrent_and_ordered(self, post_mock):
+        def slow_post(url, **kwargs):
+            time.sleep(0.2)
+            post_mock.return_value.status_code = HTTP_OK
+            return post_mock.return_value
+
+        post_mock.side_effect = slow_post
+
+        start = time.monotonic()
+        results = self.delivery_engine.fan_out(self.subscribers, self.payload)
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 0.2 * len(self.subscribers) / 2)
+        self.assertEqual([result.subscriber for result in results], self.subscribers)
+        self.assertTrue(all(result.delivered for result in results))
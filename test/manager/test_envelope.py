@@ -0,0 +1,86 @@
+import json
+import unittest
+from datetime import (
+    datetime,
+    timezone,
+)
+from manager.envelope import (
+    Envelope,
+    encode_batch,
+    is_compressed,
+)
+
+
+class TestEnvelope(unittest.TestCase):
+    def setUp(self) -> None:
+        self.published_at = datetime(2024, 8, 4, 12, 0, 0, 123456, tzinfo=timezone.utc)
+        self.message = {"message": "this is a test message"}
+        self.envelope = Envelope.create("test-topic", self.message, self.published_at)
+
+    def test_create_encodes_message_once(self):
+        self.assertEqual(
+            json.loads(self.envelope.body),
+            {
+                "message": "this is a test message",
+                "topic": "test-topic",
+                "message_timestamp_utc": "2024-08-04T12:00:00.123456+00:00",
+            },
+        )
+        self.assertEqual(self.message, {"message": "this is a test message"})
+        self.assertEqual(self.envelope["topic"], "test-topic")
+        self.assertEqual(len(self.envelope.id), 32)
+        with self.assertRaises(AttributeError):
+            self.envelope.body = b"{}"
+
+    def test_compact_fields(self):
+        self.assertEqual(self.envelope.published_at, 1722772800123456)
+        self.assertEqual(self.envelope.timestamp, self.published_at.isoformat())
+        other = Envelope.create("".join(["test-", "topic"]), self.message)
+        self.assertIs(other.topic, self.envelope.topic)
+        self.assertFalse(hasattr(self.envelope, "__dict__"))
+
+    def test_record_round_trip(self):
+        record = json.loads(json.dumps(self.envelope.to_record()))
+        restored = Envelope.from_record(record)
+        self.assertEqual(restored.id, self.envelope.id)
+        self.assertEqual(restored.published_at, self.envelope.published_at)
+        self.assertEqual(restored.body, self.envelope.body)
+
+    def test_legacy_records(self):
+        restored = Envelope.from_record(
+            [self.envelope.id, "test-topic", self.published_at.isoformat(), "{}"]
+        )
+        self.assertEqual(restored.published_at, self.envelope.published_at)
+
+        restored = Envelope.from_record(
+            {"message": "hi", "message_timestamp_utc": self.published_at.isoformat()}
+        )
+        self.assertEqual(restored.published_at, self.envelope.published_at)
+        self.assertEqual(restored["message"], "hi")
+
+    def test_compression(self):
+        message = {"message": "x" * 1000}
+        envelope = Envelope.create("test-topic", message, compress_threshold=100)
+        self.assertTrue(envelope.compressed)
+        self.assertTrue(is_compressed(envelope.data))
+        self.assertLess(len(envelope.data), 1000)
+        self.assertEqual(json.loads(envelope.body)["message"], message["message"])
+        self.assertEqual(envelope["message"], message["message"])
+
+        restored = Envelope.from_record(json.loads(json.dumps(envelope.to_record())))
+        self.assertEqual(restored.data, envelope.data)
+
+        # below the threshold, or when compression does not pay off, bodies are kept as they are
+        self.assertFalse(self.envelope.compressed)
+        envelope = Envelope.create("t", {"message": "x"}, compress_threshold=1)
+        self.assertFalse(envelope.compressed)
+
+    def test_encode_batch(self):
+        batch = json.loads(encode_batch([self.envelope, self.envelope]))
+        self.assertEqual(
+            [message["message"] for message in batch], ["this is a test message"] * 2
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+import os
+import tempfile
+import time
+import unittest
+from itertools import chain
+from unittest.mock import patch
+from manager.journal import (
+    Journal,
+    JournalError,
+)
+from manager.message_broker import MessageBroker
+from manager.subscription_manager import SubscriptionManager
+from utils.http_codes import HTTP_SERVICE_UNAVAILABLE
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.temp_dir.name
+        self.journal = Journal(data_dir=self.data_dir)
+
+    def tearDown(self) -> None:
+        self.journal.close()
+        self.temp_dir.cleanup()
+
+    def reopen(self) -> Journal:
+        self.journal.close()
+        self.journal = Journal(data_dir=self.data_dir)
+        return self.journal
+
+    def test_append_sync_replay(self):
+        lsn = self.journal.append({"op": "sub", "topic": "t", "url": "u"})
+        self.journal.sync(lsn)
+        self.journal.append({"op": "del", "sub": "u", "seqs": [1]})
+
+        records = list(self.reopen().replay())
+        self.assertEqual(
+            records,
+            [
+                {"op": "sub", "topic": "t", "url": "u"},
+                {"op": "del", "sub": "u", "seqs": [1]},
+            ],
+        )
+
+    def test_replay_ignores_torn_tail(self):
+        self.journal.append({"op": "sub", "topic": "t", "url": "u"})
+        self.journal.close()
+        segment = sorted(os.listdir(self.data_dir))[-1]
+        with open(os.path.join(self.data_dir, segment), "ab") as file:
+            file.write(b'deadbeef {"op": "sub", "topi')
+
+        self.journal = Journal(data_dir=self.data_dir)
+        self.assertEqual(
+            list(self.journal.replay()), [{"op": "sub", "topic": "t", "url": "u"}]
+        )
+
+    def test_failed_fsync_fails_sync(self):
+        with patch("manager.journal.os.fsync", side_effect=OSError(5, "EIO")):
+            lsn = self.journal.append({"op": "sub", "topic": "t", "url": "u"})
+            with self.assertRaises(JournalError):
+                self.journal.sync(lsn)
+
+        # the journal stays failed, later records are not persisted either
+        lsn = self.journal.append({"op": "sub", "topic": "t", "url": "later"})
+        with self.assertRaises(JournalError):
+            self.journal.sync(lsn)
+
+    def test_failed_fsync_fails_publish(self):
+        message_broker = MessageBroker(journal=self.journal)
+        with patch("manager.journal.os.fsync", side_effect=OSError(28, "ENOSPC")):
+            with self.assertRaises(JournalError):
+                message_broker.publish_message(
+                    topic="t", subscribers=["http://localhost:8000/a"], message={}
+                )
+        message_broker.shutdown()
+
+    def test_checkpoint_compacts_segments(self):
+        for i in range(10):
+            self.journal.append({"op": "sub", "topic": "t", "url": f"u{i}"})
+        self.journal.checkpoint([{"op": "sub", "topic": "t", "url": "snapshot"}])
+        self.journal.append({"op": "sub", "topic": "t", "url": "tail"})
+
+        files = sorted(os.listdir(self.data_dir))
+        self.assertEqual(files, ["snapshot-00000002.log", "wal-00000002.log"])
+        self.assertEqual(
+            [record["url"] for record in self.reopen().replay()], ["snapshot", "tail"]
+        )
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_recover_broker_and_subscriptions(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        subscriber = "http://localhost:8000/durable"
+        subscription_manager = SubscriptionManager(journal=self.journal)
+        message_broker = MessageBroker(journal=self.journal)
+
+        subscription_manager.subscribe("topic", subscriber)
+        for i in range(5):
+            message_broker.publish_message(
+                topic="topic", subscribers=[subscriber], message={"message": i}
+            )
+        message_broker.retrieve_messages(subscriber, 2)
+        self.journal.checkpoint(
+            chain(
+                subscription_manager.snapshot_records(),
+                message_broker.snapshot_records(),
+            )
+        )
+        message_broker.retrieve_messages(subscriber, 1)
+        message_broker.publish_message(
+            topic="topic", subscribers=[subscriber], message={"message": 5}
+        )
+
+        journal = self.reopen()
+        recovered_subscriptions = SubscriptionManager(journal=journal)
+        recovered_broker = MessageBroker(journal=journal)
+        for record in journal.replay():
+            recovered_subscriptions.restore(record)
+            recovered_broker.restore(record)
+
+        self.assertEqual(
+            recovered_subscriptions.get_subscribers("topic"), (subscriber,)
+        )
+        batch = recovered_broker.retrieve_messages(subscriber, 10)
+        self.assertEqual([entry.seq for entry in batch.entries], [4, 5, 6])
+        self.assertEqual(
+            [entry.message["message"] for entry in batch.entries], [3, 4, 5]
+        )
+        self.assertEqual(recovered_broker._budget.messages, 0)
+
+        # sequence numbers keep increasing after recovery
+        recovered_broker.publish_message(
+            topic="topic", subscribers=[subscriber], message={"message": 6}
+        )
+        self.assertEqual(
+            recovered_broker.retrieve_messages(subscriber, 1).entries[0].seq, 7
+        )
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_recover_after_unsubscribe(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        subscriber = "http://localhost:8000/returning"
+        message_broker = MessageBroker(journal=self.journal)
+        subscription_manager = SubscriptionManager(
+            journal=self.journal, on_endpoint_removed=message_broker.remove_subscriber
+        )
+
+        subscription_manager.subscribe("topic", subscriber)
+        for i in range(3):
+            message_broker.publish_message(
+                topic="topic", subscribers=[subscriber], message={"message": i}
+            )
+        subscription_manager.unsubscribe("topic", subscriber)
+        subscription_manager.subscribe("topic", subscriber)
+        message_broker.publish_message(
+            topic="topic", subscribers=[subscriber], message={"message": 3}
+        )
+
+        journal = self.reopen()
+        recovered_subscriptions = SubscriptionManager(journal=journal)
+        recovered_broker = MessageBroker(journal=journal)
+        for record in journal.replay():
+            recovered_subscriptions.restore(record)
+            recovered_broker.restore(record)
+
+        self.assertEqual(
+            recovered_subscriptions.get_subscribers("topic"), (subscriber,)
+        )
+        # the backlog dropped on unsubscribe stays dropped, the new one continues past its sequence numbers
+        batch = recovered_broker.retrieve_messages(subscriber, 10)
+        self.assertEqual([entry.seq for entry in batch.entries], [4])
+        self.assertEqual(batch.entries[0].message["message"], 3)
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_recover_dead_letters(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        subscriber = "http://localhost:8000/dead"
+        message_broker = MessageBroker(
+            journal=self.journal, retry_max_attempts=1, retry_base_delay=0.01
+        )
+        for i in range(2):
+            message_broker.publish_message(
+                topic="topic", subscribers=[subscriber], message={"message": i}
+            )
+
+        subscriber_queue = message_broker._messages_map[subscriber]
+        deadline = time.monotonic() + 5
+        while len(subscriber_queue) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        message_broker.shutdown()
+        self.assertEqual(len(message_broker._dead_letters_map[subscriber]), 2)
+        # the checkpoint keeps both dead letters, the journal after it that one was polled
+        self.journal.checkpoint(message_broker.snapshot_records())
+        polled = message_broker.retrieve_dead_letters(subscriber, 1).entries[0]
+
+        journal = self.reopen()
+        recovered_broker = MessageBroker(journal=journal)
+        for record in journal.replay():
+            recovered_broker.restore(record)
+
+        self.assertEqual(
+            len(recovered_broker.retrieve_messages(subscriber, 10).entries), 0
+        )
+        dead_letters = recovered_broker.retrieve_dead_letters(subscriber, 10)
+        # retries are jittered, either message may have been dead-lettered first
+        self.assertEqual(
+            [entry.message["message"] for entry in dead_letters.entries],
+            [1 - polled.message["message"]],
+        )
@@ -1,16 +1,39 @@
+import gzip
+import json
+import time
 import unittest
 from unittest.mock import (
     patch,
     MagicMock,
 )
-from manager.message_broker import MessageBroker
+from manager.message_broker import (
+    MessageBroker,
+    DispatchQueueFullError,
+    DELIVERIES,
+    DELIVERY_DEAD_LETTERED,
+    DELIVERY_DELIVERED,
+    DELIVERY_FAILED,
+    DELIVERY_PENDING,
+    DELIVERY_QUEUED,
+    DELIVERY_SECONDS,
+    POLLED_MESSAGES,
+)
 from utils.http_codes import (
     HTTP_OK,
     HTTP_SERVICE_UNAVAILABLE,
 )
 from requests.exceptions import ConnectionError
-from collections import deque
-from threading import Thread
+from manager.subscriber_queue import (
+    BacklogFullError,
+    OVERFLOW_REJECT,
+    SubscriberQueue,
+)
+from manager.rate_limiter import TokenBucketLimiter
+from manager.subscription_manager import SubscriptionOptions
+from threading import (
+    Thread,
+    Timer,
+)
 
 
 class TestMessageBroker(unittest.TestCase):
@@ -23,9 +46,9 @@ class TestMessageBroker(unittest.TestCase):
         ]
         self.message = {"message": "this is a test message", "whoami": "the publisher"}
 
-    @patch("manager.message_broker.requests")
-    def test_publish_message_basic_success(self, request_mock):
-        request_mock.post.return_value.status_code = HTTP_OK
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_publish_message_basic_success(self, post_mock):
+        post_mock.return_value.status_code = HTTP_OK
 
         failed_subscribers = self.message_broker.publish_message(
             topic=self.topic, subscribers=self.subscribers, message=self.message
@@ -35,9 +58,9 @@ class TestMessageBroker(unittest.TestCase):
         for subscriber in self.subscribers:
             self.assertTrue(len(self.message_broker._messages_map[subscriber]) == 0)
 
-    @patch("manager.message_broker.requests")
-    def test_publish_message_failed_subscribers(self, request_mock):
-        request_mock.post.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_publish_message_failed_subscribers(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
         failed_subscribers = self.message_broker.publish_message(
             topic=self.topic, subscribers=self.subscribers, message=self.message
         )
@@ -49,13 +72,15 @@ class TestMessageBroker(unittest.TestCase):
         for subscriber in self.subscribers:
             self.assertTrue(len(self.message_broker._messages_map[subscriber]) == 1)
             self.assertEqual(
-                self.message_broker._messages_map[subscriber].popleft()["topic"],
+                self.message_broker._messages_map[subscriber]
+                .popleft()
+                .message["topic"],
                 self.topic,
             )
 
-    @patch("manager.message_broker.requests")
-    def test_publish_message_raised_exception(self, request_mock):
-        request_mock.post.side_effect = ConnectionError("Testing raised exception")
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_publish_message_raised_exception(self, post_mock):
+        post_mock.side_effect = ConnectionError("Testing raised exception")
 
         with self.assertLogs("manager.message_broker", level="ERROR"):
             failed_subscribers = self.message_broker.publish_message(
@@ -70,14 +95,86 @@ class TestMessageBroker(unittest.TestCase):
 
         # test with data
         for subscriber in self.subscribers:
-            self.message_broker._messages_map[subscriber] = deque()
+            self.message_broker._messages_map[subscriber] = SubscriberQueue()
             self.message_broker._messages_map[subscriber].append(self.message)
         message = self.message_broker.retrieve_message(self.subscribers[1])
         self.assertEqual(message["whoami"], self.message["whoami"])
 
-    @patch("manager.message_broker.requests")
-    def test_message_broker_integration_basic_success(self, request_mock):
-        request_mock.post.return_value.status_code = HTTP_OK
+    def test_retrieve_messages(self):
+        batch = self.message_broker.retrieve_messages(self.subscribers[0], 10)
+        self.assertEqual(batch.entries, [])
+        self.assertIsNone(batch.next_cursor)
+
+        for i in range(5):
+            self.message_broker._get_queue(self.subscribers[0]).append({"message": i})
+
+        batch = self.message_broker.retrieve_messages(self.subscribers[0], 3)
+        self.assertEqual(
+            [entry.message["message"] for entry in batch.entries], [0, 1, 2]
+        )
+        self.assertEqual(batch.next_cursor, 4)
+
+        batch = self.message_broker.retrieve_messages(self.subscribers[0], 3)
+        self.assertEqual([entry.message["message"] for entry in batch.entries], [3, 4])
+        self.assertIsNone(batch.next_cursor)
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_retrieve_messages_long_poll(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+
+        batch = self.message_broker.retrieve_messages(
+            self.subscribers[0], 10, timeout=0.01
+        )
+        self.assertEqual(batch.entries, [])
+        # waiting for a subscriber nothing was queued for leaves nothing behind
+        self.assertNotIn(self.subscribers[0], self.message_broker._messages_map)
+        self.assertEqual(self.message_broker._watchers, {})
+
+        publisher = Timer(
+            0.05,
+            self.message_broker.publish_message,
+            kwargs={
+                "topic": self.topic,
+                "subscribers": self.subscribers[:1],
+                "message": self.message,
+            },
+        )
+        publisher.start()
+        batch = self.message_broker.retrieve_messages(
+            self.subscribers[0], 10, timeout=5
+        )
+        publisher.join()
+        self.assertEqual(len(batch.entries), 1)
+        self.assertEqual(batch.entries[0].message["whoami"], self.message["whoami"])
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_peek_messages_until_acked(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        for i in range(3):
+            self.message_broker.publish_message(
+                topic=self.topic, subscribers=self.subscribers[:1], message={"i": i}
+            )
+
+        batch = self.message_broker.peek_messages(self.subscribers[0], 2)
+        self.assertEqual([entry.message["i"] for entry in batch.entries], [0, 1])
+        self.assertEqual(batch.next_cursor, batch.entries[0].seq)
+        # peeking again returns the same entries until they are acked
+        self.assertEqual(
+            self.message_broker.peek_messages(self.subscribers[0], 2), batch
+        )
+
+        self.assertTrue(
+            self.message_broker.ack_message(self.subscribers[0], batch.entries[0].seq)
+        )
+        self.assertFalse(
+            self.message_broker.ack_message(self.subscribers[0], batch.entries[0].seq)
+        )
+        batch = self.message_broker.peek_messages(self.subscribers[0], 10)
+        self.assertEqual([entry.message["i"] for entry in batch.entries], [1, 2])
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_message_broker_integration_basic_success(self, post_mock):
+        post_mock.return_value.status_code = HTTP_OK
 
         self.message_broker.publish_message(
             topic=self.topic, subscribers=self.subscribers, message=self.message
@@ -86,11 +183,11 @@ class TestMessageBroker(unittest.TestCase):
         self.assertIsNone(message)
 
     @patch("manager.message_broker.datetime")
-    @patch("manager.message_broker.requests")
-    def test_message_broker_integration_failure(self, request_mock, datetime_mock):
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_message_broker_integration_failure(self, post_mock, datetime_mock):
         time_isoformat = "2024-08-04T12:00:00+00:00"
 
-        request_mock.post.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
         datetime_mock.now.return_value = MagicMock()
         datetime_mock.now.return_value.isoformat.return_value = time_isoformat
 
@@ -103,9 +200,9 @@ class TestMessageBroker(unittest.TestCase):
         self.assertEqual(message["topic"], self.topic)
         self.assertEqual(message["message_timestamp_utc"], time_isoformat)
 
-    @patch("manager.message_broker.requests")
-    def test_publish_retrieve_concurrently(self, request_mock):
-        request_mock.post.return_value.status_code = HTTP_OK
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_publish_retrieve_concurrently(self, post_mock):
+        post_mock.return_value.status_code = HTTP_OK
 
         def publish_messages():  # pragma no cover
             for i in range(10):
@@ -136,3 +233,556 @@ class TestMessageBroker(unittest.TestCase):
                     self.assertEqual(
                         len(self.message_broker._messages_map[subscriber]), 0
                     )
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_successful_delivery_acks_only_delivered_message(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        undelivered = {"message": "undelivered"}
+        self.message_broker.publish_message(
+            topic=self.topic, subscribers=self.subscribers[:1], message=undelivered
+        )
+
+        post_mock.return_value.status_code = HTTP_OK
+        self.message_broker.publish_message(
+            topic=self.topic,
+            subscribers=self.subscribers[:1],
+            message={"message": "delivered"},
+        )
+
+        message = self.message_broker.retrieve_message(self.subscribers[0])
+        self.assertEqual(message["message"], "undelivered")
+        self.assertIsNone(self.message_broker.retrieve_message(self.subscribers[0]))
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_publish_message_backlog_full_rejected(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        message_broker = MessageBroker(
+            max_queue_messages=1, overflow_policy=OVERFLOW_REJECT
+        )
+        message_broker._get_queue(self.subscribers[1]).append({"message": "waiting"})
+
+        with self.assertRaises(BacklogFullError):
+            message_broker.publish_message(
+                topic=self.topic, subscribers=self.subscribers, message=self.message
+            )
+
+        # the publish is rolled back for every subscriber
+        self.assertEqual(len(message_broker._messages_map[self.subscribers[0]]), 0)
+        self.assertEqual(len(message_broker._messages_map[self.subscribers[1]]), 1)
+        self.assertEqual(message_broker._budget.messages, 1)
+        post_mock.assert_not_called()
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_rejected_message_never_polled(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        message_broker = MessageBroker(
+            max_queue_messages=1, overflow_policy=OVERFLOW_REJECT
+        )
+        message_broker._get_queue(self.subscribers[0])
+        full_queue = message_broker._get_queue(self.subscribers[1])
+        full_queue.append({"message": "waiting"})
+
+        # a poll runs while the second backlog rejects the message the first one already took
+        polled = []
+        poller = Thread(
+            target=lambda: polled.extend(
+                message_broker.retrieve_messages(self.subscribers[0], 10).entries
+            )
+        )
+        append = full_queue.append
+
+        def rejecting_append(*args):
+            poller.start()
+            poller.join(timeout=0.2)
+            return append(*args)
+
+        full_queue.append = rejecting_append
+        with self.assertRaises(BacklogFullError):
+            message_broker.publish_message(
+                topic=self.topic, subscribers=self.subscribers, message=self.message
+            )
+        poller.join()
+
+        self.assertEqual(polled, [])
+        self.assertEqual(len(message_broker._messages_map[self.subscribers[0]]), 0)
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_failed_delivery_is_retried(self, post_mock):
+        attempts = []
+
+        def post(url, **kwargs):
+            attempts.append(url)
+            response = MagicMock()
+            response.status_code = (
+                HTTP_OK if len(attempts) == 3 else HTTP_SERVICE_UNAVAILABLE
+            )
+            return response
+
+        post_mock.side_effect = post
+        message_broker = MessageBroker(retry_max_attempts=5, retry_base_delay=0.01)
+        message_broker.publish_message(
+            topic=self.topic, subscribers=self.subscribers[:1], message=self.message
+        )
+
+        subscriber_queue = message_broker._messages_map[self.subscribers[0]]
+        deadline = time.monotonic() + 5
+        while len(subscriber_queue) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        message_broker.shutdown()
+
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(len(subscriber_queue), 0)
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_open_breaker_does_not_use_up_retries(self, post_mock):
+        # the first delivery opens the breaker, redeliveries due before it lets a probe through are
+        # postponed, not counted as attempts
+        responses = iter([HTTP_SERVICE_UNAVAILABLE, HTTP_SERVICE_UNAVAILABLE])
+
+        def post(url, **kwargs):
+            response = MagicMock()
+            response.status_code = next(responses, HTTP_OK)
+            return response
+
+        post_mock.side_effect = post
+        message_broker = MessageBroker(
+            retry_max_attempts=2,
+            retry_base_delay=0.01,
+            breaker_failure_threshold=1,
+            breaker_reset_timeout=0.2,
+        )
+        message_broker.publish_message(
+            topic=self.topic, subscribers=self.subscribers[:1], message=self.message
+        )
+
+        subscriber_queue = message_broker._messages_map[self.subscribers[0]]
+        deadline = time.monotonic() + 5
+        while len(subscriber_queue) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        message_broker.shutdown()
+
+        self.assertEqual(post_mock.call_count, 3)
+        self.assertEqual(len(subscriber_queue), 0)
+        self.assertNotIn(self.subscribers[0], message_broker._dead_letters_map)
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_exhausted_retries_are_dead_lettered(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        message_broker = MessageBroker(retry_max_attempts=2, retry_base_delay=0.01)
+        message_broker.publish_message(
+            topic=self.topic, subscribers=self.subscribers[:1], message=self.message
+        )
+
+        deadline = time.monotonic() + 5
+        while (
+            self.subscribers[0] not in message_broker._dead_letters_map
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.01)
+        message_broker.shutdown()
+
+        self.assertEqual(post_mock.call_count, 3)
+        self.assertEqual(len(message_broker._messages_map[self.subscribers[0]]), 0)
+        batch = message_broker.retrieve_dead_letters(self.subscribers[0], 10)
+        self.assertEqual(len(batch.entries), 1)
+        self.assertEqual(batch.entries[0].message["whoami"], self.message["whoami"])
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_batched_delivery(self, post_mock):
+        post_mock.return_value.status_code = HTTP_OK
+        options = SubscriptionOptions(batch_max_size=3, batch_max_linger=60)
+        message_broker = MessageBroker(
+            subscription_options=lambda subscriber: (
+                options if subscriber == self.subscribers[0] else None
+            )
+        )
+
+        for i in range(3):
+            failed_subscribers = message_broker.publish_message(
+                topic=self.topic, subscribers=self.subscribers, message={"n": i}
+            )
+            self.assertEqual(failed_subscribers, [])
+
+        subscriber_queue = message_broker._messages_map[self.subscribers[0]]
+        deadline = time.monotonic() + 5
+        while len(subscriber_queue) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        message_broker.shutdown()
+
+        self.assertEqual(len(subscriber_queue), 0)
+        # one POST per message for the plain subscriber, one array POST for the batched one
+        self.assertEqual(post_mock.call_count, 4)
+        batches = [
+            json.loads(call.kwargs["data"])
+            for call in post_mock.call_args_list
+            if call.kwargs["url"] == self.subscribers[0]
+        ]
+        self.assertEqual(len(batches), 1)
+        self.assertEqual([message["n"] for message in batches[0]], [0, 1, 2])
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_batched_subscribers_reported_queued(self, post_mock):
+        post_mock.return_value.status_code = HTTP_OK
+        options = SubscriptionOptions(batch_max_size=2, batch_max_linger=60)
+        message_broker = MessageBroker(
+            subscription_options=lambda subscriber: (
+                options if subscriber == self.subscribers[0] else None
+            )
+        )
+
+        def wait_for_status(message_id, expected):
+            deadline = time.monotonic() + 5
+            while (
+                message_broker.get_delivery_status(message_id) != expected
+                and time.monotonic() < deadline
+            ):
+                time.sleep(0.01)
+            self.assertEqual(message_broker.get_delivery_status(message_id), expected)
+
+        message_id = message_broker.submit_message(
+            topic=self.topic, subscribers=self.subscribers, message={"n": 0}
+        )
+        wait_for_status(
+            message_id,
+            {
+                self.subscribers[0]: DELIVERY_QUEUED,
+                self.subscribers[1]: DELIVERY_DELIVERED,
+            },
+        )
+        # not delivered before its batch was posted
+        self.assertNotIn(
+            self.subscribers[0],
+            [call.kwargs["url"] for call in post_mock.call_args_list],
+        )
+
+        # the second message fills the batch
+        result = message_broker.publish_batch(
+            [(self.topic, self.subscribers, {"n": 1})]
+        )[0]
+        self.assertEqual(result.queued_subscribers, self.subscribers[:1])
+        self.assertEqual(result.failed_subscribers, [])
+        wait_for_status(
+            message_id,
+            {
+                self.subscribers[0]: DELIVERY_DELIVERED,
+                self.subscribers[1]: DELIVERY_DELIVERED,
+            },
+        )
+        message_broker.shutdown()
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_compressed_messages(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        options = SubscriptionOptions(accept_encoding="gzip")
+        message_broker = MessageBroker(
+            compress_threshold=100,
+            subscription_options=lambda subscriber: (
+                options if subscriber == self.subscribers[0] else None
+            ),
+        )
+        message = {"message": "x" * 1000}
+        message_broker.publish_message(self.topic, self.subscribers, message)
+
+        posted = {call.kwargs["url"]: call.kwargs for call in post_mock.call_args_list}
+        accepting, plain = posted[self.subscribers[0]], posted[self.subscribers[1]]
+        self.assertEqual(accepting["headers"]["Content-Encoding"], "gzip")
+        self.assertEqual(
+            json.loads(gzip.decompress(accepting["data"]))["message"], "x" * 1000
+        )
+        self.assertNotIn("Content-Encoding", plain["headers"])
+        self.assertEqual(json.loads(plain["data"])["message"], "x" * 1000)
+
+        # backlogs hold and account for the compressed bytes
+        subscriber_queue = message_broker._messages_map[self.subscribers[1]]
+        self.assertLess(subscriber_queue.bytes, 1000)
+        envelope = message_broker.retrieve_message(self.subscribers[1])
+        self.assertTrue(envelope.compressed)
+        self.assertEqual(envelope["message"], "x" * 1000)
+        message_broker.shutdown()
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_failed_batch_stays_queued(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        options = SubscriptionOptions(batch_max_size=2, batch_max_linger=60)
+        message_broker = MessageBroker(subscription_options=lambda _: options)
+
+        for i in range(2):
+            message_broker.publish_message(
+                topic=self.topic, subscribers=self.subscribers[:1], message={"n": i}
+            )
+
+        deadline = time.monotonic() + 5
+        while not post_mock.call_count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        message_broker.shutdown()
+
+        self.assertEqual(post_mock.call_count, 1)
+        self.assertEqual(len(message_broker._messages_map[self.subscribers[0]]), 2)
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_remove_subscriber_reclaims_backlog(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        message_broker = MessageBroker(max_total_messages=10)
+        for _ in range(3):
+            message_broker.publish_message(
+                topic=self.topic, subscribers=self.subscribers, message=self.message
+            )
+
+        self.assertEqual(message_broker.remove_subscriber(self.subscribers[0]), 3)
+        self.assertNotIn(self.subscribers[0], message_broker._messages_map)
+        self.assertEqual(message_broker._budget.messages, 3)
+        self.assertEqual(message_broker.remove_subscriber(self.subscribers[0]), 0)
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_open_batch_of_removed_subscriber_is_not_sent(self, post_mock):
+        post_mock.return_value.status_code = HTTP_OK
+        options = SubscriptionOptions(batch_max_size=2, batch_max_linger=60)
+        message_broker = MessageBroker(subscription_options=lambda _: options)
+        subscriber = self.subscribers[0]
+
+        message_broker.publish_message(self.topic, [subscriber], {"n": "old"})
+        message_broker.remove_subscriber(subscriber)
+        # fills the batch opened for the old message
+        message_broker.publish_message(self.topic, [subscriber], {"n": "new"})
+
+        deadline = time.monotonic() + 5
+        while not post_mock.call_count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        message_broker.shutdown()
+
+        self.assertEqual(post_mock.call_count, 1)
+        self.assertEqual(
+            [
+                message["n"]
+                for message in json.loads(post_mock.call_args.kwargs["data"])
+            ],
+            ["new"],
+        )
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_stale_retry_leaves_later_message_alone(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        message_broker = MessageBroker(retry_max_attempts=2, retry_base_delay=3600)
+        subscriber = self.subscribers[0]
+
+        message_broker.publish_message(self.topic, [subscriber], {"n": "old"})
+        old_seq = message_broker._messages_map[subscriber].head_seq()
+        old_id = message_broker._messages_map[subscriber].get(old_seq).id
+        message_broker.remove_subscriber(subscriber)
+        message_broker.publish_message(self.topic, [subscriber], {"n": "new"})
+        subscriber_queue = message_broker._messages_map[subscriber]
+        self.assertGreater(subscriber_queue.head_seq(), old_seq)
+        post_mock.reset_mock()
+
+        # the last retry of the old message comes due, as if sequence numbers had started over
+        message_broker._redeliver(subscriber, subscriber_queue.head_seq(), 2, old_id)
+        message_broker.shutdown()
+
+        post_mock.assert_not_called()
+        self.assertEqual(len(subscriber_queue), 1)
+        self.assertEqual(
+            message_broker.retrieve_dead_letters(subscriber, 10).entries, []
+        )
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_publish_batch(self, post_mock):
+        def post(url, data, **kwargs):
+            response = MagicMock()
+            response.status_code = (
+                HTTP_OK if url == self.subscribers[0] else HTTP_SERVICE_UNAVAILABLE
+            )
+            return response
+
+        post_mock.side_effect = post
+        message_broker = MessageBroker(
+            max_queue_messages=3, overflow_policy=OVERFLOW_REJECT
+        )
+        results = message_broker.publish_batch(
+            [
+                (self.topic, self.subscribers, {"n": 1}),
+                ("other-topic", self.subscribers[:1], {"n": 2}),
+                (self.topic, self.subscribers, {"n": 3}),
+                (self.topic, self.subscribers, {"n": 4}),
+            ]
+        )
+
+        self.assertEqual(results[0].failed_subscribers, self.subscribers[1:])
+        self.assertEqual(results[1].failed_subscribers, [])
+        self.assertEqual(results[2].failed_subscribers, self.subscribers[1:])
+        # the whole batch is queued before delivery, the first subscriber's backlog is full by now
+        # and only this entry is rejected
+        self.assertTrue(results[3].rejected)
+        self.assertEqual(post_mock.call_count, 5)
+        self.assertEqual(len(message_broker._messages_map[self.subscribers[0]]), 0)
+        self.assertEqual(
+            [
+                entry.message["n"]
+                for entry in message_broker.retrieve_messages(
+                    self.subscribers[1], 10
+                ).entries
+            ],
+            [1, 3],
+        )
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_open_circuit_skips_delivery(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        message_broker = MessageBroker(breaker_failure_threshold=2)
+
+        for _ in range(4):
+            failed_subscribers = message_broker.publish_message(
+                topic=self.topic, subscribers=self.subscribers, message=self.message
+            )
+            self.assertEqual(failed_subscribers, self.subscribers)
+
+        self.assertEqual(post_mock.call_count, 4)
+        for subscriber in self.subscribers:
+            self.assertEqual(len(message_broker._messages_map[subscriber]), 4)
+        self.assertEqual(
+            message_broker.get_breaker_states(self.subscribers[:1]),
+            {self.subscribers[0]: {"state": "open", "consecutive_failures": 2}},
+        )
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_failures_are_logged_sampled(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        with self.assertLogs("manager.message_broker", level="ERROR") as logs:
+            for _ in range(3):
+                self.message_broker.publish_message(
+                    self.topic, self.subscribers[:1], self.message
+                )
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn(self.subscribers[0], logs.output[0])
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_metrics(self, post_mock):
+        subscriber = "http://localhost:8000/metrics"
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        self.message_broker.publish_message(self.topic, [subscriber], self.message)
+        post_mock.return_value.status_code = HTTP_OK
+        self.message_broker.publish_message(self.topic, [subscriber], self.message)
+
+        deliveries = DELIVERIES.collect()
+        self.assertEqual(deliveries[(subscriber, DELIVERY_FAILED)], 1)
+        self.assertEqual(deliveries[(subscriber, DELIVERY_DELIVERED)], 1)
+        # a count per bucket, then the sum of the observations
+        self.assertEqual(sum(DELIVERY_SECONDS.collect()[(subscriber,)][:-1]), 2)
+        self.assertEqual(self.message_broker.queue_stats()[-1][:2], (subscriber, 1))
+
+        self.message_broker.retrieve_messages(subscriber, max_count=10)
+        self.assertEqual(POLLED_MESSAGES.collect()[(subscriber,)], 1)
+
+        # series of removed subscribers are dropped
+        self.message_broker.remove_subscriber(subscriber)
+        self.assertNotIn((subscriber, DELIVERY_FAILED), DELIVERIES.collect())
+        self.assertNotIn((subscriber,), POLLED_MESSAGES.collect())
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_delivery_rate_limit(self, post_mock):
+        post_mock.return_value.status_code = HTTP_OK
+        message_broker = MessageBroker(
+            delivery_rate_limiter=TokenBucketLimiter(rate=0.001, burst=2),
+            retry_max_attempts=3,
+        )
+
+        for _ in range(3):
+            message_broker.publish_message(
+                topic=self.topic, subscribers=self.subscribers[:1], message=self.message
+            )
+
+        # the third message is over the rate, it waits in the backlog for a later retry
+        self.assertEqual(post_mock.call_count, 2)
+        self.assertEqual(len(message_broker._messages_map[self.subscribers[0]]), 1)
+        self.assertEqual(len(message_broker._retry_scheduler), 1)
+        message_broker.shutdown()
+
+    def test_subscriber_locks_are_independent(self):
+        self.message_broker._get_queue(self.subscribers[0]).append(self.message)
+        self.message_broker._get_queue(self.subscribers[1]).append(self.message)
+
+        with self.message_broker._messages_map[self.subscribers[0]].lock:
+            retrieved = []
+            poller = Thread(
+                target=lambda: retrieved.append(
+                    self.message_broker.retrieve_message(self.subscribers[1])
+                )
+            )
+            poller.start()
+            poller.join(timeout=1)
+            self.assertFalse(poller.is_alive())
+        self.assertEqual(retrieved, [self.message])
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_submit_message_delivered_in_background(self, post_mock):
+        def post(url, **kwargs):
+            response = MagicMock()
+            response.status_code = (
+                HTTP_OK if url == self.subscribers[0] else HTTP_SERVICE_UNAVAILABLE
+            )
+            return response
+
+        post_mock.side_effect = post
+
+        message_id = self.message_broker.submit_message(
+            topic=self.topic, subscribers=self.subscribers, message=self.message
+        )
+        self.message_broker.shutdown()
+
+        self.assertEqual(
+            self.message_broker.get_delivery_status(message_id),
+            {
+                self.subscribers[0]: DELIVERY_DELIVERED,
+                self.subscribers[1]: DELIVERY_FAILED,
+            },
+        )
+        self.assertIsNone(self.message_broker.get_delivery_status("unknown-id"))
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_submit_message_status_follows_retries(self, post_mock):
+        # the first subscriber recovers on its first retry, the second never does
+        attempts = []
+
+        def post(url, **kwargs):
+            attempts.append(url)
+            response = MagicMock()
+            response.status_code = (
+                HTTP_OK
+                if url == self.subscribers[0] and attempts.count(url) > 1
+                else HTTP_SERVICE_UNAVAILABLE
+            )
+            return response
+
+        post_mock.side_effect = post
+        message_broker = MessageBroker(retry_max_attempts=2, retry_base_delay=0.01)
+        message_id = message_broker.submit_message(
+            topic=self.topic, subscribers=self.subscribers, message=self.message
+        )
+
+        expected = {
+            self.subscribers[0]: DELIVERY_DELIVERED,
+            self.subscribers[1]: DELIVERY_DEAD_LETTERED,
+        }
+        deadline = time.monotonic() + 5
+        while (
+            message_broker.get_delivery_status(message_id) != expected
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.01)
+        message_broker.shutdown()
+
+        self.assertEqual(message_broker.get_delivery_status(message_id), expected)
+
+    def test_submit_message_dispatch_queue_full(self):
+        message_broker = MessageBroker(dispatch_workers=0, dispatch_queue_size=1)
+        message_id = message_broker.submit_message(
+            topic=self.topic, subscribers=self.subscribers, message=self.message
+        )
+        self.assertEqual(
+            set(message_broker.get_delivery_status(message_id).values()),
+            {DELIVERY_PENDING},
+        )
+
+        with self.assertRaises(DispatchQueueFullError):
+            message_broker.submit_message(
+                topic=self.topic, subscribers=self.subscribers, message=self.message
+            )
@@ -0,0 +1,60 @@
+import unittest
+from unittest.mock import patch
+from manager.rate_limiter import (
+    PublishRateLimiter,
+    TokenBucketLimiter,
+)
+
+
+@patch("manager.rate_limiter.time")
+class TestTokenBucketLimiter(unittest.TestCase):
+    def test_burst_then_rate(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        limiter = TokenBucketLimiter(rate=2, burst=3)
+        self.assertEqual([limiter.acquire("a") for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.acquire("a"), 0.5)
+        # other keys have buckets of their own
+        self.assertEqual(limiter.acquire("b"), 0)
+
+        # refilled lazily on the next use, never beyond the burst
+        time_mock.monotonic.return_value = 100.5
+        self.assertEqual(limiter.acquire("a"), 0)
+        self.assertGreater(limiter.acquire("a"), 0)
+        time_mock.monotonic.return_value = 200
+        self.assertEqual([limiter.acquire("a") for _ in range(3)], [0, 0, 0])
+        self.assertGreater(limiter.acquire("a"), 0)
+
+    def test_large_requests_go_into_debt(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        limiter = TokenBucketLimiter(rate=10)
+        self.assertEqual(limiter.acquire("a", tokens=25), 0)
+        # 15 tokens in debt plus one for the next message
+        self.assertAlmostEqual(limiter.acquire("a"), 1.6)
+
+    def test_least_recently_used_buckets_are_dropped(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        limiter = TokenBucketLimiter(rate=1, max_keys=2)
+        limiter.acquire("a")
+        limiter.acquire("b")
+        limiter.acquire("a")
+        limiter.acquire("c")
+        self.assertEqual(len(limiter), 2)
+        self.assertGreater(limiter.acquire("a"), 0)
+        self.assertEqual(limiter.acquire("b"), 0)
+
+    def test_publish_limits(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        publish_rate_limiter = PublishRateLimiter(topic_rate=1, publisher_rate=2)
+        self.assertEqual(publish_rate_limiter.acquire_topic("t"), 0)
+        self.assertGreater(publish_rate_limiter.acquire_topic("t"), 0)
+        self.assertEqual(publish_rate_limiter.acquire_publisher("1.2.3.4", 2), 0)
+        self.assertGreater(publish_rate_limiter.acquire_publisher("1.2.3.4"), 0)
+
+        unlimited = PublishRateLimiter()
+        for _ in range(100):
+            self.assertEqual(unlimited.acquire_topic("t"), 0)
+            self.assertEqual(unlimited.acquire_publisher(None), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
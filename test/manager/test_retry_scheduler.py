@@ -0,0 +1,59 @@
+import time
+import unittest
+from threading import Event
+from manager.retry_scheduler import RetryScheduler
+
+
+class TestRetryScheduler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.calls = []
+        self.called = Event()
+
+        def handler(subscriber, seq, attempt, message_id):
+            self.calls.append((subscriber, seq, attempt))
+            self.called.set()
+
+        self.retry_scheduler = RetryScheduler(
+            handler=handler,
+            max_attempts=3,
+            base_delay=0.01,
+            max_delay=0.04,
+            max_attempts_override={"no-retries": 0}.get,
+        )
+
+    def tearDown(self) -> None:
+        self.retry_scheduler.shutdown()
+
+    def test_backoff_is_exponential_capped_and_jittered(self):
+        for attempt, delay in ((1, 0.01), (2, 0.02), (3, 0.04), (10, 0.04)):
+            backoff = self.retry_scheduler.backoff(attempt)
+            self.assertGreaterEqual(backoff, delay / 2)
+            self.assertLessEqual(backoff, delay)
+
+    def test_schedule_calls_handler_when_due(self):
+        self.assertTrue(self.retry_scheduler.schedule("subscriber", 7, attempt=1))
+        self.assertTrue(self.called.wait(timeout=5))
+        self.assertEqual(self.calls, [("subscriber", 7, 1)])
+        self.assertEqual(len(self.retry_scheduler), 0)
+
+    def test_schedule_with_delay(self):
+        retry_scheduler = RetryScheduler(handler=lambda *args: None, base_delay=0.01)
+        retry_scheduler.schedule("subscriber", 1, attempt=1, delay=3600)
+        self.assertGreater(retry_scheduler._heap[0][0], time.monotonic() + 3000)
+        retry_scheduler.shutdown()
+
+    def test_schedule_respects_max_attempts(self):
+        self.assertFalse(self.retry_scheduler.schedule("subscriber", 1, attempt=4))
+
+        self.assertFalse(self.retry_scheduler.schedule("no-retries", 1, attempt=1))
+        self.assertEqual(self.retry_scheduler.get_max_attempts("no-retries"), 0)
+        self.assertEqual(self.retry_scheduler.get_max_attempts("subscriber"), 3)
+
+    def test_schedule_many_pending_retries(self):
+        retry_scheduler = RetryScheduler(handler=lambda *args: None, base_delay=3600)
+        start = time.monotonic()
+        for seq in range(100000):
+            retry_scheduler.schedule("subscriber", seq, attempt=1)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(len(retry_scheduler), 100000)
+        retry_scheduler.shutdown()
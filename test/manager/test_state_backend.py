@@ -0,0 +1,235 @@
+import os
+import tempfile
+import unittest
+from threading import (
+    Thread,
+    Timer,
+)
+from unittest.mock import patch
+from manager.envelope import Envelope
+from manager.journal import Journal
+from manager.message_broker import MessageBroker
+from manager.sqlite_state_backend import SQLiteStateBackend
+from manager.state_backend import MemoryStateBackend
+from manager.subscriber_queue import (
+    BacklogFullError,
+    OVERFLOW_REJECT,
+)
+from manager.subscription_manager import SubscriptionManager
+from utils.http_codes import (
+    HTTP_OK,
+    HTTP_SERVICE_UNAVAILABLE,
+)
+
+
+class TestMemoryStateBackend(unittest.TestCase):
+    def test_queues_are_journaled(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            state_backend = MemoryStateBackend(journal=Journal(data_dir=data_dir))
+            subscriber_queue = state_backend.create_queue("http://localhost:8000/a")
+            subscriber_queue.append(Envelope.create("t", {"message": "hello"}), 10)
+            state_backend.close()
+
+            state_backend = MemoryStateBackend(journal=Journal(data_dir=data_dir))
+            records = list(state_backend.replay())
+            state_backend.close()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(Envelope.from_record(records[0]["msg"])["message"], "hello")
+
+    def test_without_journal(self):
+        state_backend = MemoryStateBackend()
+        self.assertIsNone(state_backend.journal)
+        self.assertEqual(list(state_backend.replay()), [])
+        state_backend.start(snapshot_records=list, apply=print)
+        state_backend.close()
+
+
+class TestSQLiteStateBackend(unittest.TestCase):
+    """
+    Two backends opened on the same database stand in for two worker processes.
+    """
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "state.db")
+        self.workers = [self.create_worker(), self.create_worker()]
+        self.topic = "test-topic"
+        self.subscriber = "http://localhost:8000/testing"
+        self.message = {"message": "this is a test message"}
+        self.envelope = Envelope.create(self.topic, self.message)
+
+    def tearDown(self) -> None:
+        for state_backend, subscription_manager, message_broker in self.workers:
+            message_broker.shutdown()
+            subscription_manager.shutdown()
+            state_backend.close()
+        self.temp_dir.cleanup()
+
+    def create_worker(self):
+        state_backend = SQLiteStateBackend(path=self.path, poll_interval=60)
+        message_broker = MessageBroker(state_backend=state_backend)
+        subscription_manager = SubscriptionManager(
+            journal=state_backend.journal,
+            on_endpoint_removed=message_broker.remove_subscriber,
+        )
+        for record in state_backend.replay():
+            subscription_manager.restore(record)
+        state_backend.start(snapshot_records=list, apply=subscription_manager.restore)
+        return state_backend, subscription_manager, message_broker
+
+    def test_subscriptions_are_shared(self):
+        (backend_a, manager_a, _), (backend_b, manager_b, _) = self.workers
+        manager_a.subscribe("orders.*", self.subscriber)
+        self.assertEqual(manager_b.get_subscribers("orders.created"), ())
+
+        self.assertEqual(backend_b.catch_up(), 1)
+        self.assertEqual(
+            manager_b.get_subscribers("orders.created"), (self.subscriber,)
+        )
+
+        manager_b.unsubscribe("orders.*", self.subscriber)
+        backend_a.catch_up()
+        self.assertEqual(manager_a.get_subscribers("orders.created"), ())
+
+    def test_new_worker_recovers_subscriptions(self):
+        _, manager_a, _ = self.workers[0]
+        manager_a.subscribe(self.topic, self.subscriber, ttl=60)
+        manager_a.subscribe(self.topic, self.subscriber)
+        self.workers[0][0].compact()
+
+        worker = self.create_worker()
+        self.workers.append(worker)
+        self.assertEqual(worker[1].get_subscribers(self.topic), (self.subscriber,))
+        self.assertEqual(worker[1]._leases, {})
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_backlog_is_shared(self, post_mock):
+        post_mock.return_value.status_code = HTTP_SERVICE_UNAVAILABLE
+        (_, _, broker_a), (_, _, broker_b) = self.workers
+        broker_a.publish_message(self.topic, [self.subscriber], dict(self.message))
+        broker_a.publish_message(self.topic, [self.subscriber], dict(self.message))
+
+        batch = broker_b.retrieve_messages(self.subscriber, max_count=1)
+        self.assertEqual(len(batch.entries), 1)
+        self.assertEqual(batch.entries[0].message["message"], self.message["message"])
+        self.assertIsNotNone(batch.next_cursor)
+
+        batch = broker_a.retrieve_messages(self.subscriber, max_count=10)
+        self.assertEqual(len(batch.entries), 1)
+        self.assertIsNone(batch.next_cursor)
+
+    @patch("manager.delivery_engine.requests.Session.post")
+    def test_delivered_message_is_acked(self, post_mock):
+        post_mock.return_value.status_code = HTTP_OK
+        (_, _, broker_a), (_, _, broker_b) = self.workers
+        broker_a.publish_message(self.topic, [self.subscriber], dict(self.message))
+        self.assertEqual(broker_b.retrieve_messages(self.subscriber, 10).entries, [])
+
+    def test_concurrent_polls_never_share_messages(self):
+        (_, _, broker_a), (_, _, broker_b) = self.workers
+        subscriber_queue = broker_a._get_queue(self.subscriber)
+        for i in range(200):
+            subscriber_queue.append(Envelope.create(self.topic, {"message": i}), 10)
+
+        polled = {0: [], 1: []}
+
+        def poll(worker: int, message_broker: MessageBroker) -> None:
+            while True:
+                batch = message_broker.retrieve_messages(self.subscriber, max_count=7)
+                if not batch.entries:
+                    return
+                polled[worker].extend(
+                    entry.message["message"] for entry in batch.entries
+                )
+
+        threads = [
+            Thread(target=poll, args=(0, broker_a)),
+            Thread(target=poll, args=(1, broker_b)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(polled[0] + polled[1]), list(range(200)))
+
+    def test_peek_across_workers(self):
+        (backend_a, _, _), (backend_b, _, _) = self.workers
+        queue_a = backend_a.create_queue(self.subscriber)
+        queue_b = backend_b.create_queue(self.subscriber)
+        seqs = [
+            queue_a.append(Envelope.create(self.topic, {"message": i}), 10)
+            for i in range(3)
+        ]
+
+        entries = queue_b.peek_many(2)
+        self.assertEqual([entry.seq for entry in entries], seqs[:2])
+        self.assertEqual(entries[1].message["message"], 1)
+        self.assertTrue(queue_b.ack(seqs[0]))
+        self.assertEqual([entry.seq for entry in queue_a.peek_many(10)], seqs[1:])
+        self.assertEqual(len(queue_a), 2)
+
+    def test_atomic_changes_seen_at_once(self):
+        (backend_a, _, _), (backend_b, _, _) = self.workers
+        queue_a = backend_a.create_queue(self.subscriber)
+        queue_b = backend_b.create_queue(self.subscriber)
+        woken = []
+        queue_a.add_listener(lambda: woken.append(True))
+
+        with backend_a.atomic():
+            queue_a.append(Envelope.create(self.topic, {"message": 1}), 10)
+            seq = queue_a.append(Envelope.create(self.topic, {"message": 2}), 10)
+            queue_a.ack(seq)
+            self.assertEqual(queue_b.peek_many(10), [])
+            self.assertEqual(woken, [])
+
+        self.assertEqual(
+            [entry.message["message"] for entry in queue_b.peek_many(10)], [1]
+        )
+        self.assertEqual(len(woken), 2)
+
+    def test_caps_hold_across_workers(self):
+        (backend_a, _, _), (backend_b, _, _) = self.workers
+        queue_a = backend_a.create_queue(self.subscriber, max_messages=2)
+        queue_b = backend_b.create_queue(self.subscriber, max_messages=2)
+        first = queue_a.append(Envelope.create(self.topic, {"message": 1}), 10)
+        queue_b.append(Envelope.create(self.topic, {"message": 2}), 10)
+        queue_a.append(Envelope.create(self.topic, {"message": 3}), 10)
+
+        self.assertEqual(len(queue_b), 2)
+        self.assertEqual(queue_b.bytes, 20)
+        self.assertIsNone(queue_b.get(first))
+        self.assertEqual(queue_a.dropped, 1)
+
+        rejecting = backend_a.create_queue(
+            self.subscriber, max_messages=2, overflow_policy=OVERFLOW_REJECT
+        )
+        with self.assertRaises(BacklogFullError):
+            rejecting.append(Envelope.create(self.topic, {"message": 4}), 10)
+        self.assertEqual(len(queue_a), 2)
+
+    def test_remove_subscriber_drops_shared_backlog(self):
+        (_, _, broker_a), (_, _, broker_b) = self.workers
+        broker_a._get_queue(self.subscriber).append(self.envelope, 10)
+        broker_a._get_dead_letters(self.subscriber).append(self.envelope, 10)
+
+        self.assertEqual(broker_b.remove_subscriber(self.subscriber), 1)
+        self.assertEqual(broker_a.retrieve_messages(self.subscriber, 10).entries, [])
+        self.assertEqual(
+            broker_a.retrieve_dead_letters(self.subscriber, 10).entries, []
+        )
+
+    def test_long_poll_woken_by_other_worker(self):
+        (_, _, broker_a), (backend_b, _, broker_b) = self.workers
+        broker_b._get_queue(self.subscriber)
+
+        def publish_elsewhere() -> None:
+            broker_a._get_queue(self.subscriber).append(self.envelope, 10)
+            backend_b.catch_up()
+
+        Timer(0.1, publish_elsewhere).start()
+        batch = broker_b.retrieve_messages(self.subscriber, max_count=10, timeout=5)
+        self.assertEqual(len(batch.entries), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
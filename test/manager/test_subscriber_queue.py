@@ -0,0 +1,157 @@
+import unittest
+from threading import Timer
+from manager.subscriber_queue import (
+    BacklogBudget,
+    BacklogFullError,
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_REJECT,
+    SubscriberQueue,
+)
+
+
+class TestSubscriberQueue(unittest.TestCase):
+    def setUp(self) -> None:
+        self.subscriber_queue = SubscriberQueue()
+
+    def test_append_assigns_increasing_sequence_numbers(self):
+        seqs = [self.subscriber_queue.append({"message": i}) for i in range(3)]
+        self.assertEqual(seqs, [1, 2, 3])
+        self.assertEqual(len(self.subscriber_queue), 3)
+
+    def test_ack_removes_exact_entry(self):
+        first = self.subscriber_queue.append({"message": "first"})
+        second = self.subscriber_queue.append({"message": "second"})
+
+        self.assertTrue(self.subscriber_queue.ack(second))
+        self.assertFalse(self.subscriber_queue.ack(second))
+
+        entry = self.subscriber_queue.popleft()
+        self.assertEqual(entry.seq, first)
+        self.assertEqual(entry.message, {"message": "first"})
+        self.assertIsNone(self.subscriber_queue.popleft())
+
+    def test_ack_after_poll(self):
+        seq = self.subscriber_queue.append({"message": "polled"})
+        self.subscriber_queue.popleft()
+        self.assertFalse(self.subscriber_queue.ack(seq))
+        self.assertEqual(len(self.subscriber_queue), 0)
+
+    def test_popleft_many(self):
+        for i in range(5):
+            self.subscriber_queue.append({"message": i})
+
+        entries = self.subscriber_queue.popleft_many(3)
+        self.assertEqual([entry.seq for entry in entries], [1, 2, 3])
+        self.assertEqual(self.subscriber_queue.head_seq(), 4)
+
+        entries = self.subscriber_queue.popleft_many(10)
+        self.assertEqual([entry.message["message"] for entry in entries], [3, 4])
+        self.assertIsNone(self.subscriber_queue.head_seq())
+        self.assertEqual(self.subscriber_queue.popleft_many(10), [])
+
+    def test_peek_many(self):
+        seqs = [self.subscriber_queue.append({"message": i}) for i in range(4)]
+        self.subscriber_queue.ack(seqs[1])
+
+        entries = self.subscriber_queue.peek_many(2)
+        self.assertEqual([entry.seq for entry in entries], [seqs[0], seqs[2]])
+        self.assertEqual(len(self.subscriber_queue), 3)
+
+        self.subscriber_queue.ack(seqs[0])
+        entries = self.subscriber_queue.peek_many(10)
+        self.assertEqual([entry.message["message"] for entry in entries], [2, 3])
+        self.subscriber_queue.popleft_many(10)
+        self.assertEqual(self.subscriber_queue.peek_many(10), [])
+
+    def test_peek_many_across_a_gap(self):
+        self.subscriber_queue.restore(1, {"message": "old"}, 0)
+        self.subscriber_queue.restore(10**9, {"message": "new"}, 0)
+        entries = self.subscriber_queue.peek_many(10)
+        self.assertEqual([entry.seq for entry in entries], [1, 10**9])
+
+    def test_oldest_entry_skips_acked_entries(self):
+        seqs = [self.subscriber_queue.append({"message": i}) for i in range(5)]
+        self.subscriber_queue.ack(seqs[0])
+        self.subscriber_queue.ack(seqs[1])
+        self.subscriber_queue.ack(seqs[3])
+        self.assertEqual(self.subscriber_queue.head_seq(), seqs[2])
+
+        entries = self.subscriber_queue.popleft_many(10)
+        self.assertEqual([entry.seq for entry in entries], [seqs[2], seqs[4]])
+        self.assertEqual(self.subscriber_queue.append({"message": 5}), 6)
+        self.assertEqual(self.subscriber_queue.head_seq(), 6)
+
+    def test_wait(self):
+        self.assertFalse(self.subscriber_queue.wait(timeout=0.01))
+
+        timer = Timer(0.05, self.subscriber_queue.append, args=({"message": "hi"},))
+        timer.start()
+        self.assertTrue(self.subscriber_queue.wait(timeout=5))
+        timer.join()
+
+    def test_listeners(self):
+        calls = []
+        self.subscriber_queue.add_listener(lambda: calls.append(1))
+        self.subscriber_queue.append({"message": "first"})
+        self.assertEqual(calls, [1])
+
+        self.subscriber_queue.remove_listener(self.subscriber_queue._listeners[0])
+        self.subscriber_queue.append({"message": "second"})
+        self.assertEqual(calls, [1])
+
+    def test_byte_accounting(self):
+        budget = BacklogBudget()
+        subscriber_queue = SubscriberQueue(budget=budget)
+        first = subscriber_queue.append({"message": "first"}, size=10)
+        subscriber_queue.append({"message": "second"}, size=20)
+        subscriber_queue.append({"message": "third"}, size=30)
+        self.assertEqual((subscriber_queue.bytes, budget.bytes), (60, 60))
+
+        subscriber_queue.ack(first)
+        subscriber_queue.popleft()
+        self.assertEqual((subscriber_queue.bytes, budget.bytes), (30, 30))
+        subscriber_queue.popleft_many(5)
+        self.assertEqual((subscriber_queue.bytes, budget.bytes), (0, 0))
+        self.assertEqual(budget.messages, 0)
+
+    def test_overflow_drop_oldest(self):
+        subscriber_queue = SubscriberQueue(
+            max_messages=2, overflow_policy=OVERFLOW_DROP_OLDEST
+        )
+        for i in range(3):
+            self.assertIsNotNone(subscriber_queue.append({"message": i}, size=1))
+
+        self.assertEqual(subscriber_queue.dropped, 1)
+        entries = subscriber_queue.popleft_many(5)
+        self.assertEqual([entry.message["message"] for entry in entries], [1, 2])
+
+    def test_overflow_drop_newest(self):
+        subscriber_queue = SubscriberQueue(
+            max_bytes=25, overflow_policy=OVERFLOW_DROP_NEWEST
+        )
+        subscriber_queue.append({"message": "first"}, size=10)
+        subscriber_queue.append({"message": "second"}, size=10)
+        self.assertIsNone(subscriber_queue.append({"message": "third"}, size=10))
+
+        self.assertEqual(subscriber_queue.dropped, 1)
+        self.assertEqual(subscriber_queue.bytes, 20)
+        self.assertEqual(subscriber_queue.popleft().message["message"], "first")
+
+    def test_overflow_reject_global_budget(self):
+        budget = BacklogBudget(max_messages=2)
+        queues = [
+            SubscriberQueue(overflow_policy=OVERFLOW_REJECT, budget=budget)
+            for _ in range(2)
+        ]
+        queues[0].append({"message": "first"})
+        queues[1].append({"message": "second"})
+
+        with self.assertRaises(BacklogFullError):
+            queues[0].append({"message": "third"})
+        self.assertEqual(budget.messages, 2)
+        self.assertEqual(len(queues[0]), 1)
+
+    def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            SubscriberQueue(overflow_policy="drop-everything")
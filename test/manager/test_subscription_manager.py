@@ -1,5 +1,11 @@
+import time
 import unittest
-from manager.subscription_manager import SubscriptionManager
+from threading import Thread
+from unittest.mock import MagicMock
+from manager.subscription_manager import (
+    SubscriptionManager,
+    SubscriptionOptions,
+)
 
 
 class TestSubscriptionManager(unittest.TestCase):
@@ -58,3 +64,188 @@ class TestSubscriptionManager(unittest.TestCase):
     def test_get_subscribers_empty(self):
         result = self.subscription_manager.get_subscribers("test-topic")
         self.assertEqual(len(result), 0)
+
+    def test_subscription_options(self):
+        endpoint = "http://localhost:8000/batched"
+        self.assertIsNone(self.subscription_manager.get_options(endpoint))
+
+        options = SubscriptionOptions(batch_max_size=10, batch_max_linger=0.5)
+        self.subscription_manager.subscribe("test-topic", endpoint, options)
+        self.assertTrue(self.subscription_manager.get_options(endpoint).batched)
+
+        records = list(self.subscription_manager.snapshot_records())
+        self.assertEqual(records[0]["opts"]["batch_max_size"], 10)
+
+        recovered = SubscriptionManager()
+        for record in records:
+            recovered.restore(record)
+        self.assertEqual(recovered.get_options(endpoint), options)
+        self.assertEqual(recovered.get_subscribers("test-topic"), (endpoint,))
+
+    def test_wildcard_subscriptions(self):
+        self.subscription_manager.subscribe("orders.*", "http://localhost:8000/any")
+        self.subscription_manager.subscribe("orders.#", "http://localhost:8000/all")
+
+        self.assertEqual(
+            set(self.subscription_manager.get_subscribers("orders.created")),
+            {"http://localhost:8000/any", "http://localhost:8000/all"},
+        )
+        self.assertEqual(
+            self.subscription_manager.get_subscribers("orders.eu.created"),
+            ("http://localhost:8000/all",),
+        )
+
+    def test_subscribe_invalid_pattern(self):
+        self.assertFalse(
+            self.subscription_manager.subscribe("orders.#.eu", "http://localhost:8000")
+        )
+        self.assertFalse(
+            self.subscription_manager.subscribe("orders..eu", "http://localhost:8000")
+        )
+
+    def test_unsubscribe(self):
+        removed = []
+        subscription_manager = SubscriptionManager(on_endpoint_removed=removed.append)
+        subscription_manager.subscribe("topic1", "http://localhost:8000/test")
+        subscription_manager.subscribe("topic2.#", "http://localhost:8000/test")
+
+        self.assertTrue(
+            subscription_manager.unsubscribe("topic1", "http://localhost:8000/test")
+        )
+        self.assertEqual(subscription_manager.get_subscribers("topic1"), ())
+        self.assertNotIn("topic1", subscription_manager._subscription_map)
+        self.assertEqual(removed, [])
+
+        self.assertTrue(
+            subscription_manager.unsubscribe("topic2.#", "http://localhost:8000/test")
+        )
+        self.assertEqual(subscription_manager.get_subscribers("topic2.a"), ())
+        self.assertEqual(removed, ["http://localhost:8000/test"])
+
+        self.assertFalse(
+            subscription_manager.unsubscribe("topic1", "http://localhost:8000/test")
+        )
+
+    def test_subscription_expires(self):
+        removed = []
+        subscription_manager = SubscriptionManager(on_endpoint_removed=removed.append)
+        subscription_manager.subscribe("leased", "http://localhost:8000/a", ttl=0.01)
+        subscription_manager.subscribe("leased", "http://localhost:8000/b", ttl=0.01)
+        # renewing the lease without a ttl makes the subscription permanent
+        subscription_manager.subscribe("leased", "http://localhost:8000/b")
+
+        deadline = time.monotonic() + 5
+        while not removed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        subscription_manager.shutdown()
+
+        self.assertEqual(removed, ["http://localhost:8000/a"])
+        self.assertEqual(
+            subscription_manager.get_subscribers("leased"), ("http://localhost:8000/b",)
+        )
+
+    def test_far_lease_keeps_expiry_running(self):
+        removed = []
+        subscription_manager = SubscriptionManager(on_endpoint_removed=removed.append)
+        subscription_manager.subscribe("leased", "http://localhost:8000/a", ttl=1e308)
+        time.sleep(0.05)
+        subscription_manager.subscribe("leased", "http://localhost:8000/b", ttl=0.01)
+
+        deadline = time.monotonic() + 5
+        while not removed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        subscription_manager.shutdown()
+
+        self.assertEqual(removed, ["http://localhost:8000/b"])
+
+    def test_restore_unsubscribe_and_lease(self):
+        records = [
+            {"op": "sub", "topic": "topic1", "url": "http://localhost:8000/a"},
+            {"op": "sub", "topic": "topic1", "url": "http://localhost:8000/b"},
+            {"op": "unsub", "topic": "topic1", "url": "http://localhost:8000/a"},
+            {
+                "op": "sub",
+                "topic": "topic2",
+                "url": "http://localhost:8000/c",
+                "expires_at": time.time() + 60,
+            },
+        ]
+        for record in records:
+            self.subscription_manager.restore(record)
+
+        self.assertEqual(
+            self.subscription_manager.get_subscribers("topic1"),
+            ("http://localhost:8000/b",),
+        )
+        snapshot = list(self.subscription_manager.snapshot_records())
+        self.assertEqual(len(snapshot), 2)
+        self.assertIn("expires_at", snapshot[1])
+
+    def test_get_subscribers_returns_shared_snapshot(self):
+        self.subscription_manager.subscribe("topic1", "http://localhost:8000/a")
+        self.subscription_manager.subscribe("topic2", "http://localhost:8000/a")
+        snapshot = self.subscription_manager.get_subscribers("topic1")
+        other = self.subscription_manager.get_subscribers("topic2")
+        self.assertIs(self.subscription_manager.get_subscribers("topic1"), snapshot)
+
+        self.subscription_manager.subscribe("topic1", "http://localhost:8000/b")
+        self.assertEqual(snapshot, ("http://localhost:8000/a",))
+        self.assertEqual(len(self.subscription_manager.get_subscribers("topic1")), 2)
+        # changes to an exact topic leave the snapshots of other topics in place
+        self.assertIs(self.subscription_manager.get_subscribers("topic2"), other)
+
+    def test_endpoints_are_interned(self):
+        for topic in ("topic1", "topic2"):
+            self.subscription_manager.subscribe(
+                topic, " ".join(["http://localhost:8000/a", ""])
+            )
+        first = self.subscription_manager.get_subscribers("topic1")[0]
+        self.assertIs(self.subscription_manager.get_subscribers("topic2")[0], first)
+
+    def test_subscribe_batch(self):
+        journal = MagicMock()
+        journal.append.side_effect = range(1, 10)
+        subscription_manager = SubscriptionManager(journal=journal)
+        results = subscription_manager.subscribe_batch(
+            [
+                ("topic1", "http://localhost:8000/a", None, None),
+                ("orders.#", "http://localhost:8000/b", SubscriptionOptions(3), 60),
+                ("orders.#.created", "http://localhost:8000/c", None, None),
+                ("topic1", "http://localhost:8000/a", None, None),
+            ]
+        )
+        self.assertEqual(results, [True, True, False, True])
+        self.assertEqual(
+            subscription_manager.get_subscribers("orders.eu"),
+            ("http://localhost:8000/b",),
+        )
+        self.assertEqual(
+            subscription_manager.get_options("http://localhost:8000/b").max_attempts, 3
+        )
+        # the repeated subscription changes nothing and is not journaled, the rest is synced once
+        self.assertEqual(journal.append.call_count, 2)
+        journal.sync.assert_called_once_with(2)
+        subscription_manager.shutdown()
+
+    def test_journal_sync_without_lock(self):
+        journal = MagicMock()
+        journal.append.side_effect = range(1, 10)
+        subscription_manager = SubscriptionManager(journal=journal)
+        locked = []
+
+        def sync(lsn):
+            # another thread can change subscriptions while this one waits for the disk
+            changer = Thread(
+                target=subscription_manager.subscribe,
+                args=("other", "http://localhost:8000/other"),
+            )
+            changer.start()
+            changer.join(timeout=1)
+            locked.append(changer.is_alive())
+
+        journal.sync.side_effect = sync
+        subscription_manager.subscribe("topic1", "http://localhost:8000/a")
+        subscription_manager.unsubscribe("topic1", "http://localhost:8000/a")
+        self.assertGreaterEqual(len(locked), 2)
+        self.assertFalse(any(locked))
+        subscription_manager.shutdown()
@@ -0,0 +1,45 @@
+import unittest
+from manager.topic_index import TopicIndex
+
+
+class TestTopicIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.topic_index = TopicIndex()
+        self.topic_index.add("orders.created", "exact")
+        self.topic_index.add("orders.*", "one-level")
+        self.topic_index.add("orders.#", "all-orders")
+        self.topic_index.add("#", "everything")
+        self.topic_index.add("*.*.shipped", "shipped")
+
+    def test_match_wildcards(self):
+        self.assertEqual(
+            set(self.topic_index.match("orders.created")),
+            {"exact", "one-level", "all-orders", "everything"},
+        )
+        self.assertEqual(
+            set(self.topic_index.match("orders.eu.shipped")),
+            {"all-orders", "everything", "shipped"},
+        )
+        # a trailing # also matches the parent level itself
+        self.assertEqual(
+            set(self.topic_index.match("orders")), {"all-orders", "everything"}
+        )
+        self.assertEqual(set(self.topic_index.match("payments")), {"everything"})
+
+    def test_add_duplicate(self):
+        self.assertFalse(self.topic_index.add("orders.*", "one-level"))
+
+    def test_cache_is_invalidated_on_change(self):
+        self.assertNotIn("late", self.topic_index.match("orders.created"))
+        self.topic_index.add("orders.created", "late")
+        self.assertIn("late", self.topic_index.match("orders.created"))
+
+        self.assertTrue(self.topic_index.remove("orders.created", "late"))
+        self.assertNotIn("late", self.topic_index.match("orders.created"))
+        self.assertFalse(self.topic_index.remove("orders.created", "late"))
+
+    def test_remove_prunes_empty_branches(self):
+        self.topic_index.add("a.b.c", "deep")
+        self.topic_index.remove("a.b.c", "deep")
+        self.assertNotIn("a", self.topic_index._root.children)
+        self.assertIn("orders", self.topic_index._root.children)
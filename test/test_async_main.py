@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+from aiohttp import web
+from aiohttp.test_utils import (
+    AioHTTPTestCase,
+    TestServer,
+)
+from async_main import create_app
+from manager.async_delivery_engine import AsyncDeliveryEngine
+from utils import http_codes
+from utils.config import Config
+
+
+class TestAsyncApp(AioHTTPTestCase):
+    async def get_application(self) -> web.Application:
+        return create_app()
+
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.received = []
+
+        async def hook(request: web.Request) -> web.Response:
+            self.received.append(await request.json())
+            return web.json_response({}, status=http_codes.HTTP_OK)
+
+        async def down(request: web.Request) -> web.Response:
+            return web.json_response({}, status=http_codes.HTTP_SERVICE_UNAVAILABLE)
+
+        subscriber_app = web.Application()
+        subscriber_app.router.add_post("/hook", hook)
+        subscriber_app.router.add_post("/down", down)
+        self.subscriber_server = TestServer(subscriber_app)
+        await self.subscriber_server.start_server()
+        self.hook = str(self.subscriber_server.make_url("/hook"))
+        self.down = str(self.subscriber_server.make_url("/down"))
+
+    async def asyncTearDown(self) -> None:
+        await self.subscriber_server.close()
+        await super().asyncTearDown()
+
+    async def subscribe(self, topic: str, url: str) -> None:
+        response = await self.client.post(f"/subscribe/{topic}", json={"url": url})
+        self.assertEqual(response.status, http_codes.HTTP_CREATED)
+
+    async def test_root_endpoint(self):
+        response = await self.client.get("/")
+        self.assertEqual(response.status, http_codes.HTTP_OK)
+        self.assertEqual(
+            await response.text(), "Hello, World! Usage information in Readme.md"
+        )
+
+    async def test_subscribe_requires_json(self):
+        response = await self.client.post(
+            "/subscribe/test-topic", data={"url": "http://localhost:8000/testing"}
+        )
+        self.assertEqual(response.status, http_codes.HTTP_UNSUPPORTED_MEDIA_TYPE)
+
+    async def test_subscribe_batch(self):
+        response = await self.client.post(
+            "/subscribe",
+            json=[
+                {"topic": "orders.#", "url": self.hook},
+                {"topic": "orders", "url": "not a url"},
+            ],
+        )
+        self.assertEqual(response.status, http_codes.HTTP_OK)
+        results = (await response.json())["results"]
+        self.assertEqual(
+            [result["status"] for result in results], ["subscribed", "invalid"]
+        )
+
+        response = await self.client.get("/subscribers/orders.created")
+        self.assertEqual(await response.json(), [self.hook])
+
+    async def test_oversized_payload_is_rejected(self):
+        await self.subscribe("test-topic", self.hook)
+        response = await self.client.post(
+            "/publish/test-topic",
+            json={"message": "x" * Config.MAX_REQUEST_BYTES},
+        )
+        self.assertEqual(response.status, http_codes.HTTP_PAYLOAD_TOO_LARGE)
+        self.assertEqual(self.received, [])
+
+    async def test_publish_delivers_webhook(self):
+        await self.subscribe("orders.%23", self.hook)
+
+        response = await self.client.post(
+            "/publish/orders.created", json={"message": "hello"}
+        )
+        self.assertEqual(response.status, http_codes.HTTP_OK)
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(self.received[0]["message"], "hello")
+        self.assertEqual(self.received[0]["topic"], "orders.created")
+
+        response = await self.client.get(f"/poll/{self.hook}")
+        self.assertEqual((await response.json())["count"], 0)
+
+    async def test_failed_delivery_is_polled(self):
+        await self.subscribe("orders", self.down)
+
+        response = await self.client.post("/publish/orders", json={"message": "hello"})
+        self.assertEqual(response.status, http_codes.HTTP_INTERNAL_ERR)
+
+        response = await self.client.get(f"/poll/{self.down}")
+        body = await response.json()
+        self.assertEqual(body["count"], 1)
+        self.assertEqual(body["messages"][0]["message"]["message"], "hello")
+
+    async def test_long_poll_wakes_up_on_publish(self):
+        await self.subscribe("orders", self.down)
+
+        start = time.monotonic()
+        poll = asyncio.ensure_future(self.client.get(f"/poll/{self.down}?wait=5"))
+        await asyncio.sleep(0.1)
+        await self.client.post("/publish/orders", json={"message": "wake up"})
+
+        body = await (await poll).json()
+        self.assertEqual(body["count"], 1)
+        self.assertLess(time.monotonic() - start, 4)
+
+    async def test_publish_batch(self):
+        await self.subscribe("orders", self.hook)
+
+        response = await self.client.post(
+            "/publish",
+            json=[
+                {"topic": "orders", "message": {"n": 1}},
+                {"topic": "orders", "message": {"n": 2}},
+                {"topic": "unknown", "message": {"n": 3}},
+            ],
+        )
+        self.assertEqual(response.status, http_codes.HTTP_OK)
+        self.assertEqual(
+            (await response.json())["results"],
+            [
+                {"status": "delivered"},
+                {"status": "delivered"},
+                {"status": "no_subscribers"},
+            ],
+        )
+        self.assertEqual(sorted(message["n"] for message in self.received), [1, 2])
+
+    async def test_submit_callbacks_run_off_the_event_loop(self):
+        delivery_engine = AsyncDeliveryEngine()
+        await delivery_engine.start()
+        callback_threads = []
+
+        def submit() -> None:
+            future = delivery_engine.submit(self.hook, b'{"message": "hello"}')
+            future.add_done_callback(
+                lambda _: callback_threads.append(threading.get_ident())
+            )
+            self.assertTrue(future.result(timeout=5).delivered)
+
+        try:
+            await asyncio.to_thread(submit)
+        finally:
+            await delivery_engine.close()
+            await asyncio.to_thread(delivery_engine.shutdown)
+        self.assertEqual(len(callback_threads), 1)
+        self.assertNotEqual(callback_threads[0], threading.get_ident())
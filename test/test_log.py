@@ -0,0 +1,43 @@
+import logging
+import queue
+import unittest
+from utils.log import (
+    LogSampler,
+    NonBlockingQueueHandler,
+)
+
+
+class TestLog(unittest.TestCase):
+    def test_sampler(self):
+        sampler = LogSampler(every=3, max_keys=2)
+        self.assertEqual(
+            [sampler.sample("a") for _ in range(7)],
+            [True, False, False, True, False, False, True],
+        )
+        self.assertTrue(sampler.sample("b"))
+        self.assertFalse(sampler.sample("b"))
+        # a third key starts every count over
+        self.assertTrue(sampler.sample("c"))
+        self.assertTrue(sampler.sample("a"))
+
+    def test_queue_handler_never_blocks(self):
+        log_queue: queue.Queue = queue.Queue(maxsize=1)
+        handler = NonBlockingQueueHandler(log_queue)
+        logger = logging.getLogger("test_log")
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            logger.warning("first %s", "record")
+            logger.warning("second %s", "record")
+        finally:
+            logger.removeHandler(handler)
+
+        self.assertEqual(handler.dropped, 1)
+        record = log_queue.get_nowait()
+        # formatted by the listener, not by the logging thread
+        self.assertEqual(record.args, ("record",))
+        self.assertEqual(record.getMessage(), "first record")
+
+
+if __name__ == "__main__":
+    unittest.main()
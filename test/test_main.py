@@ -1,6 +1,16 @@
 import unittest
 from unittest.mock import patch
 from main import app
+import main
+from app_common import register_state_metrics
+from manager.envelope import Envelope
+from manager.message_broker import (
+    DispatchQueueFullError,
+    PublishResult,
+)
+from manager.rate_limiter import PublishRateLimiter
+from manager.journal import JournalError
+from manager.subscription_manager import SubscriptionOptions
 from utils import http_codes
 
 
@@ -72,12 +82,19 @@ class TestFlaskApp(unittest.TestCase):
         self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
         self.assertEqual(response.get_json()["message"], "Invalid URL provided.")
 
+        for method in (self.client.post, self.client.delete):
+            for body in (["url"], {"url": ["http://localhost:8000/testing"]}):
+                response = method(
+                    "/subscribe/test-topic", json=body, headers=self.headers
+                )
+                self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
     @patch("main.message_broker")
     @patch("main.subscription_manager")
     def test_publish_message(self, subscription_manager_mock, message_broker_mock):
         subscribers = ["http//localhost:8000/sample"]
         subscription_manager_mock.get_subscribers.return_value = subscribers
-        message_broker_mock.publish_message.return_value = None
+        message_broker_mock.publish_batch.return_value = [PublishResult([])]
 
         response = self.client.post(
             "/publish/test-topic",
@@ -89,7 +106,18 @@ class TestFlaskApp(unittest.TestCase):
             response.get_json(), {"message": "Message has been sent to all subscribers"}
         )
 
-        message_broker_mock.publish_message.return_value = subscribers
+        message_broker_mock.publish_batch.return_value = [
+            PublishResult([], queued_subscribers=subscribers)
+        ]
+        response = self.client.post(
+            "/publish/test-topic",
+            json={"message": "this is a test message"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_ACCEPTED)
+        self.assertEqual(response.get_json()["queued_subscribers"], subscribers)
+
+        message_broker_mock.publish_batch.return_value = [PublishResult(subscribers)]
         response = self.client.post(
             "/publish/test-topic",
             json={"message": "this is a test message"},
@@ -201,3 +229,569 @@ class TestFlaskApp(unittest.TestCase):
                 "message": "Following messages were waiting: {0: 'this is part of a complete system integration test'}"
             },
         )
+
+    @patch("main.message_broker")
+    @patch("main.subscription_manager")
+    def test_publish_message_async(
+        self, subscription_manager_mock, message_broker_mock
+    ):
+        subscribers = ["http://localhost:8000/sample"]
+        subscription_manager_mock.get_subscribers.return_value = subscribers
+        message_broker_mock.submit_message.return_value = "some-message-id"
+
+        response = self.client.post(
+            "/publish/test-topic?async=true",
+            json={"message": "this is a test message"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_ACCEPTED)
+        self.assertEqual(
+            response.get_json(),
+            {
+                "message": "Message has been accepted for delivery",
+                "message_id": "some-message-id",
+            },
+        )
+        message_broker_mock.publish_batch.assert_not_called()
+
+        message_broker_mock.submit_message.side_effect = DispatchQueueFullError()
+        response = self.client.post(
+            "/publish/test-topic?async=1",
+            json={"message": "this is a test message"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_SERVICE_UNAVAILABLE)
+
+    @patch("main.message_broker")
+    @patch("main.subscription_manager")
+    def test_publish_batch(self, subscription_manager_mock, message_broker_mock):
+        subscribers = {
+            "orders": ("http://localhost:8000/a", "http://localhost:8000/b"),
+            "payments": ("http://localhost:8000/a",),
+        }
+        subscription_manager_mock.get_subscribers.side_effect = (
+            lambda topic: subscribers.get(topic, ())
+        )
+        message_broker_mock.publish_batch.return_value = [
+            PublishResult(failed_subscribers=[]),
+            PublishResult(
+                failed_subscribers=["http://localhost:8000/b"],
+                queued_subscribers=["http://localhost:8000/a"],
+            ),
+            PublishResult(failed_subscribers=[], rejected=True),
+        ]
+
+        response = self.client.post(
+            "/publish",
+            json=[
+                {"topic": "orders", "message": {"n": 1}},
+                {"topic": "orders", "message": {"n": 2}},
+                {"topic": "payments", "message": {"n": 3}},
+                {"topic": "orders.*", "message": {"n": 4}},
+                {"topic": "unknown", "message": {"n": 5}},
+                {"topic": "orders"},
+            ],
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertEqual(
+            response.get_json()["results"],
+            [
+                {"status": "delivered"},
+                {
+                    "status": "failed",
+                    "failed_subscribers": ["http://localhost:8000/b"],
+                    "queued_subscribers": ["http://localhost:8000/a"],
+                },
+                {"status": "rejected"},
+                {"status": "invalid"},
+                {"status": "no_subscribers"},
+                {"status": "invalid"},
+            ],
+        )
+        # subscribers are resolved once per topic and all valid entries are published in one call
+        self.assertEqual(subscription_manager_mock.get_subscribers.call_count, 3)
+        entries = message_broker_mock.publish_batch.call_args.args[0]
+        self.assertEqual(
+            [(topic, message["n"]) for topic, _, message in entries],
+            [("orders", 1), ("orders", 2), ("payments", 3)],
+        )
+
+        response = self.client.post(
+            "/publish", json={"topic": "orders"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+    @patch("main.message_broker")
+    def test_publish_status(self, message_broker_mock):
+        message_broker_mock.get_delivery_status.return_value = None
+        response = self.client.get("/publish/status/unknown-id")
+        self.assertEqual(response.status_code, http_codes.HTTP_NOT_FOUND)
+
+        status = {"http://localhost:8000/sample": "delivered"}
+        message_broker_mock.get_delivery_status.return_value = status
+        response = self.client.get("/publish/status/some-message-id")
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertEqual(
+            response.get_json(),
+            {"message_id": "some-message-id", "subscribers": status},
+        )
+
+    def test_poll_endpoint(self):
+        subscriber = "http://localhost:8000/polling"
+        for i in range(3):
+            main.message_broker._get_queue(subscriber).append(
+                Envelope(i, "polling", 0, b'{"message": %d}' % i)
+            )
+
+        response = self.client.get(f"/poll/{subscriber}?max=2")
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertEqual(
+            response.get_json(),
+            {
+                "messages": [
+                    {"seq": 1, "message": {"message": 0}},
+                    {"seq": 2, "message": {"message": 1}},
+                ],
+                "count": 2,
+                "next_cursor": 3,
+            },
+        )
+
+        response = self.client.get(f"/poll/{subscriber}")
+        self.assertEqual(response.get_json()["count"], 1)
+        self.assertIsNone(response.get_json()["next_cursor"])
+
+        for max_count in ("0", "abc", "100000", "%C2%B2"):
+            response = self.client.get(f"/poll/{subscriber}?max={max_count}")
+            self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+    def test_poll_endpoint_long_poll(self):
+        subscriber = "http://localhost:8000/long-polling"
+        response = self.client.get(f"/poll/{subscriber}?wait=0.01")
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertEqual(response.get_json()["count"], 0)
+
+        for wait in ("-1", "abc", "3600"):
+            response = self.client.get(f"/poll/{subscriber}?wait={wait}")
+            self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+    def test_stream_endpoint(self):
+        subscriber = "http://localhost:8000/streaming"
+        main.message_broker._get_queue(subscriber).append(
+            Envelope(1, "streaming", 0, b'{"message": "streamed"}')
+        )
+
+        response = self.client.get(f"/stream/{subscriber}", buffered=False)
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertEqual(
+            next(response.response), b'id: 1\ndata: {"message": "streamed"}\n\n'
+        )
+        # the client goes away before the event was written, it stays queued
+        response.close()
+        self.assertEqual(len(main.message_broker._get_queue(subscriber)), 1)
+
+    @patch("main.message_broker")
+    @patch("main.subscription_manager")
+    def test_publish_message_backlog_full(
+        self, subscription_manager_mock, message_broker_mock
+    ):
+        subscription_manager_mock.get_subscribers.return_value = [
+            "http://localhost:8000/sample"
+        ]
+        message_broker_mock.publish_batch.return_value = [
+            PublishResult([], rejected=True)
+        ]
+
+        response = self.client.post(
+            "/publish/test-topic",
+            json={"message": "this is a test message"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_SERVICE_UNAVAILABLE)
+        self.assertEqual(
+            response.get_json(),
+            {"message": "Message backlog is full, please try again later"},
+        )
+
+    @patch("main.message_broker")
+    @patch("main.subscription_manager")
+    def test_publish_message_not_persisted(
+        self, subscription_manager_mock, message_broker_mock
+    ):
+        subscription_manager_mock.get_subscribers.return_value = [
+            "http://localhost:8000/sample"
+        ]
+        message_broker_mock.publish_batch.side_effect = JournalError()
+
+        response = self.client.post(
+            "/publish/test-topic",
+            json={"message": "this is a test message"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_SERVICE_UNAVAILABLE)
+        self.assertEqual(
+            response.get_json(),
+            {"message": "Message could not be persisted, please try again later"},
+        )
+
+    @patch("main.subscription_manager")
+    def test_subscription_not_persisted(self, subscription_manager_mock):
+        subscription_manager_mock.subscribe.side_effect = JournalError()
+        subscription_manager_mock.subscribe_batch.side_effect = JournalError()
+        subscription_manager_mock.unsubscribe.side_effect = JournalError()
+        url = "http://localhost:8000/sample"
+
+        for method, path, body in (
+            (self.client.post, "/subscribe/test-topic", {"url": url}),
+            (self.client.post, "/subscribe", [{"topic": "test-topic", "url": url}]),
+            (self.client.delete, "/subscribe/test-topic", {"url": url}),
+        ):
+            response = method(path, json=body, headers=self.headers)
+            self.assertEqual(response.status_code, http_codes.HTTP_SERVICE_UNAVAILABLE)
+            self.assertIn("could not be persisted", response.get_json()["message"])
+
+    @patch("main.subscription_manager")
+    def test_subscribe_batch(self, subscription_manager_mock):
+        subscription_manager_mock.subscribe_batch.return_value = [True, False]
+        response = self.client.post(
+            "/subscribe",
+            json=[
+                {"topic": "orders.#", "url": "http://localhost:8000/a", "ttl": 60},
+                {"topic": "orders", "url": "http:/localhost:8000/b"},
+                {"topic": "orders.#.eu", "url": "http://localhost:8000/c"},
+                {"topic": "orders", "url": "https://example.com/d", "max_attempts": -1},
+                {"topic": "orders", "url": "https://example.com/e"},
+            ],
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertEqual(
+            [result["status"] for result in response.get_json()["results"]],
+            ["subscribed", "invalid", "invalid", "invalid", "failed"],
+        )
+        subscription_manager_mock.subscribe_batch.assert_called_once_with(
+            [
+                ("orders.#", "http://localhost:8000/a", None, 60),
+                ("orders", "https://example.com/e", None, None),
+            ]
+        )
+
+        response = self.client.post(
+            "/subscribe", json={"topic": "orders"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+    @patch("main.subscription_manager")
+    def test_subscribe_max_attempts(self, subscription_manager_mock):
+        response = self.client.post(
+            "/subscribe/test-topic",
+            json={"url": "http://localhost:8000/retrying", "max_attempts": 3},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_CREATED)
+        subscription_manager_mock.subscribe.assert_called_once_with(
+            topic="test-topic",
+            endpoint="http://localhost:8000/retrying",
+            options=SubscriptionOptions(max_attempts=3),
+            ttl=None,
+        )
+
+        response = self.client.post(
+            "/subscribe/test-topic",
+            json={"url": "http://localhost:8000/retrying", "max_attempts": -1},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+    @patch("main.subscription_manager")
+    def test_subscribe_batched(self, subscription_manager_mock):
+        response = self.client.post(
+            "/subscribe/test-topic",
+            json={
+                "url": "http://localhost:8000/batched",
+                "batch": {"max_size": 50, "max_linger_ms": 200},
+            },
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_CREATED)
+        subscription_manager_mock.subscribe.assert_called_once_with(
+            topic="test-topic",
+            endpoint="http://localhost:8000/batched",
+            options=SubscriptionOptions(batch_max_size=50, batch_max_linger=0.2),
+            ttl=None,
+        )
+
+        response = self.client.post(
+            "/subscribe/test-topic",
+            json={"url": "http://localhost:8000/batched", "batch": {"max_size": 0}},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+        for options in (
+            '"batch": {"max_size": true}',
+            '"batch": {"max_size": 5, "max_linger_ms": 1e308}',
+            '"batch": {"max_size": 5, "max_linger_ms": NaN}',
+            '"batch": {"max_size": 5, "max_linger_ms": true}',
+            '"max_attempts": true',
+        ):
+            response = self.client.post(
+                "/subscribe/test-topic",
+                data=f'{{"url": "http://localhost:8000/batched", {options}}}',
+                headers=self.headers,
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+        subscription_manager_mock.subscribe.assert_called_once()
+
+    @patch("main.subscription_manager")
+    def test_subscribe_accept_encoding(self, subscription_manager_mock):
+        response = self.client.post(
+            "/subscribe/test-topic",
+            json={"url": "http://localhost:8000/gzip", "accept_encoding": "gzip"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_CREATED)
+        subscription_manager_mock.subscribe.assert_called_once_with(
+            topic="test-topic",
+            endpoint="http://localhost:8000/gzip",
+            options=SubscriptionOptions(accept_encoding="gzip"),
+            ttl=None,
+        )
+
+        response = self.client.post(
+            "/subscribe/test-topic",
+            json={"url": "http://localhost:8000/gzip", "accept_encoding": "br"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+    @patch("main.subscription_manager")
+    @patch(
+        "main.publish_rate_limiter", PublishRateLimiter(topic_rate=0.001, topic_burst=1)
+    )
+    def test_publish_rate_limited(self, subscription_manager_mock):
+        subscription_manager_mock.get_subscribers.return_value = ()
+        response = self.client.post(
+            "/publish/limited", json={"message": "first"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_NOT_FOUND)
+
+        response = self.client.post(
+            "/publish/limited", json={"message": "second"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response.headers["Retry-After"]), 0)
+        subscription_manager_mock.get_subscribers.assert_called_once()
+
+        response = self.client.post(
+            "/publish",
+            json=[
+                {"topic": "limited", "message": {"message": "third"}},
+                {"topic": "other", "message": {"message": "fourth"}},
+            ],
+            headers=self.headers,
+        )
+        results = response.get_json()["results"]
+        self.assertEqual(results[0]["status"], "rate_limited")
+        self.assertEqual(results[1]["status"], "no_subscribers")
+
+    @patch(
+        "main.publish_rate_limiter",
+        PublishRateLimiter(publisher_rate=0.001, publisher_burst=2),
+    )
+    def test_publisher_rate_limited(self):
+        response = self.client.post(
+            "/publish",
+            json=[{"topic": "a", "message": {"message": "x"}}] * 3,
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        response = self.client.post(
+            "/publish/a", json={"message": "x"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_TOO_MANY_REQUESTS)
+
+    @patch("main.subscription_manager")
+    @patch(
+        "main.publish_rate_limiter",
+        PublishRateLimiter(publisher_rate=0.001, publisher_burst=2),
+    )
+    def test_invalid_publishes_take_no_tokens(self, subscription_manager_mock):
+        subscription_manager_mock.get_subscribers.return_value = ()
+        response = self.client.post("/publish/a", json={}, headers=self.headers)
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+        response = self.client.post(
+            "/publish/a..b", json={"message": "x"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+        # two valid entries take the whole burst, the invalid ones take nothing
+        response = self.client.post(
+            "/publish",
+            json=[
+                {"topic": "a", "message": {"message": "x"}},
+                {"topic": "a", "message": {}},
+                {"topic": "b", "message": {"message": "x"}},
+                {"topic": "a"},
+            ],
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertEqual(
+            [result["status"] for result in response.get_json()["results"]],
+            ["no_subscribers", "invalid", "no_subscribers", "invalid"],
+        )
+        response = self.client.post(
+            "/publish/a", json={"message": "x"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_TOO_MANY_REQUESTS)
+
+    def test_metrics(self):
+        # gauges read the state of the app created last, other test modules create apps of their own
+        register_state_metrics(main.subscription_manager, main.message_broker)
+        self.client.post(
+            "/subscribe/metrics",
+            json={"url": "http://localhost:8000/metrics"},
+            headers=self.headers,
+        )
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        body = response.data.decode()
+        self.assertIn("# TYPE leafi_publish_seconds histogram", body)
+        self.assertIn('leafi_subscriptions{topic="metrics"} 1', body)
+
+    @patch("main.message_broker")
+    def test_publish_payload_too_large(self, message_broker_mock):
+        with patch.dict(app.config, {"MAX_CONTENT_LENGTH": 100}):
+            response = self.client.post(
+                "/publish/test-topic",
+                json={"message": "x" * 100},
+                headers=self.headers,
+            )
+        self.assertEqual(response.status_code, http_codes.HTTP_PAYLOAD_TOO_LARGE)
+        message_broker_mock.publish_batch.assert_not_called()
+
+    def test_wildcard_topics(self):
+        response = self.client.post(
+            "/subscribe/wildcard.%23",
+            json={"url": "http://localhost:8000/wildcard"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_CREATED)
+        response = self.client.get("/subscribers/wildcard.eu.created")
+        self.assertEqual(response.get_json(), ["http://localhost:8000/wildcard"])
+
+        response = self.client.post(
+            "/subscribe/wildcard.%23.eu",
+            json={"url": "http://localhost:8000/wildcard"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+        response = self.client.post(
+            "/publish/wildcard.*",
+            json={"message": "this is a test message"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+    @patch("main.message_broker")
+    def test_topic_named_batch(self, message_broker_mock):
+        message_broker_mock.publish_batch.return_value = [PublishResult([])]
+        response = self.client.post(
+            "/subscribe/batch",
+            json={"url": "http://localhost:8000/batch-topic"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_CREATED)
+        response = self.client.get("/subscribers/batch")
+        self.assertEqual(response.get_json(), ["http://localhost:8000/batch-topic"])
+
+        response = self.client.post(
+            "/publish/batch", json={"message": "hello"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertEqual(
+            message_broker_mock.publish_batch.call_args.args[0][0][0], "batch"
+        )
+
+    def test_unsubscribe_endpoint(self):
+        subscriber = "http://localhost:8000/leaving"
+        self.client.post(
+            "/subscribe/leaving-topic", json={"url": subscriber}, headers=self.headers
+        )
+
+        response = self.client.delete(
+            "/subscribe/leaving-topic", json={"url": subscriber}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        response = self.client.get("/subscribers/leaving-topic")
+        self.assertEqual(response.status_code, http_codes.HTTP_NOT_FOUND)
+
+        response = self.client.delete(
+            "/subscribe/leaving-topic", json={"url": subscriber}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_NOT_FOUND)
+
+    @patch("main.subscription_manager")
+    def test_subscribe_ttl(self, subscription_manager_mock):
+        response = self.client.post(
+            "/subscribe/test-topic",
+            json={"url": "http://localhost:8000/leased", "ttl": 60},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_CREATED)
+        subscription_manager_mock.subscribe.assert_called_once_with(
+            topic="test-topic",
+            endpoint="http://localhost:8000/leased",
+            options=None,
+            ttl=60,
+        )
+
+        response = self.client.post(
+            "/subscribe/test-topic",
+            json={"url": "http://localhost:8000/leased", "ttl": 0},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+        for ttl in ("1e308", "Infinity", "NaN"):
+            response = self.client.post(
+                "/subscribe/test-topic",
+                data=f'{{"url": "http://localhost:8000/leased", "ttl": {ttl}}}',
+                headers=self.headers,
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+        subscription_manager_mock.subscribe.assert_called_once()
+
+    def test_dead_letters_endpoint(self):
+        subscriber = "http://localhost:8000/dead"
+        response = self.client.get(f"/dead_letters/{subscriber}")
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertEqual(
+            response.get_json(), {"messages": [], "count": 0, "next_cursor": None}
+        )
+
+        response = self.client.get(f"/dead_letters/{subscriber}?max=0")
+        self.assertEqual(response.status_code, http_codes.HTTP_BAD_REQUEST)
+
+    @patch("main.message_broker")
+    @patch("main.subscription_manager")
+    def test_breakers_endpoint(self, subscription_manager_mock, message_broker_mock):
+        subscription_manager_mock.get_subscribers.return_value = []
+        response = self.client.get("/subscribers/test-topic/breakers")
+        self.assertEqual(response.status_code, http_codes.HTTP_NOT_FOUND)
+
+        subscribers = ["http://localhost:8000/sample"]
+        states = {subscribers[0]: {"state": "open", "consecutive_failures": 5}}
+        subscription_manager_mock.get_subscribers.return_value = subscribers
+        message_broker_mock.get_breaker_states.return_value = states
+        response = self.client.get("/subscribers/test-topic/breakers")
+        self.assertEqual(response.status_code, http_codes.HTTP_OK)
+        self.assertEqual(response.get_json(), states)
+        message_broker_mock.get_breaker_states.assert_called_once_with(subscribers)
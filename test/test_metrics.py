@@ -0,0 +1,64 @@
+import unittest
+from threading import Thread
+from utils.metrics import MetricsRegistry
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = MetricsRegistry()
+
+    def test_counter_sums_threads(self):
+        counter = self.registry.counter("requests_total", "Requests", ("route",))
+        counter.inc("/poll")
+
+        def record() -> None:
+            for _ in range(1000):
+                counter.inc("/poll")
+            counter.inc("/publish", amount=2)
+
+        threads = [Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # the values of threads that ended are kept
+        self.assertEqual(counter.collect(), {("/poll",): 4001, ("/publish",): 8})
+        self.assertIs(
+            self.registry.counter("requests_total", "Requests", ("route",)), counter
+        )
+
+        counter.remove("/publish")
+        self.assertEqual(counter.collect(), {("/poll",): 4001})
+
+    def test_histogram(self):
+        histogram = self.registry.histogram(
+            "latency_seconds", "Latency", buckets=(0.1, 1.0)
+        )
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+        self.assertEqual(
+            self.registry.render().splitlines(),
+            [
+                "# HELP latency_seconds Latency",
+                "# TYPE latency_seconds histogram",
+                'latency_seconds_bucket{le="0.1"} 2',
+                'latency_seconds_bucket{le="1.0"} 3',
+                'latency_seconds_bucket{le="+Inf"} 4',
+                "latency_seconds_sum 5.65",
+                "latency_seconds_count 4",
+            ],
+        )
+
+    def test_gauge_and_escaping(self):
+        self.registry.gauge("depth", "Depth", ("queue",), lambda: [(("a",), 1)])
+        # registering again replaces the gauge, so it reads the latest state
+        self.registry.gauge(
+            "depth", "Depth", ("queue",), lambda: [(('say "hi"\\n',), 2)]
+        )
+        self.assertIn('depth{queue="say \\"hi\\"\\\\n"} 2', self.registry.render())
+        self.assertNotIn('depth{queue="a"}', self.registry.render())
+
+
+if __name__ == "__main__":
+    unittest.main()